@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Set
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from storage import touch_users, rollup_activity
+
+log = logging.getLogger(__name__)
+
+
+class ActivityTracker:
+    """
+    Har bir update'dan foydalanuvchi id'sini xotiradagi to'plamga qo'shadi (update
+    uchun yagona xarajat). Fon vazifasi (run) to'plamni har flush_interval soniyada
+    bitta so'rov bilan users.last_seen'ga yozadi — bir oraliqda bir foydalanuvchi
+    bir marta yoziladi. DAU/MAU esa har rollup_interval'da counters'ga hisoblanadi.
+    """
+
+    def __init__(self, tz: str = "Asia/Tashkent"):
+        self.tz = tz
+        self._seen: Set[int] = set()
+        self.counters: Dict[str, int] = {"flushed_users": 0, "flushes": 0}
+
+    async def __call__(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if isinstance(update, Update) and update.effective_user is not None:
+            self._seen.add(update.effective_user.id)
+
+    async def flush(self) -> None:
+        if not self._seen:
+            return
+        batch, self._seen = self._seen, set()
+        try:
+            await asyncio.to_thread(touch_users, list(batch))
+        except Exception:
+            # Keyingi urinishda qayta yoziladi
+            self._seen |= batch
+            raise
+        self.counters["flushed_users"] += len(batch)
+        self.counters["flushes"] += 1
+
+    async def run(self, flush_interval: float = 60, rollup_interval: float = 600) -> None:
+        last_rollup = float("-inf")
+        try:
+            while True:
+                try:
+                    await self.flush()
+                    if time.monotonic() - last_rollup >= rollup_interval:
+                        last_rollup = time.monotonic()
+                        stats = await asyncio.to_thread(rollup_activity, self.tz)
+                        log.info("Faollik: DAU=%s MAU=%s", stats.get("dau"), stats.get("mau"))
+                except Exception:
+                    log.exception("Faollikni yozishda xato")
+                await asyncio.sleep(flush_interval)
+        finally:
+            # To'xtatilganda (post_stop) bufer yo'qolmasin
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Faollik buferini yakuniy yozishda xato")
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counters, pending=len(self._seen))
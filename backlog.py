@@ -0,0 +1,143 @@
+"""
+Ishga tushishdagi backlog: bot o'chiq turgan paytda Telegram'da to'planib qolgan update'lar.
+
+Oddiy ishga tushishda ularning hammasi qaytadan bajariladi — foydalanuvchi allaqachon
+tark etgan xabarlarni tahrirlash, hech kim kutmayotgan audio yuborish va h.k.
+Shu sababli polling/webhook boshlanishidan oldin backlog bir marta tortib olinadi:
+
+  * eskirgan callback query'lar faqat answer() qilinadi (spinner yopiladi);
+  * har bir chatda navigatsiya (render callback'lari, /start) ketma-ketligidan
+    faqat oxirgisi qoladi;
+  * matnli javoblar va amal bajaradigan callbacklar tartibi bilan saqlanadi.
+
+Qolganlari sink'ga (Application.update_queue yoki updates_queue) uzatiladi.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from telegram import Bot, Update
+
+from dispatch import chat_key, is_render_callback
+
+log = logging.getLogger(__name__)
+
+FETCH_LIMIT = 100
+NAV_COMMANDS = frozenset({"/start", "/admin"})
+
+
+def _sent_at(update: Update) -> Optional[float]:
+    """Update yaratilgan vaqt (unix). Callback query'da sana yo'q — None."""
+    if update.callback_query is not None:
+        return None
+    msg = update.message or update.edited_message or update.channel_post or update.edited_channel_post
+    if msg is not None:
+        return (msg.edit_date or msg.date).timestamp()
+    event = update.my_chat_member or update.chat_member or update.chat_join_request
+    if event is not None:
+        return event.date.timestamp()
+    return None
+
+
+def _ages(updates: List[Update], now: float) -> List[Optional[float]]:
+    """
+    Har bir update yoshining quyi chegarasi (soniya).
+    update_id o'sib boradi, demak callback tap undan keyingi sanali update'dan oldin
+    bo'lgan: uning yoshi kamida o'sha update yoshicha. Keyin sanali update bo'lmasa — None.
+    """
+    ages: List[Optional[float]] = [None] * len(updates)
+    later: Optional[float] = None
+    for i in range(len(updates) - 1, -1, -1):
+        sent = _sent_at(updates[i])
+        if sent is not None:
+            later = now - sent
+        ages[i] = later
+    return ages
+
+
+def _is_navigation(update: Update) -> bool:
+    if update.callback_query is not None:
+        return is_render_callback(update.callback_query.data)
+    if update.message is not None and update.message.text:
+        return update.message.text.split("@", 1)[0].strip() in NAV_COMMANDS
+    return False
+
+
+def plan_backlog(updates: List[Update], fresh_seconds: float,
+                 now: Optional[float] = None) -> Tuple[List[Update], List[Update]]:
+    """
+    Backlog'ni ikkiga ajratadi: (qayta bajariladiganlar, faqat answer() qilinadiganlar).
+    Tartib update_id bo'yicha saqlanadi.
+    """
+    now = time.time() if now is None else now
+    ages = _ages(updates, now)
+
+    kept: List[Update] = []
+    answer_only: List[Update] = []
+    for update, age in zip(updates, ages):
+        if update.callback_query is not None and age is not None and age > fresh_seconds:
+            answer_only.append(update)
+        else:
+            kept.append(update)
+
+    last_nav: Dict[Optional[int], int] = {}
+    for update in kept:
+        if _is_navigation(update):
+            last_nav[chat_key(update)] = update.update_id
+
+    replay: List[Update] = []
+    for update in kept:
+        if _is_navigation(update) and last_nav[chat_key(update)] != update.update_id:
+            if update.callback_query is not None:
+                answer_only.append(update)
+            continue
+        replay.append(update)
+    return replay, answer_only
+
+
+async def _answer_quietly(update: Update) -> None:
+    try:
+        await update.callback_query.answer()
+    except Exception:
+        # Juda eski query'ga Telegram "query is too old" qaytaradi — bu kutilgan holat
+        log.debug("Backlog callback'iga javob berib bo'lmadi", exc_info=True)
+
+
+async def drain_backlog(bot: Bot, sink: Callable[[Update], Awaitable[None]],
+                        fresh_seconds: float) -> Dict[str, float]:
+    """
+    Kutib turgan update'larni tortib oladi, Telegram'da tasdiqlaydi va saralangan
+    qismini sink'ga uzatadi. Webhook o'rnatilgan bo'lsa u o'chiriladi (pending saqlanadi) —
+    chaqiruvchi uni qayta o'rnatishi kerak.
+    """
+    started = time.monotonic()
+    await bot.delete_webhook()
+
+    updates: List[Update] = []
+    offset = None
+    while True:
+        # offset bilan keyingi chaqiruv oldingi partiyani Telegram tomonda tasdiqlaydi
+        batch = await bot.get_updates(offset=offset, timeout=0, limit=FETCH_LIMIT,
+                                      allowed_updates=Update.ALL_TYPES)
+        if not batch:
+            break
+        updates.extend(batch)
+        offset = batch[-1].update_id + 1
+
+    replay, answer_only = plan_backlog(updates, fresh_seconds)
+    await asyncio.gather(*(_answer_quietly(u) for u in answer_only))
+    for update in replay:
+        await sink(update)
+
+    stats = {
+        "fetched": len(updates),
+        "replayed": len(replay),
+        "answered_only": len(answer_only),
+        "dropped": len(updates) - len(replay) - len(answer_only),
+        "seconds": round(time.monotonic() - started, 3),
+    }
+    if updates:
+        log.info("Backlog: %(fetched)d ta update, %(replayed)d tasi bajariladi, "
+                 "%(answered_only)d tasiga faqat javob berildi (%(seconds)ss)", stats)
+    return stats
@@ -11,3 +11,60 @@ if not BOT_TOKEN:
 ADMINS = [int(s) for s in os.getenv("ADMINS", "").split(",") if s.strip()]
 DEV_USERNAME = os.getenv("DEV_USERNAME")
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME")
+
+# Ishga tushirish rejimi: "polling" (standart) yoki "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT") or os.getenv("PORT") or 8443)
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Ochiq URL (https://.../telegram). Bo'sh bo'lsa setWebhook chaqirilmaydi — lokal test uchun.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+
+# Ko'p jarayonli rejim (BOT_MODE=receiver / BOT_MODE=worker)
+RECEIVER_SOURCE = os.getenv("RECEIVER_SOURCE", "webhook").strip().lower()  # webhook | polling
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+# >0 bo'lsa, worker faqat |chat_id| % WORKER_PARTITIONS == WORKER_INDEX chatlarni oladi
+WORKER_PARTITIONS = int(os.getenv("WORKER_PARTITIONS", "0"))
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+
+# Secret'siz webhook'ga har kim soxta update (masalan, admin nomidan) yubora oladi
+if (BOT_MODE == "webhook" or (BOT_MODE == "receiver" and RECEIVER_SOURCE != "polling")) and not WEBHOOK_SECRET:
+    raise ValueError("WEBHOOK_SECRET not found in .env file (required in webhook mode)!")
+
+# Bir vaqtda bajariladigan update'lar soni (bitta chat ichida baribir ketma-ket)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+
+# Suhbat/wizard holatlari: DB'ga yozish oralig'i (s) va tashlab ketilganlarini o'chirish muddati (soat)
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "5"))
+STATE_TTL_HOURS = int(os.getenv("STATE_TTL_HOURS", "24"))
+
+# Ishga tushishda to'planib qolgan update'larni saralash (backlog.py).
+# Shundan eski callback tap'lari bajarilmaydi, faqat javob beriladi (s).
+BACKLOG_DRAIN = os.getenv("BACKLOG_DRAIN", "1").strip().lower() not in ("0", "false", "no")
+BACKLOG_FRESH_SECONDS = float(os.getenv("BACKLOG_FRESH_SECONDS", "30"))
+
+# Foydalanuvchi bo'yicha flood nazorati: soniyasiga update'lar va ketma-ket ruxsat etilgan "portlash"
+FLOOD_RATE = float(os.getenv("FLOOD_RATE", "1"))
+FLOOD_BURST = float(os.getenv("FLOOD_BURST", "8"))
+
+# Faollik (DAU/MAU): last_seen DB'ga yozish oralig'i, hisoblash oralig'i (s) va "kun" chegarasi vaqt zonasi
+ACTIVITY_FLUSH_SECONDS = float(os.getenv("ACTIVITY_FLUSH_SECONDS", "60"))
+ACTIVITY_ROLLUP_SECONDS = float(os.getenv("ACTIVITY_ROLLUP_SECONDS", "600"))
+ACTIVITY_TZ = os.getenv("ACTIVITY_TZ", "Asia/Tashkent")
+
+# Tinglash joyi ("▶️ Davom ettirish"): xotiradagi buferni DB'ga yozish oralig'i (s)
+PROGRESS_FLUSH_SECONDS = float(os.getenv("PROGRESS_FLUSH_SECONDS", "30"))
+
+# Trend va mashhurlar ro'yxatlarini fonda qayta hisoblash oralig'i (s)
+DISCOVERY_REFRESH_SECONDS = float(os.getenv("DISCOVERY_REFRESH_SECONDS", "900"))
+
+# Xotiradagi janr indeksini DB'dan qayta yuklash oralig'i (s) — boshqa replika/worker o'zgarishlari uchun
+GENRE_INDEX_REFRESH_SECONDS = float(os.getenv("GENRE_INDEX_REFRESH_SECONDS", "300"))
+
+# book_summary: katalog o'zgarganini tekshirish oralig'i va o'zgarmasa ham qayta hisoblash oralig'i (s)
+SUMMARY_CHECK_SECONDS = float(os.getenv("SUMMARY_CHECK_SECONDS", "10"))
+SUMMARY_MAX_AGE_SECONDS = float(os.getenv("SUMMARY_MAX_AGE_SECONDS", "900"))
+
+# Jarayon ko'rsatkichlarini (metrics.py) logga yozish oralig'i (s); 0 — o'chiq
+METRICS_LOG_SECONDS = float(os.getenv("METRICS_LOG_SECONDS", "300"))
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from config import ACTIVITY_TZ, DISCOVERY_REFRESH_SECONDS
+from hll import HyperLogLog
+from storage import (
+    get_book_stats_page, get_top_books_per_genre, load_recent_listener_sketches,
+    replace_discovery_lists, load_discovery_lists,
+)
+
+log = logging.getLogger(__name__)
+
+TOP_N = 10
+TREND_DAYS = 7
+TREND_MIN_LISTENERS = 3
+TREND_SMOOTHING = 5  # yangi kitob 0 → 3 tinglovchi bilan cheksiz "o'sish" olmasin
+
+
+def compute_trending(rows: List[Dict], today, limit: int = TOP_N) -> List[Tuple[str, float]]:
+    """
+    Kitob sketch'laridan (listener_sketches) trend: oxirgi 7 kundagi noyob
+    tinglovchilarning undan oldingi 7 kunga nisbatan o'sishi.
+    """
+    recent: Dict[str, HyperLogLog] = {}
+    previous: Dict[str, HyperLogLog] = {}
+    boundary = today - timedelta(days=TREND_DAYS - 1)
+    for r in rows:
+        target = recent if r["day"] >= boundary else previous
+        target.setdefault(r["key"], HyperLogLog()).merge(HyperLogLog.from_bytes(r["registers"]))
+
+    scored = []
+    for book_id, sketch in recent.items():
+        now = sketch.estimate()
+        if now < TREND_MIN_LISTENERS:
+            continue
+        before = previous[book_id].estimate() if book_id in previous else 0
+        scored.append((book_id, (now - before) / (before + TREND_SMOOTHING)))
+    scored.sort(key=lambda item: (-item[1], item[0]))
+    return scored[:limit]
+
+
+class Discovery:
+    """
+    "🔥 Trenddagilar", "⭐ Eng mashhurlar" va janrlar bo'yicha eng mashhurlar —
+    fonda hisoblanadi (run), ekranlar faqat xotiradagi tayyor ro'yxatni o'qiydi.
+
+    Natija discovery_lists jadvalida ham saqlanadi: qayta ishga tushganda yoki
+    boshqa replika allaqachon yangilagan bo'lsa, qayta hisoblanmaydi — faqat o'qiladi.
+    """
+
+    def __init__(self, tz: str = "Asia/Tashkent", refresh_interval: float = 900):
+        self.tz = ZoneInfo(tz)
+        self.refresh_interval = refresh_interval
+        self._lists: Dict[Tuple[str, str], List[Dict]] = {}
+        self.refreshed_at: Optional[datetime] = None
+
+    def get(self, list_name: str, key: str = "") -> List[Dict]:
+        return self._lists.get((list_name, str(key)), [])
+
+    def _compute(self) -> List[Tuple[str, str, str, float]]:
+        rows = [("popular", "", r["id"], float(r["count"])) for r in get_book_stats_page(0, TOP_N)[:TOP_N]]
+        rows += [
+            ("genre", str(r["genre_id"]), r["book_id"], float(r["count"]))
+            for r in get_top_books_per_genre(TOP_N)
+        ]
+        today = datetime.now(self.tz).date()
+        sketches = load_recent_listener_sketches("book", today - timedelta(days=2 * TREND_DAYS - 1))
+        rows += [("trending", "", book_id, score) for book_id, score in compute_trending(sketches, today)]
+        return rows
+
+    def _load(self, rows: List[Dict]) -> None:
+        lists: Dict[Tuple[str, str], List[Dict]] = {}
+        for r in rows:
+            lists.setdefault((r["list"], r["key"]), []).append(r)
+        self._lists = lists
+        self.refreshed_at = max((r["refreshed_at"] for r in rows), default=None)
+
+    def _is_fresh(self, rows: List[Dict]) -> bool:
+        if not rows:
+            return False
+        age = datetime.now(timezone.utc) - max(r["refreshed_at"] for r in rows)
+        return age.total_seconds() < self.refresh_interval
+
+    def refresh(self, force: bool = False) -> None:
+        """Sinxron (thread'da chaqiriladi): jadval yangi bo'lsa o'qiydi, aks holda qayta hisoblaydi."""
+        rows = load_discovery_lists()
+        if force or not self._is_fresh(rows):
+            replace_discovery_lists(self._compute())
+            rows = load_discovery_lists()
+        self._load(rows)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+                log.info("Discovery ro'yxatlari yangilandi: %d ta ro'yxat", len(self._lists))
+            except Exception:
+                log.exception("Discovery ro'yxatlarini yangilashda xato")
+            await asyncio.sleep(self.refresh_interval)
+
+
+discovery = Discovery(ACTIVITY_TZ, DISCOVERY_REFRESH_SECONDS)
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Dict, Hashable, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+log = logging.getLogger(__name__)
+
+# Faqat sof "render" qiladigan callbacklar (qayta chizish idempotent).
+# part_, toggle_*, confirm_* kabi amal bajaradiganlari hech qachon tashlab yuborilmaydi.
+COALESCE_EXACT = frozenset({
+    "home", "books", "genres", "stats", "admin_panel", "admin_contact", "trending", "popular",
+})
+COALESCE_PREFIXES = (
+    "book:", "genre:", "fb:", "statbooks:", "gtop:", "gf:", "gfr:", "book_", "genre_", "stat_",
+)
+
+
+def is_render_callback(data: Optional[str]) -> bool:
+    if not data:
+        return False
+    return data in COALESCE_EXACT or data.startswith(COALESCE_PREFIXES)
+
+
+class EditCoalescer:
+    """
+    Bitta xabarga qisqa oraliqda kelgan bir nechta tap'dan faqat oxirgisi bajariladi.
+    Kelish vaqtida (navbatga tushganda) oxirgi update_id yoziladi; navbati kelganda
+    undan yangiroq tap allaqachon kelgan bo'lsa, eskisi faqat answer() qilinadi.
+    """
+
+    def __init__(self, window: float = 0.5):
+        self.window = window
+        # (chat_id, message_id) -> (oxirgi update_id, kelgan vaqti)
+        self._latest: Dict[Hashable, Tuple[int, float]] = {}
+        self.counters: Dict[str, int] = {"seen": 0, "coalesced": 0}
+
+    @staticmethod
+    def _key(update: Update) -> Optional[Hashable]:
+        query = update.callback_query
+        if query is None or not is_render_callback(query.data):
+            return None
+        if query.message is not None:
+            return query.message.chat.id, query.message.message_id
+        return query.inline_message_id
+
+    def note_arrival(self, update: Update) -> None:
+        key = self._key(update)
+        if key is None:
+            return
+        self.counters["seen"] += 1
+        self._latest[key] = (update.update_id, time.monotonic())
+
+    def is_superseded(self, update: Update) -> bool:
+        key = self._key(update)
+        if key is None:
+            return False
+        latest = self._latest.get(key)
+        if latest is None or latest[0] == update.update_id:
+            self._latest.pop(key, None)
+            return False
+        # Yangi tap oynadan tashqarida kelgan bo'lsa ham, eskisini bajaramiz
+        return latest[0] > update.update_id and (time.monotonic() - latest[1]) <= self.window
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counters, pending_keys=len(self._latest))
+
+
+class _ChatLane:
+    __slots__ = ("lock", "pending")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+
+def chat_key(update: object) -> Optional[int]:
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Turli chatlarning update'lari parallel, bitta chatniki esa qat'iy ketma-ket
+    bajariladi — ConversationHandler bosqichlari aralashib ketmaydi.
+    Chat navbatida kutayotganlar umumiy limit (max_concurrent) slotini band qilmaydi.
+    Navbat boshiga chiqqan render tap'idan yangisi kelgan bo'lsa, u faqat answer() qilinadi.
+    """
+
+    def __init__(self, max_concurrent: int = 32, coalescer: Optional[EditCoalescer] = None):
+        super().__init__(max_concurrent_updates=max_concurrent)
+        self.coalescer = coalescer or EditCoalescer()
+        self._lanes: Dict[int, _ChatLane] = {}
+        self.counters: Dict[str, int] = {"processed": 0, "queued_behind_chat": 0, "max_chat_depth": 0}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def process_update(self, update: object, coroutine: Awaitable) -> None:
+        if isinstance(update, Update):
+            self.coalescer.note_arrival(update)
+        key = chat_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _ChatLane()
+        lane.pending += 1
+        if lane.pending > 1:
+            self.counters["queued_behind_chat"] += 1
+            self.counters["max_chat_depth"] = max(self.counters["max_chat_depth"], lane.pending)
+        try:
+            # Avval chat navbati, keyin umumiy semafor (super().process_update)
+            async with lane.lock:
+                await super().process_update(update, coroutine)
+        finally:
+            lane.pending -= 1
+            if lane.pending == 0:
+                self._lanes.pop(key, None)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        if isinstance(update, Update) and self.coalescer.is_superseded(update):
+            self.coalescer.counters["coalesced"] += 1
+            coroutine.close()
+            try:
+                await update.callback_query.answer()
+            except Exception:
+                log.debug("Eskirgan callback'ga javob berib bo'lmadi", exc_info=True)
+            return
+        self.counters["processed"] += 1
+        await coroutine
+
+    def chat_depths(self, top: int = 10) -> List[Tuple[int, int]]:
+        """Eng uzun chat navbatlari: [(chat_id, kutayotganlar soni), ...]."""
+        depths = sorted(((k, l.pending) for k, l in self._lanes.items()), key=lambda x: x[1], reverse=True)
+        return depths[:top]
+
+    def stats(self) -> Dict[str, object]:
+        return dict(
+            self.counters,
+            running=self.current_concurrent_updates,
+            limit=self.max_concurrent_updates,
+            active_chats=len(self._lanes),
+            pending=sum(l.pending for l in self._lanes.values()),
+            coalesced=self.coalescer.counters["coalesced"],
+            deepest=self.chat_depths(3),
+        )
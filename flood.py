@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional, Set
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+log = logging.getLogger(__name__)
+
+# Bucket: [tokens, updated, warned] — object emas, ro'yxat (xotirada ixcham)
+_TOKENS, _UPDATED, _WARNED = 0, 1, 2
+
+
+class FloodControl:
+    """
+    Foydalanuvchi bo'yicha token bucket. main'da group -1 TypeHandler sifatida
+    barcha handlerlardan oldin ishlaydi. Limitdan oshgan update DB'ga tegmasdan
+    to'xtatiladi (ApplicationHandlerStop). Har cheklangan callback'ga javob beriladi
+    (aks holda tugma "yuklanmoqda" holatida qoladi), ogohlantirish matni esa har
+    "portlash"da faqat birinchisiga.
+
+    Bucketlar LRU tartibidagi OrderedDict'da; max_users dan oshsa eng uzoq
+    faol bo'lmaganlari tashlanadi (ular baribir to'la bo'lgan bo'ladi).
+    Adminlar (load_exempt) limitlanmaydi: ro'yxat fonda har exempt_ttl soniyada yangilanadi.
+    """
+
+    def __init__(
+        self,
+        rate: float = 1.0,
+        burst: float = 8,
+        max_users: int = 20000,
+        load_exempt: Optional[Callable[[], Iterable[int]]] = None,
+        exempt_ttl: float = 300,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self._buckets: "OrderedDict[int, list]" = OrderedDict()
+        self._load_exempt = load_exempt
+        self._exempt_ttl = exempt_ttl
+        self._exempt: Set[int] = set()
+        self._exempt_at = float("-inf")
+        self._exempt_task: Optional[asyncio.Task] = None
+        self.counters: Dict[str, int] = {"checked": 0, "throttled": 0, "warned": 0, "evicted": 0}
+
+    def allow(self, user_id: int, now: float) -> bool:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = [self.burst, now, False]
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+                self.counters["evicted"] += 1
+        else:
+            self._buckets.move_to_end(user_id)
+            bucket[_TOKENS] = min(self.burst, bucket[_TOKENS] + (now - bucket[_UPDATED]) * self.rate)
+            bucket[_UPDATED] = now
+        if bucket[_TOKENS] >= 1:
+            bucket[_TOKENS] -= 1
+            bucket[_WARNED] = False
+            return True
+        return False
+
+    def _refresh_exempt(self, now: float) -> None:
+        if self._load_exempt is None or now - self._exempt_at < self._exempt_ttl:
+            return
+        if self._exempt_task is not None and not self._exempt_task.done():
+            return
+        self._exempt_at = now
+
+        async def load():
+            try:
+                self._exempt = set(await asyncio.to_thread(self._load_exempt))
+            except Exception:
+                log.warning("Flood: adminlar ro'yxatini yangilab bo'lmadi", exc_info=True)
+
+        self._exempt_task = asyncio.create_task(load())
+
+    async def __call__(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if not isinstance(update, Update) or update.effective_user is None:
+            return
+        user_id = update.effective_user.id
+        now = time.monotonic()
+        self.counters["checked"] += 1
+        self._refresh_exempt(now)
+        if user_id in self._exempt or self.allow(user_id, now):
+            return
+
+        self.counters["throttled"] += 1
+        bucket = self._buckets[user_id]
+        text = None
+        if not bucket[_WARNED]:
+            bucket[_WARNED] = True
+            self.counters["warned"] += 1
+            text = "⏳ Juda tez! Biroz kuting."
+            log.info("Flood: %s cheklandi (jami cheklangan update'lar: %d)", user_id, self.counters["throttled"])
+        if update.callback_query is not None:
+            # Javobsiz callback tugmada "soat"ni qoldiradi: har biriga javob, matn faqat birinchisiga
+            try:
+                await update.callback_query.answer(text)
+            except TelegramError:
+                pass
+        raise ApplicationHandlerStop
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counters, tracked_users=len(self._buckets), exempt=len(self._exempt))
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+log = logging.getLogger(__name__)
+
+# Raqamsiz id'li kitoblar (sort_key NULL) DB'dagi kabi oxirida turadi
+_NULLS_LAST = float("inf")
+
+
+class GenreIndex:
+    """
+    Janr ↔ kitob teskari indeksi xotirada: janr → kitob id'lari to'plami,
+    kitob → janrlar, hamda kitob nomlari va janr nomlari. Janrlar bo'yicha
+    ko'rish va bir nechta janrni birlashtirish (kesishma) DB'siz bajariladi.
+
+    storage.py'dagi yozuvchi funksiyalar (set_book_genres, link_book_genre,
+    delete_genre, kitob qo'shish/o'chirish/nomini o'zgartirish) muvaffaqiyatli
+    yozuvdan keyin indeksni o'zi yangilaydi. Boshqa jarayonlar (replika, worker)
+    o'zgarishlari esa run() orqali davriy qayta yuklash bilan yetib keladi.
+
+    Storage funksiyalari thread'larda ishlaydi, shuning uchun barcha o'zgarishlar
+    qulf ostida; o'qishlar tayyor nusxa qaytaradi.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._books: Dict[str, Tuple[Union[int, float], str]] = {}   # id -> (sort_key, nomi)
+        self._genres: Dict[int, str] = {}              # id -> nomi
+        self._by_genre: Dict[int, Set[str]] = {}
+        self._by_book: Dict[str, Set[int]] = {}
+        self.ready = False
+        # Har o'zgarishda oshadi: yuklash davomida kelgan yozuv eski snapshot bilan yo'qolmasin
+        self.generation = 0
+
+    # ---------- To'liq yuklash ----------
+
+    def load(self, books: Iterable[Dict], genres: Iterable[Dict], links: Iterable[Dict],
+             generation: Optional[int] = None) -> bool:
+        """Snapshot'ni o'rnatadi; `generation` dan beri o'zgarish bo'lgan bo'lsa, tashlab yuboradi."""
+        new_books = {
+            b["id"]: (b["sort_key"] if b["sort_key"] is not None else _NULLS_LAST, b["nomi"]) for b in books
+        }
+        new_genres = {g["id"]: g["nomi"] for g in genres}
+        by_genre: Dict[int, Set[str]] = {gid: set() for gid in new_genres}
+        by_book: Dict[str, Set[int]] = {}
+        for link in links:
+            by_genre.setdefault(link["genre_id"], set()).add(link["book_id"])
+            by_book.setdefault(link["book_id"], set()).add(link["genre_id"])
+        with self._lock:
+            if generation is not None and self.ready and generation != self.generation:
+                return False
+            self._books, self._genres = new_books, new_genres
+            self._by_genre, self._by_book = by_genre, by_book
+            self.ready = True
+            return True
+
+    # ---------- storage.py'dan keladigan o'zgarishlar ----------
+
+    def _changed(self) -> None:
+        self.generation += 1
+
+    def book_added(self, book_id: str, nomi: str, sort_key: Optional[int]) -> None:
+        with self._lock:
+            self._changed()
+            self._books[book_id] = (sort_key if sort_key is not None else _NULLS_LAST, nomi)
+
+    def book_renamed(self, book_id: str, nomi: str) -> None:
+        with self._lock:
+            self._changed()
+            if book_id in self._books:
+                self._books[book_id] = (self._books[book_id][0], nomi)
+
+    def book_deleted(self, book_id: str) -> None:
+        with self._lock:
+            self._changed()
+            self._books.pop(book_id, None)
+            for gid in self._by_book.pop(book_id, ()):
+                self._by_genre.get(gid, set()).discard(book_id)
+
+    def genre_added(self, genre_id: int, nomi: str) -> None:
+        with self._lock:
+            self._changed()
+            self._genres[genre_id] = nomi
+            self._by_genre.setdefault(genre_id, set())
+
+    def genre_deleted(self, genre_id: int) -> None:
+        with self._lock:
+            self._changed()
+            self._genres.pop(genre_id, None)
+            for book_id in self._by_genre.pop(genre_id, ()):
+                self._by_book.get(book_id, set()).discard(genre_id)
+
+    def genre_linked(self, book_id: str, genre_id: int) -> None:
+        with self._lock:
+            self._changed()
+            self._by_genre.setdefault(genre_id, set()).add(book_id)
+            self._by_book.setdefault(book_id, set()).add(genre_id)
+
+    def links_changed(self, added: Iterable[Tuple[str, int]], removed: Iterable[Tuple[str, int]]) -> None:
+        """storage.set_genres_for_books qaytargan farq (qo'shilgan / olib tashlangan bog'lanishlar)."""
+        with self._lock:
+            self._changed()
+            for book_id, gid in removed:
+                self._by_genre.get(gid, set()).discard(book_id)
+                books = self._by_book.get(book_id)
+                if books is not None:
+                    books.discard(gid)
+                    if not books:
+                        del self._by_book[book_id]
+            for book_id, gid in added:
+                self._by_genre.setdefault(gid, set()).add(book_id)
+                self._by_book.setdefault(book_id, set()).add(gid)
+
+    def genres_set(self, book_id: str, genre_ids: Iterable[int]) -> None:
+        with self._lock:
+            self._changed()
+            new = set(genre_ids)
+            for gid in self._by_book.get(book_id, set()) - new:
+                self._by_genre.get(gid, set()).discard(book_id)
+            for gid in new:
+                self._by_genre.setdefault(gid, set()).add(book_id)
+            if new:
+                self._by_book[book_id] = new
+            else:
+                self._by_book.pop(book_id, None)
+
+    # ---------- O'qish ----------
+
+    def genres(self) -> List[Dict]:
+        """Barcha janrlar nomi bo'yicha (storage.get_genres kabi)."""
+        with self._lock:
+            items = list(self._genres.items())
+        return [{"id": gid, "nomi": nomi} for gid, nomi in sorted(items, key=lambda g: (g[1], g[0]))]
+
+    def books(self) -> List[Dict]:
+        """Barcha kitoblar sort_key, id tartibida (storage.get_books kabi, faqat id va nomi)."""
+        with self._lock:
+            rows = sorted((key, book_id, nomi) for book_id, (key, nomi) in self._books.items())
+        return [{"id": book_id, "nomi": nomi} for _, book_id, nomi in rows]
+
+    def genre_name(self, genre_id: int) -> Optional[str]:
+        return self._genres.get(genre_id)
+
+    def _matching(self, genre_ids: Iterable[int]) -> Set[str]:
+        # Eng kichik to'plamdan boshlab kesishadi: natija hech qachon undan katta bo'lmaydi
+        postings = sorted((self._by_genre.get(gid, set()) for gid in set(genre_ids)), key=len)
+        if not postings:
+            return set()
+        result = set(postings[0])
+        for p in postings[1:]:
+            result &= p
+            if not result:
+                break
+        return result
+
+    def books_with_genres(self, genre_ids: Iterable[int]) -> List[Dict]:
+        """Tanlangan janrlarning hammasiga kiruvchi kitoblar, sort_key, id tartibida."""
+        with self._lock:
+            ids = self._matching(genre_ids)
+            rows = [(self._books[b][0], b, self._books[b][1]) for b in ids if b in self._books]
+        rows.sort()
+        return [{"id": book_id, "nomi": nomi} for _, book_id, nomi in rows]
+
+    def refine_counts(self, genre_ids: Iterable[int]) -> Dict[int, int]:
+        """Har bir boshqa janr qo'shilsa, nechta kitob qoladi (filtr tugmalari uchun)."""
+        selected = set(genre_ids)
+        with self._lock:
+            base = self._matching(selected) if selected else None
+            return {
+                gid: len(books if base is None else base & books)
+                for gid, books in self._by_genre.items() if gid not in selected
+            }
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "books": len(self._books), "genres": len(self._genres),
+            "links": sum(len(s) for s in self._by_book.values()), "generation": self.generation,
+        }
+
+    # ---------- Fon yangilanishi ----------
+
+    async def run(self, load: Callable[[], object], interval: float = 300) -> None:
+        """Boshqa jarayonlardagi o'zgarishlar uchun davriy qayta yuklash (storage.load_genre_index)."""
+        while True:
+            try:
+                await asyncio.to_thread(load)
+            except Exception:
+                log.exception("Janr indeksini yuklashda xato")
+            await asyncio.sleep(interval)
+
+
+genre_index = GenreIndex()
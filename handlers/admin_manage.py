@@ -1,8 +1,9 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler, MessageHandler, CallbackQueryHandler, filters
 from utils import load_admins, save_admins, BACK_HOME_KB, safe_edit_message
+from router import cb
 
-ASK_NEW_ADMIN_ID = range(1)
+ASK_NEW_ADMIN_ID = 900  # int: persistence holatni JSON'da saqlaydi
 
 
 # 👤 Adminlarni boshqarish menyusi
@@ -62,7 +63,7 @@ async def delete_admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     for uid, data in admins.items():
         if uid != user_id:  # o‘zini o‘chira olmaydi
             keyboard.append([
-                InlineKeyboardButton(f"{data['name']} ({uid})", callback_data=f"remove_admin_{uid}")
+                InlineKeyboardButton(f"{data['name']} ({uid})", callback_data=cb("remove_admin", uid))
             ])
 
     keyboard.append([InlineKeyboardButton("🔙 Ortga", callback_data="admin_manage_admins")])
@@ -82,7 +83,7 @@ async def delete_admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def remove_admin_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    admin_id = query.data.replace("remove_admin_", "")
+    admin_id = context.args[0]
     admins = load_admins()
 
     if admin_id not in admins:
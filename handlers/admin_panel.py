@@ -1,6 +1,9 @@
+from html import escape
+
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from utils import is_admin, safe_edit_message
+from utils import is_admin, safe_edit_message, BACK_HOME_KB
+import metrics
 
 
 # ✅ Admin panelga kirish
@@ -27,11 +30,13 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("➖Qismni o‘chirish", callback_data="admin_delete_part")],
         [InlineKeyboardButton("🏷 Janrlarni boshqarish", callback_data="admin_manage_genres")],
         [InlineKeyboardButton("✒️ Kitobga janr belgilash", callback_data="admin_assign_genres")],
+        [InlineKeyboardButton("🗂 Janrni ko‘p kitobga belgilash", callback_data="admin_bulk_genres")],
         [InlineKeyboardButton("✏️ Kitob nomini tahrirlash", callback_data="admin_rename_book")],
         [InlineKeyboardButton("📚 Kitoblar ro‘yxati", callback_data="admin_list_books")],
         [InlineKeyboardButton("📬 Xabar yuborish", callback_data="admin_broadcast")],
-        [InlineKeyboardButton("💬 Oxirgi 10 ta fikr", callback_data="admin_view_feedback")],
+        [InlineKeyboardButton("💬 Fikrlar qutisi", callback_data="admin_view_feedback")],
         [InlineKeyboardButton("👤 Adminlarni boshqarish", callback_data="admin_manage_admins")],
+        [InlineKeyboardButton("🩺 Tizim ko‘rsatkichlari", callback_data="admin_metrics")],
         [InlineKeyboardButton("🏠 Asosiy menyu", callback_data="home")],
     ]
 
@@ -41,3 +46,17 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="HTML")
 
+
+# 🩺 Shu jarayonning ko'rsatkichlari (metrics.py): rate limiter, navbatlar, buferlar...
+async def show_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    if not is_admin(update.effective_user.id):
+        await safe_edit_message(query.message, "⛔ Sizda bu bo‘limga kirish huquqi yo‘q.")
+        return
+
+    lines = ["🩺 <b>Tizim ko‘rsatkichlari</b> (shu jarayon)\n"]
+    for name, values in metrics.snapshot().items():
+        pairs = ", ".join(f"{escape(str(k))}={escape(str(v))}" for k, v in values.items())
+        lines.append(f"<b>{escape(name)}</b>: {pairs}")
+    await safe_edit_message(query.message, "\n".join(lines), BACK_HOME_KB)
@@ -1,12 +1,14 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
+import asyncio
 import re
 
 from storage import (
-    get_books, add_book, get_parts, add_part, delete_part_by_index,
-    delete_book, get_genres, set_book_genres, get_next_book_id
+    get_books, get_parts, add_part, delete_part_by_index,
+    delete_book, get_genres, create_book, catalog_work
 )
 from utils import safe_edit_message
+from router import cb
 
 TELEGRAM_LINK_PATTERN = re.compile(r"^https://t\.me/[\w\d_]+/\d+$")
 
@@ -16,9 +18,10 @@ ADD_PART_SELECT_BOOK, ADD_PART_URL = range(100, 102)
 DELETE_PART_SELECT_BOOK, DELETE_PART_SELECT, CONFIRM_DELETE_PART = range(200, 203)
 ASK_BOOK_DELETE, CONFIRM_BOOK_DELETE = range(300, 302)
 
-# Temp storage
-TEMP_BOOK = {}  # user_id -> {'title':..., 'genres': set([...]), 'book_id': '...'}
-TEMP_ADD_PART = {}
+# Wizard holati context.user_data'da saqlanadi (PostgresPersistence orqali DB'da, TTL bilan):
+#   "new_book": {'title':..., 'genres': [...], 'parts': [url, ...]}
+#   (kitob "✅ Tugatdim" bosilganda bitta tranzaksiyada yoziladi — yarim kitob qolmaydi)
+#   "add_part_book_id": '...'
 
 
 # ==================== KITOB QO‘SHISH ====================
@@ -40,7 +43,7 @@ async def ask_book_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def receive_book_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     title = (update.message.text or "").strip()
-    TEMP_BOOK[update.effective_user.id] = {"title": title, "genres": set()}
+    context.user_data["new_book"] = {"title": title, "genres": [], "parts": []}
     # Janrlar ro'yxatini chiqaramiz (multi-select)
     genres = get_genres()
     if not genres:
@@ -79,8 +82,7 @@ async def receive_book_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def toggle_select_genre(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    user_id = query.from_user.id
-    data = TEMP_BOOK.get(user_id)
+    data = context.user_data.get("new_book")
     if not data:
         await safe_edit_message(query.message, "❌ Holat topilmadi.")
         return ConversationHandler.END
@@ -89,7 +91,7 @@ async def toggle_select_genre(update: Update, context: ContextTypes.DEFAULT_TYPE
     if gid in data["genres"]:
         data["genres"].remove(gid)
     else:
-        data["genres"].add(gid)
+        data["genres"].append(gid)
 
     # Qayta chizamiz
     genres = get_genres()
@@ -131,7 +133,18 @@ async def genres_done_then_parts(update: Update, context: ContextTypes.DEFAULT_T
 
 
 async def receive_book_part(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
+    # Tashlab ketilgan wizard holati tozalangan bo'lishi mumkin (persistence.evict_stale_state_loop)
+    data = context.user_data.get("new_book")
+    if data is None:
+        await update.message.reply_text(
+            "❌ Holat topilmadi: kitob qo‘shish muddati o‘tgan. Qaytadan boshlang.",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("➕ Kitob qo‘shish", callback_data="admin_add_book")],
+                [InlineKeyboardButton("🏠 Admin panel", callback_data="admin_panel")],
+            ])
+        )
+        return ConversationHandler.END
+
     text = (update.message.text or "").strip()
     keyboard = [
         [InlineKeyboardButton("✅ Tugatdim", callback_data="finish_add_book")],
@@ -146,39 +159,62 @@ async def receive_book_part(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return ADD_BOOK_PARTS
 
-    # DBga yozish: agar hali kitob yaratilmagan bo'lsa, avval uni yaratamiz
-    data = TEMP_BOOK.get(user_id)
-    if "book_id" not in data:
-        book_id = get_next_book_id()
-        add_book(book_id, data["title"])
-        # janr bog'lash
-        if data["genres"]:
-            set_book_genres(book_id, list(data["genres"]))
-        data["book_id"] = book_id
-
-    book_id = data["book_id"]
-    # navbatdagi qism nomi
-    parts = get_parts(book_id)
-    part_name = f"{len(parts) + 1}-qism"
-    add_part(book_id, part_name, text)
+    # Hozircha faqat wizard holatiga yoziladi; DB'ga "✅ Tugatdim"da birdaniga
+    data.setdefault("parts", []).append(text)
 
     await update.message.reply_text(
-        f"🎧 Qism qo‘shildi. Jami: {len(parts) + 1}",
+        f"🎧 Qism qabul qilindi. Jami: {len(data['parts'])}\n"
+        "Kitob «✅ Tugatdim» bosilganda saqlanadi.",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
     return ADD_BOOK_PARTS
 
 
+def _save_new_book(data: dict) -> str:
+    if "book_id" in data:
+        # Eski oqimdan qolgan holat: kitob allaqachon yaratilgan, faqat qolgan qismlar qo'shiladi
+        book_id = data["book_id"]
+        start = len(get_parts(book_id)) + 1
+        with catalog_work() as work:
+            work.add_parts(book_id, [(f"{i}-qism", url) for i, url in enumerate(data.get("parts", []), start=start)])
+        return book_id
+    return create_book(data["title"], data["genres"], data["parts"])
+
+
 async def finish_add_book(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    user_id = query.from_user.id
-    TEMP_BOOK.pop(user_id, None)  # tozalash
-
+    data = context.user_data.get("new_book") or {}
     keyboard = [[InlineKeyboardButton("🏠 Asosiy menyu", callback_data="admin_panel")]]
+
+    if not data.get("parts") and "book_id" not in data:
+        context.user_data.pop("new_book", None)
+        await safe_edit_message(
+            query.message,
+            "ℹ️ Hech qanday qism yuborilmadi — kitob saqlanmadi.",
+            InlineKeyboardMarkup(keyboard)
+        )
+        return ConversationHandler.END
+
+    # Kitob, janrlari va qismlari — bitta tranzaksiya: xato bo'lsa hech narsa yozilmaydi
+    # va holat saqlanib qoladi (qayta "✅ Tugatdim" bosish mumkin)
+    try:
+        await asyncio.to_thread(_save_new_book, data)
+    except Exception:
+        await safe_edit_message(
+            query.message,
+            "❌ Kitobni saqlab bo‘lmadi, hech narsa yozilmadi. Birozdan so‘ng qayta urinib ko‘ring.",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("✅ Tugatdim", callback_data="finish_add_book")],
+                [InlineKeyboardButton("❌ Bekor qilish", callback_data="cancel_add_book")],
+            ])
+        )
+        raise
+    context.user_data.pop("new_book", None)  # tozalash
+
     await safe_edit_message(
         query.message,
-        "✅ Kitob saqlandi!",
+        f"✅ Kitob saqlandi! Qismlar: {len(data.get('parts', []))} ta.",
         InlineKeyboardMarkup(keyboard)
     )
     return ConversationHandler.END
@@ -187,7 +223,7 @@ async def finish_add_book(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cancel_add_book(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    TEMP_BOOK.pop(query.from_user.id, None)
+    context.user_data.pop("new_book", None)
     await safe_edit_message(
         query.message,
         "❌ Kitob qo‘shish bekor qilindi.",
@@ -232,7 +268,7 @@ async def select_book_for_part_add(update: Update, context: ContextTypes.DEFAULT
     query = update.callback_query
     await query.answer()
     book_id = query.data.replace("addpart_", "")
-    TEMP_ADD_PART[query.from_user.id] = book_id
+    context.user_data["add_part_book_id"] = book_id
     keyboard = [
         [InlineKeyboardButton("🏁 Tugatish", callback_data="cancel_add_part")],
         [InlineKeyboardButton("🔙 Ortga", callback_data="admin_add_part")]
@@ -247,7 +283,18 @@ async def select_book_for_part_add(update: Update, context: ContextTypes.DEFAULT
 
 
 async def receive_part_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
+    # Tashlab ketilgan wizard holati tozalangan bo'lishi mumkin (persistence.evict_stale_state_loop)
+    book_id = context.user_data.get("add_part_book_id")
+    if book_id is None:
+        await update.message.reply_text(
+            "❌ Holat topilmadi: qism qo‘shish muddati o‘tgan. Qaytadan boshlang.",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("➕ Qism qo‘shish", callback_data="admin_add_part")],
+                [InlineKeyboardButton("🏠 Admin panel", callback_data="admin_panel")],
+            ])
+        )
+        return ConversationHandler.END
+
     text = (update.message.text or "").strip()
     keyboard = [
         [InlineKeyboardButton("🏁 Tugatish", callback_data="cancel_add_part")],
@@ -262,7 +309,6 @@ async def receive_part_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return ADD_PART_URL
 
-    book_id = TEMP_ADD_PART[user_id]
     parts = get_parts(book_id)
     part_name = f"{len(parts) + 1}-qism"
     add_part(book_id, part_name, text)
@@ -277,7 +323,7 @@ async def receive_part_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cancel_add_part(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    TEMP_ADD_PART.pop(query.from_user.id, None)
+    context.user_data.pop("add_part_book_id", None)
     await safe_edit_message(
         query.message,
         "✔️ Qism qo‘shish yakunlandi.",
@@ -404,7 +450,7 @@ async def admin_list_books(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = []
     row = []
     for b in books:
-        row.append(InlineKeyboardButton(b["nomi"], callback_data=f"deletebook_{b['id']}"))
+        row.append(InlineKeyboardButton(b["nomi"], callback_data=cb("deletebook", b["id"])))
         if len(row) == 2:
             keyboard.append(row)
             row = []
@@ -424,7 +470,7 @@ async def admin_list_books(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def ask_confirm_book_delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    book_id = query.data.replace("deletebook_", "")
+    book_id = context.args[0]
     context.user_data["delete_book_id"] = book_id
     keyboard = [
         [InlineKeyboardButton("✅ Ha, o‘chirish", callback_data="confirm_delete_book")],
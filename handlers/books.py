@@ -1,7 +1,14 @@
+import asyncio
+from html import escape
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
-from storage import get_books, get_parts, get_book, increment_book_view
+from storage import get_parts, get_book, increment_book_view, set_part_duration, load_genre_index
+from genre_index import genre_index
+from summary import summaries, format_duration
 from utils import safe_edit_message
+from router import cb
+from listeners import tracker as listeners
+from progress import progress
 
 
 # 📚 Barcha kitoblar ro'yxati (qismlari bo'lmasa ham ko'rsatiladi)
@@ -9,7 +16,10 @@ async def show_books(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    books = get_books()
+    # Ro'yxat xotiradagi indeksdan, yorliqlar (qismlar soni) book_summary nusxasidan — DB'siz
+    if not genre_index.ready:
+        await asyncio.to_thread(load_genre_index)
+    books = genre_index.books()
     if not books:
         keyboard = [[InlineKeyboardButton("🏠 Asosiy sahifa", callback_data="home")]]
         await safe_edit_message(
@@ -22,7 +32,7 @@ async def show_books(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = []
     row = []
     for b in books:
-        row.append(InlineKeyboardButton(b["nomi"], callback_data=f"book_{b['id']}"))
+        row.append(InlineKeyboardButton(summaries.label(b["id"], b["nomi"]), callback_data=cb("book", b["id"])))
         if len(row) == 2:
             keyboard.append(row)
             row = []
@@ -44,14 +54,16 @@ async def show_books(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # 🎧 Tanlangan kitob qismlari (bo'lmasa xabar chiqadi)
 async def show_book_parts(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    _, book_id = query.data.split("_", 1)
+    book_id = context.args[0]
 
-    # Statistikani kitob ochilganda ham yuritamiz
-    book = get_book(book_id)
+    # Statistikani kitob ochilganda ham yuritamiz.
+    # DB chaqiruvlari threadda: boshqa chatlar kutib qolmaydi, bir xil o'qishlar birlashadi.
+    book = await asyncio.to_thread(get_book, book_id)
     if book:
-        increment_book_view(book["nomi"])
+        await asyncio.to_thread(increment_book_view, book["id"])
+        listeners.note(book["id"], update.effective_user.id)
 
-    parts = get_parts(book_id)
+    parts = await asyncio.to_thread(get_parts, book_id)
 
     if not parts:
         keyboard = [[
@@ -68,7 +80,7 @@ async def show_book_parts(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = []
     row = []
     for i, p in enumerate(parts):
-        row.append(InlineKeyboardButton(p["nomi"], callback_data=f"part_{book_id}_{i}"))
+        row.append(InlineKeyboardButton(p["nomi"], callback_data=cb("part", book_id, i)))
         if len(row) == 2:
             keyboard.append(row)
             row = []
@@ -80,9 +92,23 @@ async def show_book_parts(update: Update, context: ContextTypes.DEFAULT_TYPE):
         InlineKeyboardButton("🏠 Asosiy sahifa", callback_data="home"),
     ])
 
+    header = "🎧 Qismlar ro‘yxati:"
+    summary = summaries.get(book_id)
+    if book and summary:
+        facts = [f"🎧 {len(parts)} qism"]
+        if summary["total_duration"]:
+            facts.append(f"⏱ {format_duration(summary['total_duration'])}")
+        facts.append(f"👁 {summary['views']} marta ochilgan")
+        # Matn HTML sifatida yuboriladi: nomlardagi < va & ekranlanadi
+        genres = [escape(n) for n in map(genre_index.genre_name, summary["genre_ids"]) if n]
+        header = f"📖 {escape(book['nomi'])}\n" + " · ".join(facts) + "\n"
+        if genres:
+            header += f"🏷 {', '.join(genres)}\n"
+        header += "\n🎧 Qismlar ro‘yxati:"
+
     await safe_edit_message(
         query.message,
-        "🎧 Qismlar ro‘yxati:",
+        header,
         InlineKeyboardMarkup(keyboard)
     )
 
@@ -90,28 +116,37 @@ async def show_book_parts(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ⬇️ Qismni yuborish
 async def send_audio_part(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    _, book_id, part_index = query.data.split("_")
-    part_index = int(part_index)
+    book_id, part_index = context.args
 
-    parts = get_parts(book_id)
+    parts = await asyncio.to_thread(get_parts, book_id)
     if not parts or part_index < 0 or part_index >= len(parts):
         await safe_edit_message(
             query.message,
             "❌ Qism topilmadi yoki hali qo‘shilmagan.",
             InlineKeyboardMarkup([[
-                InlineKeyboardButton("🔙 Ortga", callback_data=f"book_{book_id}"),
+                InlineKeyboardButton("🔙 Ortga", callback_data=cb("book", book_id)),
                 InlineKeyboardButton("🏠 Asosiy sahifa", callback_data="home"),
             ]])
         )
         return
 
     part = parts[part_index]
-    await query.message.reply_audio(audio=part["audio_url"], caption=f"{part['nomi']}")
+    listeners.note(book_id, update.effective_user.id)
+    progress.note(update.effective_user.id, book_id, part["id"])
+    sent = await query.message.reply_audio(audio=part["audio_url"], caption=f"{part['nomi']}")
+    # Davomiylik Telegram javobidan bir marta yoziladi (book_summary'dagi umumiy vaqt uchun)
+    if part.get("duration") is None and sent.audio and sent.audio.duration:
+        await asyncio.to_thread(set_part_duration, part["id"], sent.audio.duration)
 
-    keyboard = [[
-        InlineKeyboardButton("🔙 Ortga", callback_data=f"book_{book_id}"),
+    keyboard = []
+    if part_index + 1 < len(parts):
+        keyboard.append([InlineKeyboardButton(
+            f"▶️ Keyingi: {parts[part_index + 1]['nomi']}", callback_data=cb("part", book_id, part_index + 1)
+        )])
+    keyboard.append([
+        InlineKeyboardButton("🔙 Ortga", callback_data=cb("book", book_id)),
         InlineKeyboardButton("🏠 Asosiy sahifa", callback_data="home"),
-    ]]
+    ])
     await query.message.reply_text(
         "⬆️ Yana boshqa qismlarni tanlashingiz mumkin:",
         reply_markup=InlineKeyboardMarkup(keyboard)
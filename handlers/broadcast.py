@@ -1,5 +1,5 @@
 import asyncio
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram import Update, Message, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, ConversationHandler
 from storage import get_users
 
@@ -21,7 +21,8 @@ async def ask_broadcast_message(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def handle_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = update.message
-    context.user_data["broadcast_message"] = message
+    # Message obyektining o'zi emas, JSON ko'rinishi saqlanadi (persistence uchun)
+    context.user_data["broadcast_message"] = message.to_dict()
     keyboard = [
         [InlineKeyboardButton("✅ Ha, yubor", callback_data="confirm_broadcast")],
         [InlineKeyboardButton("❌ Bekor qilish", callback_data="cancel_broadcast")]
@@ -58,10 +59,11 @@ async def handle_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    message = context.user_data.get("broadcast_message")
-    if not message:
+    data = context.user_data.get("broadcast_message")
+    if not data:
         await query.edit_message_text("❌ Xabar topilmadi.")
         return ConversationHandler.END
+    message = Message.de_json(data, context.bot)
 
     user_ids = [u["id"] for u in get_users()]
     success = 0;
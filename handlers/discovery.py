@@ -0,0 +1,49 @@
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.ext import ContextTypes
+from discovery import discovery
+from summary import summaries
+from utils import safe_edit_message
+from router import cb
+
+
+async def _show_list(update: Update, title: str, empty: str, rows, back: str):
+    """Tayyor ro'yxatni kitob tugmalari sifatida chizadi (DB'ga murojaatsiz)."""
+    query = update.callback_query
+    await query.answer()
+
+    keyboard = [
+        [InlineKeyboardButton(
+            f"{pos}. {summaries.label(r['book_id'], r['nomi'], detailed=True)}", callback_data=cb("book", r["book_id"])
+        )]
+        for pos, r in enumerate(rows, start=1)
+    ]
+    keyboard.append([
+        InlineKeyboardButton("🔙 Ortga", callback_data=back),
+        InlineKeyboardButton("🏠 Asosiy menyu", callback_data="home"),
+    ])
+    await safe_edit_message(query.message, title if rows else empty, InlineKeyboardMarkup(keyboard))
+
+
+# ⭐ Eng ko'p ochilgan kitoblar
+async def show_popular(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _show_list(
+        update, "⭐ Eng mashhur kitoblar:", "ℹ️ Hozircha mashhur kitoblar ro‘yxati tayyor emas.",
+        discovery.get("popular"), "home",
+    )
+
+
+# 🔥 Oxirgi hafta tinglovchilari eng tez o'sgan kitoblar
+async def show_trending(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _show_list(
+        update, "🔥 Shu hafta trenddagi kitoblar:", "ℹ️ Shu hafta trenddagi kitoblar hali yo‘q.",
+        discovery.get("trending"), "home",
+    )
+
+
+# ⭐ Janrning eng mashhurlari: gtop:<genre_id>
+async def show_genre_popular(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    genre_id = context.args[0]
+    await _show_list(
+        update, "⭐ Bu janrning eng mashhur kitoblari:", "ℹ️ Bu janr uchun hali statistika yo‘q.",
+        discovery.get("genre", genre_id), cb("genre", genre_id),
+    )
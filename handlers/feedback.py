@@ -33,14 +33,18 @@ async def save_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     text = (update.message.text or "").strip()
 
-    add_feedback(
+    added = add_feedback(
         user_id=user.id,
         name=f"{user.first_name or ''} {user.last_name or ''}".strip(),
         username=user.username or "",
         text=text
     )
 
-    await update.message.reply_text("✅ Fikringiz uchun rahmat!")
+    if added:
+        await update.message.reply_text("✅ Fikringiz uchun rahmat!")
+    else:
+        # Bir xil fikr qayta yuborilgan (takrorlar DB darajasida rad etiladi)
+        await update.message.reply_text("ℹ️ Bu fikringiz allaqachon qabul qilingan. Rahmat!")
 
     keyboard = [[InlineKeyboardButton("🏠 Asosiy menyu", callback_data="home")]]
     await update.message.reply_text(
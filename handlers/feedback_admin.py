@@ -1,52 +1,79 @@
+from html import escape
+
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
-from storage import get_feedback, deduplicate_feedback
-from utils import safe_edit_message
+from storage import get_feedback_page, set_feedback_status, get_counters
+from utils import is_admin, safe_edit_message
+from router import cb
+
+PAGE_SIZE = 5
+MAX_TEXT = 600  # bitta sahifa Telegram'ning 4096 belgilik chegarasidan oshmasligi uchun
+
+STATUS_TITLES = {"open": "📬 Ochiq fikrlar", "archived": "🗄 Arxiv"}
+
 
+def _render_item(fb) -> str:
+    name = escape(fb.get("name") or "Nomaʼlum")
+    username = fb.get("username") or ""
+    username_str = f"@{escape(username)}" if username else "username: yo‘q"
+    message = fb.get("text") or ""
+    if len(message) > MAX_TEXT:
+        message = message[:MAX_TEXT] + "…"
+    date = fb["created_at"].strftime("%d.%m.%Y %H:%M") if fb.get("created_at") else ""
+    return f"<b>#{fb['fid']}</b> · <b>{name}</b> ({username_str}) · <i>{date}</i>\n{escape(message)}\n\n"
 
-async def show_last_feedbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+# 💬 Fikrlar qutisi: fb:<status>:<older|newer>:<cursor fid, 0 = boshidan>
+async def show_feedback_inbox(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
+    if not is_admin(update.effective_user.id):
+        return
 
-    feedbacks = get_feedback(10)
-
-    if not feedbacks:
-        text = "ℹ️ Hozircha hech qanday fikr bildirilmagan."
+    status, direction, cursor = context.args or ("open", "older", 0)
+    if status not in STATUS_TITLES:
+        status = "open"
+    rows = get_feedback_page(status, direction, cursor or None, PAGE_SIZE)
+    more = len(rows) > PAGE_SIZE
+    rows = rows[:PAGE_SIZE]
+    if direction == "newer":
+        rows.reverse()
+        has_newer, has_older = more, True
     else:
-        text = "💬 So‘nggi 10 ta foydalanuvchi fikri:\n\n"
-        for fb in feedbacks:
-            name = fb.get("name") or "Nomaʼlum"
-            username = fb.get("username") or ""
-            message = fb.get("text") or ""
-            username_str = f"@{username}" if username else "username: yo‘q"
-            text += f"<b>{name}</b> ({username_str}):\n{message}\n\n"
-
-    keyboard = [
-        [InlineKeyboardButton("♻️ Takrorlarni tozalash", callback_data="admin_dedupe_feedback")],
-        [InlineKeyboardButton("🔙 Ortga", callback_data="admin_panel")],
-        [InlineKeyboardButton("🏠 Asosiy menyu", callback_data="home")]
-    ]
+        has_newer, has_older = bool(cursor), more
 
-    await safe_edit_message(
-        query.message,
-        text=text,
-        reply_markup=InlineKeyboardMarkup(keyboard),
-        parse_mode="HTML"
+    counts = get_counters("feedback_open", "feedback_archived")
+    text = (
+        f"{STATUS_TITLES[status]}\n"
+        f"📬 Ochiq: <b>{counts['feedback_open']}</b> · 🗄 Arxivda: <b>{counts['feedback_archived']}</b>\n\n"
     )
+    if not rows:
+        text += "ℹ️ Bu yerda hozircha fikr yo‘q."
+    for fb in rows:
+        text += _render_item(fb)
 
+    # Amal tugmasidan keyin aynan shu sahifa qayta chiziladi
+    page = (status, direction, cursor)
+    keyboard = []
+    for fb in rows:
+        if status == "open":
+            label, target = f"🗄 #{fb['fid']} ni arxivlash", "archived"
+        else:
+            label, target = f"↩️ #{fb['fid']} ni qaytarish", "open"
+        keyboard.append([InlineKeyboardButton(label, callback_data=cb("fbset", fb["fid"], target, *page))])
 
-# ♻️ Takrorlarni tozalash
-async def dedupe_feedback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-
-    removed = deduplicate_feedback()
-    text = f"✅ Tayyor. Takror fikrlar tozalandi.\n\n🗑 O‘chirilganlar soni: <b>{removed}</b> ta"
+    nav = []
+    if has_newer and rows:
+        nav.append(InlineKeyboardButton("⬅️ Yangiroq", callback_data=cb("fb", status, "newer", rows[0]["fid"])))
+    if has_older and rows:
+        nav.append(InlineKeyboardButton("Eskiroq ➡️", callback_data=cb("fb", status, "older", rows[-1]["fid"])))
+    if nav:
+        keyboard.append(nav)
 
-    keyboard = [
-        [InlineKeyboardButton("🔙 Ortga (fikrlar)", callback_data="admin_view_feedback")],
-        [InlineKeyboardButton("🏠 Admin panel", callback_data="admin_panel")],
-    ]
+    other = "archived" if status == "open" else "open"
+    keyboard.append([InlineKeyboardButton(STATUS_TITLES[other], callback_data=cb("fb", other, "older", 0))])
+    keyboard.append([InlineKeyboardButton("🔙 Ortga", callback_data="admin_panel")])
+    keyboard.append([InlineKeyboardButton("🏠 Asosiy menyu", callback_data="home")])
 
     await safe_edit_message(
         query.message,
@@ -55,3 +82,13 @@ async def dedupe_feedback_handler(update: Update, context: ContextTypes.DEFAULT_
         parse_mode="HTML"
     )
 
+
+# 🗄 Arxivlash / qaytarish: fbset:<fid>:<yangi status>:<sahifa>
+async def change_feedback_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        await update.callback_query.answer()
+        return
+    fid, target, *page = context.args
+    set_feedback_status(fid, target)
+    context.args = page
+    await show_feedback_inbox(update, context)
@@ -41,7 +41,7 @@ async def pick_book_then_show_genres(update: Update, context: ContextTypes.DEFAU
     all_genres = get_genres()
     current = {g["id"] for g in get_genres_for_book(book_id)}  # mavjud tanlovlar
 
-    context.user_data["assign_selected_genres"] = set(current)
+    context.user_data["assign_selected_genres"] = sorted(current)
 
     if not all_genres:
         await query.edit_message_text(
@@ -61,7 +61,7 @@ async def pick_book_then_show_genres(update: Update, context: ContextTypes.DEFAU
     return TOGGLE_GENRES_FOR_BOOK
 
 
-def _genres_keyboard(all_genres: list[dict], selected: set[int]):
+def _genres_keyboard(all_genres: list[dict], selected: list[int]):
     kb = []
     row = []
     for g in all_genres:
@@ -93,11 +93,11 @@ async def toggle_book_genre(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     gid = int(query.data.replace("toggle_book_genre_", ""))
-    selected: set[int] = context.user_data.get("assign_selected_genres", set())
+    selected: list[int] = context.user_data.get("assign_selected_genres", [])
     if gid in selected:
         selected.remove(gid)
     else:
-        selected.add(gid)
+        selected.append(gid)
     context.user_data["assign_selected_genres"] = selected
 
     all_genres = get_genres()
@@ -115,7 +115,7 @@ async def save_book_genres(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
 
     book_id = context.user_data.get("assign_book_id")
-    selected: set[int] = context.user_data.get("assign_selected_genres", set())
+    selected: list[int] = context.user_data.get("assign_selected_genres", [])
 
     if not book_id:
         await query.edit_message_text("❌ Xatolik: kitob aniqlanmadi.",
@@ -123,13 +123,14 @@ async def save_book_genres(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                           [[InlineKeyboardButton("🏠 Admin panel", callback_data="admin_panel")]]))
         return ConversationHandler.END
 
-    set_book_genres(book_id, list(selected))
+    # Faqat farq yoziladi (bitta atomar so'rov)
+    diff = set_book_genres(book_id, list(selected))
     # Tozalash
     context.user_data.pop("assign_book_id", None)
     context.user_data.pop("assign_selected_genres", None)
 
     await query.edit_message_text(
-        "✅ Janrlar muvaffaqiyatli saqlandi.",
+        f"✅ Janrlar muvaffaqiyatli saqlandi (➕ {diff['added']} · ➖ {diff['removed']}).",
         reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🏠 Admin panel", callback_data="admin_panel")]])
     )
     return ConversationHandler.END
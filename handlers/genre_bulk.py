@@ -0,0 +1,183 @@
+import asyncio
+from html import escape
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.ext import ContextTypes, ConversationHandler
+from storage import get_genres, get_books_by_genre, update_genre_books, load_genre_index
+from genre_index import genre_index
+from router import cb, fits, parse
+from utils import is_admin, safe_edit_message
+
+# States
+BULK_SELECT_GENRE = 710
+BULK_SELECT_BOOKS = 711
+
+BULK_PAGE_SIZE = 10
+
+
+# --- Step 1: Janr tanlash ---
+async def start_bulk_genre(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    if not is_admin(update.effective_user.id):
+        await safe_edit_message(query.message, "⛔ Sizda bu bo‘limga kirish huquqi yo‘q.")
+        return ConversationHandler.END
+
+    genres = await asyncio.to_thread(get_genres)
+    if not genres:
+        await safe_edit_message(
+            query.message,
+            "Hali hech qanday janr yaratilmagan. Avval janr yarating: 🏷 Janrlarni boshqarish.",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("🏷 Janrlarni boshqarish", callback_data="admin_manage_genres")],
+                [InlineKeyboardButton("🏠 Admin panel", callback_data="admin_panel")],
+            ])
+        )
+        return ConversationHandler.END
+
+    keyboard = []
+    row = []
+    for g in genres:
+        row.append(InlineKeyboardButton(g["nomi"], callback_data=cb("bulkgenre", g["id"])))
+        if len(row) == 2:
+            keyboard.append(row)
+            row = []
+    if row:
+        keyboard.append(row)
+    keyboard.append([InlineKeyboardButton("🏠 Admin panel", callback_data="admin_panel")])
+
+    await safe_edit_message(
+        query.message,
+        "🏷 Qaysi janrni ko‘p kitobga belgilamoqchisiz?",
+        InlineKeyboardMarkup(keyboard)
+    )
+    return BULK_SELECT_GENRE
+
+
+# --- Step 2: Kitoblarni belgilash ---
+async def pick_bulk_genre(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    gid, = parse(query.data, "bulkgenre", int)
+    # Holat bir marta yuklanadi: keyingi tap'lar faqat user_data va xotiradagi indeksni o'qiydi
+    current = [b["id"] for b in await asyncio.to_thread(get_books_by_genre, gid)]
+    if not genre_index.ready:
+        await asyncio.to_thread(load_genre_index)
+    context.user_data["bulk_genre"] = {"genre_id": gid, "original": current, "selected": current}
+    return await _render_books(update, context, 0)
+
+
+async def _render_books(update: Update, context: ContextTypes.DEFAULT_TYPE, page: int):
+    query = update.callback_query
+    state = context.user_data.get("bulk_genre")
+    if not state:
+        await safe_edit_message(query.message, "❌ Xatolik: janr holati topilmadi.", InlineKeyboardMarkup([
+            [InlineKeyboardButton("🏠 Admin panel", callback_data="admin_panel")]
+        ]))
+        return ConversationHandler.END
+
+    books = genre_index.books()
+    pages = max(1, -(-len(books) // BULK_PAGE_SIZE))
+    page = min(max(0, page), pages - 1)
+    chunk = books[page * BULK_PAGE_SIZE:(page + 1) * BULK_PAGE_SIZE]
+    selected = set(state["selected"])
+    original = set(state["original"])
+
+    keyboard = []
+    for b in chunk:
+        data = cb("bulkbook", page, b["id"])
+        if not fits(data):
+            continue  # Telegram callback_data chegarasi (juda uzun matnli id)
+        marker = "✅" if b["id"] in selected else "▫️"
+        keyboard.append([InlineKeyboardButton(f"{marker} {b['nomi']}", callback_data=data)])
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅️", callback_data=cb("bulkpage", page - 1)))
+    nav.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=cb("bulkpage", page)))
+    if page + 1 < pages:
+        nav.append(InlineKeyboardButton("➡️", callback_data=cb("bulkpage", page + 1)))
+    keyboard.append(nav)
+    keyboard.append([
+        InlineKeyboardButton("☑️ Sahifani belgilash", callback_data=cb("bulkall", page, 1)),
+        InlineKeyboardButton("🔲 Sahifani tozalash", callback_data=cb("bulkall", page, 0)),
+    ])
+
+    to_add, to_remove = len(selected - original), len(original - selected)
+    keyboard.append([InlineKeyboardButton(f"💾 Saqlash (➕ {to_add} · ➖ {to_remove})", callback_data="bulk_save")])
+    keyboard.append([
+        InlineKeyboardButton("🔙 Ortga", callback_data="admin_bulk_genres"),
+        InlineKeyboardButton("🏠 Admin panel", callback_data="admin_panel"),
+    ])
+
+    name = escape(genre_index.genre_name(state["genre_id"]) or f"#{state['genre_id']}")
+    await safe_edit_message(
+        query.message,
+        f"🏷 Janr: {name}\n"
+        f"✅ Belgilangan kitoblar: {len(selected)} ta\n\n"
+        "Kitoblarni belgilang yoki olib tashlang, so‘ng saqlang — hammasi bitta tranzaksiyada yoziladi.",
+        InlineKeyboardMarkup(keyboard)
+    )
+    return BULK_SELECT_BOOKS
+
+
+async def toggle_bulk_book(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    page, book_id = parse(query.data, "bulkbook", int, str)
+    state = context.user_data.get("bulk_genre")
+    if state:
+        selected = set(state["selected"])
+        selected ^= {book_id}
+        state["selected"] = sorted(selected)
+    return await _render_books(update, context, page)
+
+
+async def toggle_bulk_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    page, on = parse(query.data, "bulkall", int, int)
+    state = context.user_data.get("bulk_genre")
+    if state:
+        ids = {b["id"] for b in genre_index.books()[page * BULK_PAGE_SIZE:(page + 1) * BULK_PAGE_SIZE]}
+        selected = set(state["selected"])
+        selected = selected | ids if on else selected - ids
+        state["selected"] = sorted(selected)
+    return await _render_books(update, context, page)
+
+
+async def show_bulk_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    page, = parse(query.data, "bulkpage", int)
+    return await _render_books(update, context, page)
+
+
+# --- Step 3: Saqlash (bitta so'rov) ---
+async def save_bulk_genre(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    state = context.user_data.pop("bulk_genre", None)
+    if not state:
+        await safe_edit_message(query.message, "❌ Xatolik: janr holati topilmadi.", InlineKeyboardMarkup([
+            [InlineKeyboardButton("🏠 Admin panel", callback_data="admin_panel")]
+        ]))
+        return ConversationHandler.END
+
+    selected, original = set(state["selected"]), set(state["original"])
+    diff = await asyncio.to_thread(
+        update_genre_books, state["genre_id"], sorted(selected - original), sorted(original - selected)
+    )
+    await safe_edit_message(
+        query.message,
+        f"✅ Saqlandi: ➕ {diff['added']} ta kitob qo‘shildi, ➖ {diff['removed']} ta olib tashlandi.",
+        InlineKeyboardMarkup([
+            [InlineKeyboardButton("🏷 Yana janr belgilash", callback_data="admin_bulk_genres")],
+            [InlineKeyboardButton("🏠 Admin panel", callback_data="admin_panel")],
+        ])
+    )
+    return ConversationHandler.END
@@ -1,7 +1,13 @@
+import asyncio
+from html import escape
+
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes, ConversationHandler, MessageHandler, CallbackQueryHandler, filters
-from storage import get_genres, add_genre, delete_genre, get_books_by_genre
+from storage import get_genres, add_genre, delete_genre, load_genre_index
+from genre_index import genre_index
+from summary import summaries
 from utils import is_admin, safe_edit_message
+from router import cb, fits
 
 # States
 GENRE_MENU = 590
@@ -9,6 +15,24 @@ ASK_GENRE_NAME = 591
 DELETE_GENRE_SELECT = 592
 CONFIRM_DELETE_GENRE = 593
 
+FILTER_PAGE_SIZE = 20
+
+
+async def _index():
+    """Foydalanuvchi ekranlari xotiradagi indeksdan o'qiydi; hali yuklanmagan bo'lsa bir marta yuklanadi."""
+    if not genre_index.ready:
+        await asyncio.to_thread(load_genre_index)
+    return genre_index
+
+
+def _parse_selection(raw: str) -> list:
+    # Tanlangan janrlar callback_data'da: "3-7-12" ("0" — hech narsa)
+    return sorted({int(x) for x in raw.split("-") if x.isdigit() and int(x) > 0})
+
+
+def _encode_selection(genre_ids) -> str:
+    return "-".join(map(str, sorted(genre_ids))) or "0"
+
 
 # ========================= Foydalanuvchi oqimi =========================
 
@@ -17,7 +41,7 @@ async def show_genres(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    genres = get_genres()
+    genres = (await _index()).genres()
     if not genres:
         kb = [[InlineKeyboardButton("🏠 Asosiy menyu", callback_data="home")]]
         await safe_edit_message(query.message, "🏷 Hali janrlar qo‘shilmagan.", InlineKeyboardMarkup(kb))
@@ -26,13 +50,14 @@ async def show_genres(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = []
     row = []
     for g in genres:
-        row.append(InlineKeyboardButton(g["nomi"], callback_data=f"genre_{g['id']}"))
+        row.append(InlineKeyboardButton(g["nomi"], callback_data=cb("genre", g["id"])))
         if len(row) == 2:
             keyboard.append(row)
             row = []
     if row:
         keyboard.append(row)
 
+    keyboard.append([InlineKeyboardButton("🔎 Bir nechta janr bo‘yicha qidirish", callback_data=cb("gf", "0"))])
     keyboard.append([
         InlineKeyboardButton("🔙 Ortga", callback_data="home"),
         InlineKeyboardButton("🏠 Asosiy menyu", callback_data="home"),
@@ -50,8 +75,8 @@ async def show_books_in_genre(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     await query.answer()
 
-    gid = int(query.data.replace("genre_", ""))
-    books = get_books_by_genre(gid)
+    gid = context.args[0]
+    books = (await _index()).books_with_genres([gid])
 
     if not books:
         kb = [[
@@ -68,13 +93,14 @@ async def show_books_in_genre(update: Update, context: ContextTypes.DEFAULT_TYPE
     keyboard = []
     row = []
     for b in books:
-        row.append(InlineKeyboardButton(b["nomi"], callback_data=f"book_{b['id']}"))
+        row.append(InlineKeyboardButton(summaries.label(b["id"], b["nomi"]), callback_data=cb("book", b["id"])))
         if len(row) == 2:
             keyboard.append(row)
             row = []
     if row:
         keyboard.append(row)
 
+    keyboard.append([InlineKeyboardButton("⭐ Janrning eng mashhurlari", callback_data=cb("gtop", gid))])
     keyboard.append([
         InlineKeyboardButton("🔙 Ortga (janrlar)", callback_data="genres"),
         InlineKeyboardButton("🏠 Asosiy menyu", callback_data="home"),
@@ -87,6 +113,93 @@ async def show_books_in_genre(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
 
 
+# 🔎 Janrlar filtri: gf:<tanlangan janrlar>. Har tugma bosilganda tanlov to'liq
+# callback_data'da keladi; kesishmalar xotiradagi indeksda hisoblanadi.
+async def show_genre_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    index = await _index()
+    selected = [gid for gid in _parse_selection(context.args[0]) if index.genre_name(gid)]
+    counts = index.refine_counts(selected)
+    found = len(index.books_with_genres(selected)) if selected else 0
+
+    keyboard = []
+    row = []
+    for g in index.genres():
+        if g["id"] in selected:
+            label = f"✅ {g['nomi']}"
+            target = [x for x in selected if x != g["id"]]
+        elif counts.get(g["id"]):
+            label = f"{g['nomi']} ({counts[g['id']]})"
+            target = selected + [g["id"]]
+        else:
+            continue  # natijani bo'shatib qo'yadigan janrlar ko'rsatilmaydi
+        data = cb("gf", _encode_selection(target))
+        if not fits(data):
+            continue  # Telegram callback_data chegarasi
+        row.append(InlineKeyboardButton(label, callback_data=data))
+        if len(row) == 2:
+            keyboard.append(row)
+            row = []
+    if row:
+        keyboard.append(row)
+
+    if selected:
+        keyboard.append([InlineKeyboardButton(
+            f"📚 Natijalar ({found})", callback_data=cb("gfr", _encode_selection(selected), 0)
+        )])
+        keyboard.append([InlineKeyboardButton("🧹 Tozalash", callback_data=cb("gf", "0"))])
+    keyboard.append([
+        InlineKeyboardButton("🔙 Ortga (janrlar)", callback_data="genres"),
+        InlineKeyboardButton("🏠 Asosiy menyu", callback_data="home"),
+    ])
+
+    if selected:
+        # Janr shu orada o'chirilgan bo'lishi mumkin (genre_name → None); matn HTML
+        names = ", ".join(escape(n) for n in map(index.genre_name, selected) if n)
+        text = f"🔎 Tanlangan janrlar: {names}\n📚 Hammasiga mos kitoblar: {found} ta\n\nYana janr qo‘shing yoki natijalarni oching:"
+    else:
+        text = "🔎 Janrlarni tanlang — barchasiga mos kitoblar ko‘rsatiladi:"
+    await safe_edit_message(query.message, text, InlineKeyboardMarkup(keyboard))
+
+
+# 📚 Filtr natijalari: gfr:<tanlangan janrlar>:<sahifa>
+async def show_genre_filter_results(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    raw, page = context.args
+    page = max(0, page)
+    books = (await _index()).books_with_genres(_parse_selection(raw))
+    chunk = books[page * FILTER_PAGE_SIZE:(page + 1) * FILTER_PAGE_SIZE]
+
+    keyboard = []
+    row = []
+    for b in chunk:
+        row.append(InlineKeyboardButton(summaries.label(b["id"], b["nomi"]), callback_data=cb("book", b["id"])))
+        if len(row) == 2:
+            keyboard.append(row)
+            row = []
+    if row:
+        keyboard.append(row)
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅️ Oldingi", callback_data=cb("gfr", raw, page - 1)))
+    if (page + 1) * FILTER_PAGE_SIZE < len(books):
+        nav.append(InlineKeyboardButton("Keyingi ➡️", callback_data=cb("gfr", raw, page + 1)))
+    if nav:
+        keyboard.append(nav)
+    keyboard.append([
+        InlineKeyboardButton("🔙 Filtrga qaytish", callback_data=cb("gf", raw)),
+        InlineKeyboardButton("🏠 Asosiy menyu", callback_data="home"),
+    ])
+
+    text = f"📚 Mos kitoblar: {len(books)} ta" if books else "ℹ️ Tanlangan janrlarning hammasiga mos kitob yo‘q."
+    await safe_edit_message(query.message, text, InlineKeyboardMarkup(keyboard))
+
+
 # ========================= Admin oqimi =========================
 
 async def admin_genre_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
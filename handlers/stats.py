@@ -1,15 +1,24 @@
+import asyncio
+from html import escape
+
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
-from storage import get_users, get_book_views, get_books
+from storage import get_counters, get_book_stats_page, get_genres
 from utils import safe_edit_message
+from router import cb
+from listeners import tracker as listeners
+
+STATS_PAGE_SIZE = 20
+LISTENER_DAYS = 30
 
 
 async def show_stats_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     keyboard = [
-        [InlineKeyboardButton("👥 Foydalanuvchilar soni", callback_data="stat_users")],
+        [InlineKeyboardButton("👥 Foydalanuvchilar (DAU/MAU)", callback_data="stat_users")],
         [InlineKeyboardButton("📖 Kitoblar statistikasi", callback_data="stat_books")],
+        [InlineKeyboardButton("👂 Noyob tinglovchilar (janrlar)", callback_data="stat_listeners")],
         [InlineKeyboardButton("🏠 Asosiy menyu", callback_data="home")]
     ]
     await safe_edit_message(query.message, "📊 Statistika menyusi:", InlineKeyboardMarkup(keyboard))
@@ -18,36 +27,87 @@ async def show_stats_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def show_user_count(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    count = len(get_users())
+    # Fonda (activity.py) hisoblangan qiymatlar — users jadvali har tap'da sanalmaydi
+    counts = get_counters("users_total", "dau", "mau")
     keyboard = [[
         InlineKeyboardButton("🔙 Ortga", callback_data="stats"),
         InlineKeyboardButton("🏠 Asosiy menyu", callback_data="home")
     ]]
     await safe_edit_message(
         query.message,
-        text=f"👥 Botdan foydalanuvchilar soni: <b>{count}</b> ta",
+        text=(
+            f"👥 Botdan foydalanuvchilar soni: <b>{counts['users_total']}</b> ta\n\n"
+            f"📅 Bugun faol (DAU): <b>{counts['dau']}</b> ta\n"
+            f"🗓 Oxirgi 30 kunda faol (MAU): <b>{counts['mau']}</b> ta"
+        ),
         reply_markup=InlineKeyboardMarkup(keyboard),
         parse_mode="HTML"
     )
 
 
+# 📖 Eng ko'p ochilgan kitoblar: stat_books (1-sahifa) yoki statbooks:<sahifa>
 async def show_book_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    views = {row["book_name"]: row["count"] for row in get_book_views()}
-    books = get_books()
-    titles = {b["nomi"] for b in books}
+    page = context.args[0] if context.args else 0
+    page = max(0, page)
+    rows = get_book_stats_page(page * STATS_PAGE_SIZE, STATS_PAGE_SIZE)
+    has_next = len(rows) > STATS_PAGE_SIZE
+    rows = rows[:STATS_PAGE_SIZE]
 
-    filtered = {t: c for t, c in views.items() if t in titles}
-    if not filtered:
-        text = "📚 Hali statistik ma’lumot yo‘q yoki mavjud kitoblarga tegishli emas.\n\n" \
+    if not rows and page == 0:
+        text = "📚 Hali statistik ma’lumot yo‘q.\n\n" \
                "ℹ️ Statistika kitob qismlar ro‘yxatini ochganingizda yangilanadi."
+    elif not rows:
+        text = "📚 Bu sahifada kitob yo‘q."
+    else:
+        # Bitta so'rov: sahifadagi kitoblarning 30 kunlik sketch'lari
+        uniques = await asyncio.to_thread(
+            listeners.unique_listeners, "book", [row["id"] for row in rows], LISTENER_DAYS
+        )
+        text = f"📖 Kitoblar bo‘yicha statistika ({page + 1}-sahifa):\n\n"
+        for pos, row in enumerate(rows, start=page * STATS_PAGE_SIZE + 1):
+            text += (f"{pos}. <b>{escape(row['nomi'])}</b>: {row['count']} marta ochilgan"
+                     f" · 👂 ~{uniques[str(row['id'])]}\n")
+        text += f"\n👂 — oxirgi {LISTENER_DAYS} kundagi noyob tinglovchilar (taxminiy)"
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅️ Oldingi", callback_data=cb("statbooks", page - 1)))
+    if has_next:
+        nav.append(InlineKeyboardButton("Keyingi ➡️", callback_data=cb("statbooks", page + 1)))
+    keyboard = [nav] if nav else []
+    keyboard.append([
+        InlineKeyboardButton("🔙 Ortga", callback_data="stats"),
+        InlineKeyboardButton("🏠 Asosiy menyu", callback_data="home")
+    ])
+    await safe_edit_message(
+        query.message,
+        text=text,
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode="HTML"
+    )
+
+
+# 👂 Janrlar bo'yicha noyob tinglovchilar (oxirgi 30 kun, HyperLogLog taxmini)
+async def show_listener_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    genres = await asyncio.to_thread(get_genres)
+    uniques = await asyncio.to_thread(
+        listeners.unique_listeners, "genre", [g["id"] for g in genres], LISTENER_DAYS
+    )
+    ranked = sorted(genres, key=lambda g: -uniques[str(g["id"])])
+
+    if not ranked:
+        text = "🏷 Hozircha janrlar yo‘q."
     else:
-        sorted_stats = sorted(filtered.items(), key=lambda x: x[1], reverse=True)
-        text = "📖 Kitoblar bo‘yicha statistika:\n\n"
-        for name, cnt in sorted_stats:
-            text += f"• <b>{name}</b>: {cnt} marta ochilgan\n"
+        text = f"👂 Janrlar bo‘yicha noyob tinglovchilar (oxirgi {LISTENER_DAYS} kun):\n\n"
+        for pos, g in enumerate(ranked, start=1):
+            text += f"{pos}. <b>{escape(g['nomi'])}</b>: ~{uniques[str(g['id'])]} kishi\n"
+        text += "\nℹ️ Qiymatlar taxminiy (±2–3%), bir kishi bir necha marta sanalmaydi."
 
     keyboard = [[
         InlineKeyboardButton("🔙 Ortga", callback_data="stats"),
@@ -59,4 +119,3 @@ async def show_book_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=InlineKeyboardMarkup(keyboard),
         parse_mode="HTML"
     )
-
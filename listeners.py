@@ -0,0 +1,92 @@
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Tuple
+from zoneinfo import ZoneInfo
+
+from config import ACTIVITY_TZ
+from hll import HyperLogLog
+from storage import get_genre_ids_for_books, save_listener_sketches, load_listener_sketches
+
+log = logging.getLogger(__name__)
+
+
+class ListenerTracker:
+    """
+    Kitob va janrlar bo'yicha noyob tinglovchilar (HyperLogLog, hll.py).
+
+    note() — tap uchun yagona xarajat: hash va bitta registr yangilanishi (DB'siz).
+    Fon vazifasi (run) har flush_interval'da o'sha kungi kitob sketch'larini
+    yozadi; janr sketch'lari flush paytida kitoblarnikidan birlashtiriladi
+    (bitta so'rov bilan kitob → janrlar). Birlashtirish idempotent (max), shuning
+    uchun xato bo'lsa sketch bufferga qaytariladi va keyingi safar qayta yoziladi.
+    """
+
+    def __init__(self, tz: str = "Asia/Tashkent"):
+        self.tz = ZoneInfo(tz)
+        self._sketches: Dict[Tuple[date, str], HyperLogLog] = {}
+        self.counters: Dict[str, int] = {"notes": 0, "flushes": 0, "flushed_books": 0}
+
+    def today(self) -> date:
+        return datetime.now(self.tz).date()
+
+    def note(self, book_id: str, user_id: int) -> None:
+        key = (self.today(), str(book_id))
+        sketch = self._sketches.get(key)
+        if sketch is None:
+            sketch = self._sketches[key] = HyperLogLog()
+        sketch.add(user_id)
+        self.counters["notes"] += 1
+
+    async def flush(self) -> None:
+        if not self._sketches:
+            return
+        batch, self._sketches = self._sketches, {}
+        try:
+            genre_map = await asyncio.to_thread(get_genre_ids_for_books, list({b for _, b in batch}))
+            by_day: Dict[date, List[Tuple[str, str, bytes]]] = {}
+            genres: Dict[Tuple[date, str], HyperLogLog] = {}
+            for (day, book_id), sketch in batch.items():
+                by_day.setdefault(day, []).append(("book", book_id, sketch.to_bytes()))
+                for genre_id in genre_map.get(book_id, ()):
+                    genres.setdefault((day, str(genre_id)), HyperLogLog()).merge(sketch)
+            for (day, genre_id), sketch in genres.items():
+                by_day[day].append(("genre", genre_id, sketch.to_bytes()))
+            for day, items in sorted(by_day.items()):
+                await asyncio.to_thread(save_listener_sketches, day, items)
+        except Exception:
+            # Qaytariladi: oraliqda kelgan yangi tinglovchilar bilan birlashadi
+            for key, sketch in batch.items():
+                if key in self._sketches:
+                    sketch.merge(self._sketches[key])
+                self._sketches[key] = sketch
+            raise
+        self.counters["flushes"] += 1
+        self.counters["flushed_books"] += len(batch)
+
+    async def run(self, flush_interval: float = 60) -> None:
+        try:
+            while True:
+                await asyncio.sleep(flush_interval)
+                try:
+                    await self.flush()
+                except Exception:
+                    log.exception("Tinglovchilar sketch'larini yozishda xato")
+        finally:
+            # To'xtatilganda (post_stop) bufer yo'qolmasin
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Tinglovchilar buferini yakuniy yozishda xato")
+
+    def unique_listeners(self, scope: str, keys: List[str], days: int = 30) -> Dict[str, int]:
+        """Oxirgi `days` kun (bugun ham) bo'yicha {key: taxminiy noyob tinglovchilar} — DB'dan, sinxron."""
+        since = self.today() - timedelta(days=days - 1)
+        stored = load_listener_sketches(scope, [str(k) for k in keys], since)
+        return {str(k): HyperLogLog.union(stored.get(str(k), ())).estimate() for k in keys}
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counters, pending=len(self._sketches))
+
+
+tracker = ListenerTracker(ACTIVITY_TZ)
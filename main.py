@@ -1,21 +1,46 @@
+import asyncio
+import logging
+
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, ContextTypes, ConversationHandler,
-    CallbackQueryHandler, MessageHandler, filters
+    CallbackQueryHandler, MessageHandler, TypeHandler, filters
 )
 from telegram.error import BadRequest
 from telegram.constants import ParseMode
 
-from config import BOT_TOKEN
-from storage import init_db, add_user
+from config import (
+    BOT_TOKEN, BOT_MODE, MAX_CONCURRENT_UPDATES, WORKER_PARTITIONS,
+    STATE_TTL_HOURS, PERSISTENCE_INTERVAL, WEBHOOK_URL,
+    BACKLOG_DRAIN, BACKLOG_FRESH_SECONDS, FLOOD_RATE, FLOOD_BURST, ADMINS,
+    ACTIVITY_FLUSH_SECONDS, ACTIVITY_ROLLUP_SECONDS, ACTIVITY_TZ, PROGRESS_FLUSH_SECONDS,
+    GENRE_INDEX_REFRESH_SECONDS, SUMMARY_CHECK_SECONDS, SUMMARY_MAX_AGE_SECONDS, METRICS_LOG_SECONDS,
+)
+from storage import init_db, add_user, get_admins, load_genre_index, single_flight_stats
 from utils import is_admin
+from ratelimit import TelegramRateLimiter
+from dispatch import ChatOrderedUpdateProcessor
+from router import CallbackRouter, cb
+from webhook import run_webhook
+from queue_worker import run_receiver, run_worker
+from persistence import PostgresPersistence, evict_stale_state_loop
+from backlog import drain_backlog
+from flood import FloodControl
+from activity import ActivityTracker
+from listeners import tracker as listeners
+from progress import progress
+from discovery import discovery
+from genre_index import genre_index
+from summary import summaries
+import metrics
 
 # --- Admin panel va boshqalar ---
-from handlers.admin_panel import admin_panel
+from handlers.admin_panel import admin_panel, show_metrics
 from handlers.books import show_books, show_book_parts, send_audio_part
-from handlers.stats import show_stats_menu, show_user_count, show_book_stats
+from handlers.stats import show_stats_menu, show_user_count, show_book_stats, show_listener_stats
+from handlers.discovery import show_popular, show_trending, show_genre_popular
 from handlers.feedback import ask_feedback, save_feedback, cancel_feedback, ASK_FEEDBACK
-from handlers.feedback_admin import show_last_feedbacks, dedupe_feedback_handler
+from handlers.feedback_admin import show_feedback_inbox, change_feedback_status
 from handlers.broadcast import (
     ask_broadcast_message, handle_broadcast, confirm_broadcast, cancel_broadcast,
     ASK_BROADCAST_MESSAGE, CONFIRM_BROADCAST
@@ -27,7 +52,7 @@ from handlers.admin_manage import (
 
 # --- Janrlar ---
 from handlers.genres import (
-    show_genres, show_books_in_genre,
+    show_genres, show_books_in_genre, show_genre_filter, show_genre_filter_results,
     admin_genre_menu, ask_genre_name, receive_genre_name,
     delete_genre_menu, confirm_delete_genre, really_delete_genre,
     ASK_GENRE_NAME, DELETE_GENRE_SELECT, CONFIRM_DELETE_GENRE,
@@ -47,6 +72,10 @@ from handlers.book_manage import (
 )
 
 # --- Mavjud kitoblarga janr belgilash ---
+from handlers.genre_bulk import (
+    start_bulk_genre, pick_bulk_genre, toggle_bulk_book, toggle_bulk_page, show_bulk_page,
+    save_bulk_genre, BULK_SELECT_GENRE, BULK_SELECT_BOOKS,
+)
 from handlers.genre_assign import (
     start_assign_genres, pick_book_then_show_genres, toggle_book_genre, save_book_genres,
     SELECT_BOOK_FOR_ASSIGN, TOGGLE_GENRES_FOR_BOOK
@@ -104,9 +133,21 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     add_user(user.id, user.first_name or "")
 
-    keyboard = [
+    keyboard = []
+    # Bitta so'rov: oxirgi tinglangan kitobning keyingi qismi (tugatilgan kitoblar o'tkaziladi)
+    resume = await progress.resume(user.id)
+    if resume:
+        keyboard.append([InlineKeyboardButton(
+            f"▶️ Davom ettirish: {resume['book_nomi']} — {resume['part_nomi']}",
+            callback_data=cb("part", resume["book_id"], resume["part_index"]),
+        )])
+    keyboard += [
         [InlineKeyboardButton("📚 Kitoblar", callback_data='books')],
         [InlineKeyboardButton("🏷 Janrlar", callback_data='genres')],
+        [
+            InlineKeyboardButton("🔥 Trenddagilar", callback_data='trending'),
+            InlineKeyboardButton("⭐ Eng mashhurlar", callback_data='popular'),
+        ],
         [InlineKeyboardButton("📊 Statistika", callback_data='stats')],
         [InlineKeyboardButton("💬 Fikr bildirish", callback_data='feedback')],
         [InlineKeyboardButton("👤 Admin bilan bog‘lanish", callback_data='admin_contact')],
@@ -150,13 +191,139 @@ async def admin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await admin_panel(update, context)
 
 
-def main():
-    init_db()
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+def build_callback_router() -> CallbackRouter:
+    """
+    ConversationHandler'larga tegishli bo'lmagan barcha callbacklar shu yerda.
+    'home' va 'admin_panel' suhbatlarni yakunlaydi, shuning uchun ular alohida qoladi.
+    """
+    router = CallbackRouter()
+    # Foydalanuvchi oqimi (issiq yo'l)
+    router.prefix("part", send_audio_part, str, int, legacy="part_")
+    router.prefix("book", show_book_parts, str, legacy="book_")
+    router.exact("books", show_books)
+    router.exact("genres", show_genres)
+    router.prefix("genre", show_books_in_genre, int, legacy="genre_")
+    router.exact("stats", show_stats_menu)
+    router.exact("stat_users", show_user_count)
+    router.exact("stat_books", show_book_stats)
+    router.prefix("statbooks", show_book_stats, int)
+    router.exact("stat_listeners", show_listener_stats)
+    router.exact("trending", show_trending)
+    router.exact("popular", show_popular)
+    router.prefix("gtop", show_genre_popular, int)
+    router.prefix("gf", show_genre_filter, str)
+    router.prefix("gfr", show_genre_filter_results, str, int)
+    router.exact("admin_contact", admin_contact)
+
+    # Admin: statik bo'limlar
+    router.exact("admin_metrics", show_metrics)
+    router.exact("admin_manage_admins", admin_manage_admins)
+    router.exact("admin_delete_admin", delete_admin_menu)
+    router.prefix("remove_admin", remove_admin_confirm, str, legacy="remove_admin_")
+    router.exact("admin_list_books", admin_list_books)
+    router.exact("admin_delete_book", admin_list_books)
+    router.prefix("deletebook", ask_confirm_book_delete, str, legacy="deletebook_")
+    router.exact("confirm_delete_book", confirm_book_delete)
+    router.exact("admin_view_feedback", show_feedback_inbox)
+    # Eski xabarlardagi "dublikatlarni tozalash" tugmasi: endi dublikatlar yozishda rad etiladi
+    router.exact("admin_dedupe_feedback", show_feedback_inbox)
+    router.prefix("fb", show_feedback_inbox, str, str, int)
+    router.prefix("fbset", change_feedback_status, int, str, str, str, int)
+    metrics.register("router", router.stats)
+    return router
+
+
+def _flood_exempt_ids():
+    return {int(r["id"]) for r in get_admins()} | set(ADMINS)
+
+
+activity = ActivityTracker(ACTIVITY_TZ)
+metrics.register("activity", activity.stats)
+metrics.register("listeners", listeners.stats)
+metrics.register("progress", progress.stats)
+metrics.register("genre_index", genre_index.stats)
+metrics.register("summaries", summaries.stats)
+metrics.register("single_flight", lambda: dict(single_flight_stats))
+
+_background_tasks: list = []
+
+
+async def post_init(app):
+    """Fon vazifalari (run_polling, webhook va worker rejimlarida bir xil chaqiriladi)."""
+    # Polling/update'lardan oldin: o'chiq paytdagi backlog saralanib navbatga qo'yiladi.
+    # Webhook faqat o'zimiz qayta o'rnatadigan bo'lsak (WEBHOOK_URL) tegamiz.
+    if BACKLOG_DRAIN and (BOT_MODE == "polling" or (BOT_MODE == "webhook" and WEBHOOK_URL)):
+        await drain_backlog(app.bot, app.update_queue.put, BACKLOG_FRESH_SECONDS)
+    _background_tasks.append(asyncio.create_task(
+        evict_stale_state_loop(app, STATE_TTL_HOURS * 3600), name="evict_stale_state"
+    ))
+    _background_tasks.append(asyncio.create_task(
+        activity.run(ACTIVITY_FLUSH_SECONDS, ACTIVITY_ROLLUP_SECONDS), name="activity"
+    ))
+    _background_tasks.append(asyncio.create_task(
+        listeners.run(ACTIVITY_FLUSH_SECONDS), name="listeners"
+    ))
+    _background_tasks.append(asyncio.create_task(
+        progress.run(PROGRESS_FLUSH_SECONDS), name="progress"
+    ))
+    # JobQueue o'rniga: ro'yxatlar fonda qayta hisoblanadi, ekranlar faqat xotiradan o'qiydi
+    _background_tasks.append(asyncio.create_task(discovery.run(), name="discovery"))
+    # Janr indeksi: o'z yozuvlarimiz darhol, boshqa jarayonlarniki shu oraliqda yetib keladi
+    _background_tasks.append(asyncio.create_task(
+        genre_index.run(load_genre_index, GENRE_INDEX_REFRESH_SECONDS), name="genre_index"
+    ))
+    _background_tasks.append(asyncio.create_task(
+        summaries.run(SUMMARY_CHECK_SECONDS, SUMMARY_MAX_AGE_SECONDS), name="book_summary"
+    ))
+    _background_tasks.append(asyncio.create_task(metrics.run(METRICS_LOG_SECONDS), name="metrics"))
+
+
+async def post_stop(app):
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+
+
+def build_application():
+    """Barcha handlerlar ulangan Application (polling, webhook va worker uchun umumiy)."""
+    # Barcha Bot API so'rovlari umumiy/chat limitlari va RetryAfter orqali o'tadi
+    limiter = TelegramRateLimiter()
+    metrics.register("ratelimit", limiter.stats)
+    # Turli chatlar parallel, bitta chat ketma-ket; bitta xabarga ketma-ket tap'lardan
+    # faqat oxirgisi chiziladi
+    processor = ChatOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES)
+    metrics.register("dispatch", processor.stats)
+    metrics.register("coalesce", processor.coalescer.stats)
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .rate_limiter(limiter)
+        .concurrent_updates(processor)
+        # Wizard holatlari va suhbat bosqichlari DB'da; workerlar chatlarga bog'lanmagan
+        # bo'lsa, user_data har update oldidan DB'dan yangilanadi
+        .persistence(PostgresPersistence(
+            update_interval=PERSISTENCE_INTERVAL,
+            refresh=(BOT_MODE == "worker" and not WORKER_PARTITIONS),
+        ))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .build()
+    )
+
+    # Faollik (DAU/MAU): cheklangan foydalanuvchilar ham faol hisoblanadi, shuning uchun flooddan oldin
+    app.add_handler(TypeHandler(Update, activity), group=-2)
+    # Har bir update avval shu yerdan o'tadi: limitdan oshganlar DB'ga yetmaydi
+    flood = FloodControl(rate=FLOOD_RATE, burst=FLOOD_BURST, load_exempt=_flood_exempt_ids)
+    metrics.register("flood", flood.stats)
+    app.add_handler(TypeHandler(Update, flood), group=-1)
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("admin", admin_cmd))
 
+    # Birinchi bo'lib tekshiriladi: issiq yo'llar regexlar ro'yxatini aylanmaydi
+    app.add_handler(build_callback_router())
+
     # ----- Feedback -----
     app.add_handler(ConversationHandler(
         entry_points=[CallbackQueryHandler(ask_feedback, pattern=r"^feedback$")],
@@ -170,7 +337,8 @@ def main():
             CallbackQueryHandler(start, pattern=r"^home$"),
             MessageHandler(filters.COMMAND, cancel_feedback)
         ],
-        per_chat=True, allow_reentry=True
+        per_chat=True, allow_reentry=True,
+        name="feedback", persistent=True
     ))
 
     # ----- Add Book (with genres) -----
@@ -189,7 +357,8 @@ def main():
             ]
         },
         fallbacks=[CallbackQueryHandler(cancel_add_book, pattern=r"^cancel_add_book$")],
-        per_chat=True, allow_reentry=True
+        per_chat=True, allow_reentry=True,
+        name="add_book", persistent=True
     ))
 
     # ----- Add Part -----
@@ -203,7 +372,8 @@ def main():
             ],
         },
         fallbacks=[CallbackQueryHandler(cancel_add_part, pattern=r"^cancel_add_part$")],
-        per_chat=True, allow_reentry=True
+        per_chat=True, allow_reentry=True,
+        name="add_part", persistent=True
     ))
 
     # ----- Delete Part -----
@@ -215,7 +385,8 @@ def main():
             CONFIRM_DELETE_PART: [CallbackQueryHandler(really_delete_part, pattern=r"^confirm_delete_part$")],
         },
         fallbacks=[CallbackQueryHandler(admin_panel, pattern=r"^admin_panel$")],
-        per_chat=True, allow_reentry=True
+        per_chat=True, allow_reentry=True,
+        name="delete_part", persistent=True
     ))
 
     # ----- Broadcast -----
@@ -229,18 +400,17 @@ def main():
             ],
         },
         fallbacks=[CallbackQueryHandler(cancel_broadcast, pattern=r"^cancel_broadcast$")],
-        per_chat=True, allow_reentry=True
+        per_chat=True, allow_reentry=True,
+        name="broadcast", persistent=True
     ))
 
     # ----- Adminlar -----
-    app.add_handler(CallbackQueryHandler(admin_manage_admins, pattern=r"^admin_manage_admins$"))
     app.add_handler(ConversationHandler(
         entry_points=[CallbackQueryHandler(ask_admin_id, pattern=r"^admin_add_admin$")],
         states={ASK_NEW_ADMIN_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_admin_id)]},
-        fallbacks=[], per_chat=True, allow_reentry=True
+        fallbacks=[], per_chat=True, allow_reentry=True,
+        name="add_admin", persistent=True
     ))
-    app.add_handler(CallbackQueryHandler(delete_admin_menu, pattern=r"^admin_delete_admin$"))
-    app.add_handler(CallbackQueryHandler(remove_admin_confirm, pattern=r"^remove_admin_"))
 
     # ----- Janrlarni boshqarish -----
     app.add_handler(ConversationHandler(
@@ -269,7 +439,8 @@ def main():
             CallbackQueryHandler(admin_panel, pattern=r"^admin_panel$"),
             CallbackQueryHandler(start, pattern=r"^home$"),
         ],
-        per_chat=True, allow_reentry=True
+        per_chat=True, allow_reentry=True,
+        name="manage_genres", persistent=True
     ))
 
     # ----- Mavjud kitoblarga janr belgilash -----
@@ -290,7 +461,32 @@ def main():
             CallbackQueryHandler(admin_panel, pattern=r"^admin_panel$"),
             CallbackQueryHandler(start, pattern=r"^home$"),
         ],
-        per_chat=True, allow_reentry=True
+        per_chat=True, allow_reentry=True,
+        name="assign_genres", persistent=True
+    ))
+
+    # ----- Bitta janrni ko'p kitobga belgilash -----
+    app.add_handler(ConversationHandler(
+        entry_points=[CallbackQueryHandler(start_bulk_genre, pattern=r"^admin_bulk_genres$")],
+        states={
+            BULK_SELECT_GENRE: [
+                CallbackQueryHandler(pick_bulk_genre, pattern=r"^bulkgenre:\d+$"),
+            ],
+            BULK_SELECT_BOOKS: [
+                CallbackQueryHandler(toggle_bulk_book, pattern=r"^bulkbook:\d+:."),
+                CallbackQueryHandler(toggle_bulk_page, pattern=r"^bulkall:\d+:[01]$"),
+                CallbackQueryHandler(show_bulk_page, pattern=r"^bulkpage:\d+$"),
+                CallbackQueryHandler(save_bulk_genre, pattern=r"^bulk_save$"),
+                CallbackQueryHandler(start_bulk_genre, pattern=r"^admin_bulk_genres$"),
+            ],
+        },
+        fallbacks=[
+            CallbackQueryHandler(start_bulk_genre, pattern=r"^admin_bulk_genres$"),
+            CallbackQueryHandler(admin_panel, pattern=r"^admin_panel$"),
+            CallbackQueryHandler(start, pattern=r"^home$"),
+        ],
+        per_chat=True, allow_reentry=True,
+        name="bulk_genres", persistent=True
     ))
 
     # ----- Kitob nomini tahrirlash (YANGI) -----
@@ -310,35 +506,36 @@ def main():
             CallbackQueryHandler(admin_panel, pattern=r"^admin_panel$"),
             CallbackQueryHandler(start, pattern=r"^home$"),
         ],
-        per_chat=True, allow_reentry=True
+        per_chat=True, allow_reentry=True,
+        name="rename_book", persistent=True
     ))
 
     # ----- Static handlers -----
     app.add_handler(CallbackQueryHandler(start, pattern=r"^home$"))
     app.add_handler(CallbackQueryHandler(admin_panel, pattern=r"^admin_panel$"))
-    app.add_handler(CallbackQueryHandler(admin_contact, pattern=r"^admin_contact$"))
-
-    app.add_handler(CallbackQueryHandler(send_audio_part, pattern=r"^part_"))
-    app.add_handler(CallbackQueryHandler(show_book_parts, pattern=r"^book_"))
-    app.add_handler(CallbackQueryHandler(show_books, pattern=r"^books$"))
 
-    # Kitoblar ro‘yxati va o‘chirish
-    app.add_handler(CallbackQueryHandler(admin_list_books, pattern=r"^admin_list_books$"))
-    app.add_handler(CallbackQueryHandler(admin_list_books, pattern=r"^admin_delete_book$"))
-    app.add_handler(CallbackQueryHandler(ask_confirm_book_delete, pattern=r"^deletebook_"))
-    app.add_handler(CallbackQueryHandler(confirm_book_delete, pattern=r"^confirm_delete_book$"))
+    return app
 
-    app.add_handler(CallbackQueryHandler(show_user_count, pattern=r"^stat_users$"))
-    app.add_handler(CallbackQueryHandler(show_book_stats, pattern=r"^stat_books$"))
-    app.add_handler(CallbackQueryHandler(show_stats_menu, pattern=r"^stats$"))
 
-    app.add_handler(CallbackQueryHandler(show_last_feedbacks, pattern=r"^admin_view_feedback$"))
-    app.add_handler(CallbackQueryHandler(show_genres, pattern=r"^genres$"))
-    app.add_handler(CallbackQueryHandler(show_books_in_genre, pattern=r"^genre_\d+$"))
-    app.add_handler(CallbackQueryHandler(dedupe_feedback_handler, pattern=r"^admin_dedupe_feedback$"))
-
-    print("✅ Bot ishga tushdi.")
-    app.run_polling()
+def main():
+    # Fon vazifalari va metrics.run INFO darajasida yozadi; httpx har so'rovni loglamasin
+    logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s: %(message)s", level=logging.INFO)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    init_db()
+    app = build_application()
+
+    if BOT_MODE == "webhook":
+        print("✅ Bot ishga tushdi (webhook).")
+        run_webhook(app)
+    elif BOT_MODE == "receiver":
+        print("✅ Receiver ishga tushdi: update'lar navbatga yoziladi.")
+        run_receiver(app)
+    elif BOT_MODE == "worker":
+        print("✅ Worker ishga tushdi: update'lar navbatdan olinadi.")
+        run_worker(app)
+    else:
+        print("✅ Bot ishga tushdi.")
+        app.run_polling()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,45 @@
+"""
+Jarayon ichidagi ko'rsatkichlar uchun yagona joy.
+
+Har bir komponent (rate limiter, dispatch, router, flood, buferlar...) o'zining
+stats() funksiyasini register() bilan ro'yxatdan o'tkazadi. Ularni ikki joy o'qiydi:
+davriy log qatori (run) va admin paneldagi "🩺 Tizim ko'rsatkichlari" ekrani.
+Ko'rsatkichlar shu jarayonniki: ko'p workerli rejimda har worker o'zinikini loglaydi.
+"""
+import asyncio
+import logging
+from typing import Callable, Dict
+
+log = logging.getLogger(__name__)
+
+_sources: Dict[str, Callable[[], Dict]] = {}
+
+
+def register(name: str, stats: Callable[[], Dict]) -> None:
+    _sources[name] = stats
+
+
+def snapshot() -> Dict[str, Dict]:
+    """Barcha manbalar ko'rsatkichlari; xato bergan manba o'tkazib yuboriladi."""
+    result = {}
+    for name, stats in sorted(_sources.items()):
+        try:
+            result[name] = stats()
+        except Exception:
+            log.exception("%s ko'rsatkichlarini o'qishda xato", name)
+    return result
+
+
+def format_line(snap: Dict[str, Dict]) -> str:
+    return " ".join(
+        f"{name}[{' '.join(f'{k}={v}' for k, v in values.items())}]" for name, values in snap.items()
+    )
+
+
+async def run(interval: float) -> None:
+    """Har `interval` soniyada bitta log qatori (interval <= 0 bo'lsa o'chiq)."""
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        log.info("Ko'rsatkichlar: %s", format_line(snapshot()))
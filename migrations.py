@@ -0,0 +1,445 @@
+"""
+Versioned PostgreSQL schema.
+
+Each Migration has a number; applied numbers are recorded in schema_version.
+On startup the runner does one version check; only when the DB is behind does it
+take an advisory lock (so concurrent replicas don't race) and apply missing steps
+in order. Never edit a released step — add a new one.
+
+  python migrations.py           # apply pending steps (DATABASE_URL)
+
+Steps with transactional=False run statement by statement outside a transaction,
+which is what CREATE INDEX CONCURRENTLY needs. Such steps must be safe to re-run.
+"""
+import logging
+import os
+import time
+from typing import List, Optional, Sequence, Union
+
+import psycopg
+from psycopg.rows import tuple_row
+
+log = logging.getLogger(__name__)
+
+# pg_advisory_lock key (any constant unique to this app)
+MIGRATION_LOCK_ID = 0x41554449  # "AUDI"
+# How often a waiting replica retries the lock (seconds)
+LOCK_POLL_INTERVAL = 1.0
+
+
+class ConcurrentIndex:
+    """CREATE INDEX CONCURRENTLY that also cleans up an INVALID leftover of a failed build."""
+
+    __slots__ = ("name", "definition", "unique")
+
+    def __init__(self, name: str, definition: str, unique: bool = False):
+        self.name = name
+        self.definition = definition  # "parts (book_id, id)"
+        self.unique = unique
+
+
+Statement = Union[str, ConcurrentIndex]
+
+
+class Migration:
+    __slots__ = ("version", "name", "statements", "transactional")
+
+    def __init__(self, version: int, name: str, statements: Sequence[Statement], transactional: bool = True):
+        self.version = version
+        self.name = name
+        self.statements = list(statements)
+        self.transactional = transactional
+        if transactional and any(isinstance(s, ConcurrentIndex) for s in self.statements):
+            raise ValueError(f"migration {version}: CONCURRENTLY needs transactional=False")
+
+
+MIGRATIONS: List[Migration] = [
+    # Baseline: the schema init_db() used to create on every start. IF NOT EXISTS
+    # lets existing databases adopt versioning without changes.
+    Migration(1, "baseline catalog", [
+        """
+        CREATE TABLE IF NOT EXISTS books (
+            id TEXT PRIMARY KEY,
+            nomi TEXT NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS parts (
+            id SERIAL PRIMARY KEY,
+            book_id TEXT NOT NULL REFERENCES books(id) ON DELETE CASCADE,
+            nomi TEXT NOT NULL,
+            audio_url TEXT NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS genres (
+            id SERIAL PRIMARY KEY,
+            nomi TEXT UNIQUE NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS book_genres (
+            book_id TEXT NOT NULL REFERENCES books(id) ON DELETE CASCADE,
+            genre_id INTEGER NOT NULL REFERENCES genres(id) ON DELETE CASCADE,
+            PRIMARY KEY (book_id, genre_id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id BIGINT PRIMARY KEY,
+            name TEXT
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS admins (
+            id BIGINT PRIMARY KEY,
+            name TEXT
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS feedback (
+            id BIGINT,               -- user_id
+            name TEXT,
+            username TEXT,
+            text TEXT,
+            created_at TIMESTAMPTZ   -- ISO time
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS book_views (
+            book_name TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_feedback_user_text ON feedback (id, text);",
+    ]),
+    # Raw Telegram updates waiting for a worker (multi-worker mode)
+    Migration(2, "updates queue", [
+        """
+        CREATE TABLE IF NOT EXISTS updates_queue (
+            id BIGSERIAL PRIMARY KEY,
+            update_id BIGINT UNIQUE NOT NULL,
+            chat_id BIGINT,
+            payload JSONB NOT NULL,
+            received_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_updates_queue_chat ON updates_queue (chat_id, id);",
+    ]),
+    # Bot state (user_data, conversation states) for PostgresPersistence
+    Migration(3, "bot state", [
+        """
+        CREATE TABLE IF NOT EXISTS bot_state (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data JSONB NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (kind, key)
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_bot_state_updated ON bot_state (updated_at);",
+    ]),
+    # Lookups found by scripts/check_query_plans.py (the old SQLite schema had the first two)
+    Migration(4, "catalog lookup indexes", [
+        ConcurrentIndex("idx_parts_book_id", "parts (book_id, id)"),
+        ConcurrentIndex("idx_book_genres_genre", "book_genres (genre_id, book_id)"),
+        ConcurrentIndex("idx_books_nomi", "books (nomi)"),
+        ConcurrentIndex("idx_feedback_created", "feedback (created_at DESC NULLS LAST, id DESC)"),
+    ], transactional=False),
+    # Numeric book ids: sort_key replaces the per-row regex cast, the sequence
+    # replaces MAX(id)+1. Text ids stay as they are (sort_key NULL, listed last).
+    Migration(5, "book id sequence", [
+        "ALTER TABLE books ADD COLUMN IF NOT EXISTS sort_key BIGINT;",
+        "UPDATE books SET sort_key = id::bigint WHERE id ~ '^\\d{1,18}$' AND sort_key IS NULL;",
+        "CREATE SEQUENCE IF NOT EXISTS books_id_seq AS BIGINT;",
+        "SELECT setval('books_id_seq', COALESCE((SELECT MAX(sort_key) FROM books), 0) + 1, false);",
+    ]),
+    Migration(6, "book sort key index", [
+        ConcurrentIndex("idx_books_sort_key", "books (sort_key, id)"),
+    ], transactional=False),
+    # Duplicate feedback is rejected at insert time by (user, content hash).
+    # The hash is a generated column, so every writer and the backfill agree on
+    # normalization (whitespace collapsed, lowercase). Replaces the (id, text)
+    # B-tree, which grew with text length and broke on very long messages.
+    Migration(7, "feedback content hash", [
+        """
+        CREATE OR REPLACE FUNCTION feedback_hash(body TEXT) RETURNS BYTEA
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE
+        AS $$ SELECT sha256(convert_to(lower(btrim(regexp_replace(body, '\\s+', ' ', 'g'))), 'UTF8')) $$;
+        """,
+        "ALTER TABLE feedback ADD COLUMN IF NOT EXISTS text_hash BYTEA "
+        "GENERATED ALWAYS AS (feedback_hash(text)) STORED;",
+        # Last on-demand style cleanup, so the unique index can be built
+        """
+        DELETE FROM feedback a
+        USING feedback b
+        WHERE a.id = b.id AND a.text_hash = b.text_hash AND a.ctid > b.ctid;
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_feedback_user_hash ON feedback (id, text_hash);",
+        "DROP INDEX IF EXISTS idx_feedback_user_text;",
+    ]),
+    # Feedback inbox: row id for keyset paging, open/archived status, and
+    # trigger-maintained counters so the inbox header never runs COUNT(*).
+    Migration(8, "feedback inbox and counters", [
+        """
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0
+        );
+        """,
+        "ALTER TABLE feedback ADD COLUMN IF NOT EXISTS fid BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY;",
+        "ALTER TABLE feedback ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'open' "
+        "CHECK (status IN ('open', 'archived'));",
+        "UPDATE feedback SET created_at = 'epoch' WHERE created_at IS NULL;",
+        "ALTER TABLE feedback ALTER COLUMN created_at SET DEFAULT now(), ALTER COLUMN created_at SET NOT NULL;",
+        """
+        CREATE OR REPLACE FUNCTION feedback_counters() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE counters SET value = value - 1 WHERE name = 'feedback_' || OLD.status;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO counters (name, value) VALUES ('feedback_' || NEW.status, 1)
+                ON CONFLICT (name) DO UPDATE SET value = counters.value + 1;
+            END IF;
+            RETURN NULL;
+        END $$;
+        """,
+        "DROP TRIGGER IF EXISTS trg_feedback_counters ON feedback;",
+        """
+        CREATE TRIGGER trg_feedback_counters
+        AFTER INSERT OR DELETE OR UPDATE OF status ON feedback
+        FOR EACH ROW EXECUTE FUNCTION feedback_counters();
+        """,
+        """
+        INSERT INTO counters (name, value)
+        SELECT 'feedback_' || s, (SELECT COUNT(*) FROM feedback WHERE status = s)
+        FROM unnest(ARRAY['open', 'archived']) AS s
+        ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value;
+        """,
+    ]),
+    Migration(9, "feedback inbox indexes", [
+        ConcurrentIndex("idx_feedback_open", "feedback (created_at DESC, fid DESC) WHERE status = 'open'"),
+        ConcurrentIndex("idx_feedback_archived", "feedback (created_at DESC, fid DESC) WHERE status = 'archived'"),
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_feedback_created;",
+    ], transactional=False),
+    # Views belong to a book id, not a title: renames keep their counts and the
+    # ranking joins live books by key. Rows for titles that no longer exist were
+    # never shown anywhere and are dropped.
+    Migration(10, "book views by id", [
+        "ALTER TABLE book_views ADD COLUMN IF NOT EXISTS book_id TEXT;",
+        """
+        UPDATE book_views v SET book_id = b.id
+        FROM books b
+        WHERE b.nomi = v.book_name AND v.book_id IS NULL;
+        """,
+        "DELETE FROM book_views WHERE book_id IS NULL;",
+        "ALTER TABLE book_views DROP CONSTRAINT IF EXISTS book_views_pkey;",
+        "ALTER TABLE book_views ALTER COLUMN book_name DROP NOT NULL;",
+        """
+        ALTER TABLE book_views
+            ADD PRIMARY KEY (book_id),
+            ADD FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE;
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_book_views_rank ON book_views (count DESC, book_id);",
+    ]),
+    # Activity: last_seen is written in bulk by activity.py; DAU/MAU are rolled up
+    # periodically into counters and one history row per day.
+    Migration(11, "user activity", [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS last_seen TIMESTAMPTZ;",
+        """
+        CREATE TABLE IF NOT EXISTS activity_daily (
+            day DATE PRIMARY KEY,
+            dau INTEGER NOT NULL,
+            mau INTEGER NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """,
+    ]),
+    Migration(12, "user activity index", [
+        ConcurrentIndex("idx_users_last_seen", "users (last_seen)"),
+    ], transactional=False),
+    # Unique listeners: one HyperLogLog sketch (hll.py) per book / genre per day.
+    # Ranges of days are merged on read, so no per-user rows are ever stored.
+    Migration(13, "listener sketches", [
+        """
+        CREATE TABLE IF NOT EXISTS listener_sketches (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            day DATE NOT NULL,
+            registers BYTEA NOT NULL,
+            PRIMARY KEY (scope, key, day)
+        );
+        """,
+    ]),
+    # Listening progress: the last part sent per (user, book), written in batches
+    # by progress.py. part_id (not a position) so deleting parts never shifts it.
+    Migration(14, "listening progress", [
+        """
+        CREATE TABLE IF NOT EXISTS listening_progress (
+            user_id BIGINT NOT NULL,
+            book_id TEXT NOT NULL REFERENCES books(id) ON DELETE CASCADE,
+            part_id INTEGER NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (user_id, book_id)
+        );
+        """,
+    ]),
+    # Discovery lists (popular / per-genre popular / trending) precomputed by
+    # discovery.py and replaced as a whole; screens only read this small table.
+    Migration(15, "discovery lists", [
+        """
+        CREATE TABLE IF NOT EXISTS discovery_lists (
+            list TEXT NOT NULL,
+            key TEXT NOT NULL DEFAULT '',
+            position SMALLINT NOT NULL,
+            book_id TEXT NOT NULL REFERENCES books(id) ON DELETE CASCADE,
+            score DOUBLE PRECISION NOT NULL,
+            refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (list, key, position)
+        );
+        """,
+    ]),
+    # Per-book summary for list labels (part count, duration, genres, views) in one
+    # read. Refreshed CONCURRENTLY by summary.py after catalog writes, which needs
+    # the unique index. parts.duration is filled from Telegram when a part is sent.
+    Migration(16, "book summary", [
+        "ALTER TABLE parts ADD COLUMN IF NOT EXISTS duration INTEGER;",
+        """
+        CREATE MATERIALIZED VIEW IF NOT EXISTS book_summary AS
+        SELECT b.id AS book_id, b.nomi, b.sort_key,
+               COALESCE(p.part_count, 0) AS part_count,
+               COALESCE(p.total_duration, 0) AS total_duration,
+               COALESCE(g.genre_ids, '{}') AS genre_ids,
+               COALESCE(v.count, 0) AS views
+        FROM books b
+        LEFT JOIN (
+            SELECT book_id, COUNT(*) AS part_count, SUM(duration) AS total_duration
+            FROM parts GROUP BY book_id
+        ) p ON p.book_id = b.id
+        LEFT JOIN (
+            SELECT book_id, array_agg(genre_id ORDER BY genre_id) AS genre_ids
+            FROM book_genres GROUP BY book_id
+        ) g ON g.book_id = b.id
+        LEFT JOIN book_views v ON v.book_id = b.id;
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_book_summary_id ON book_summary (book_id);",
+    ]),
+    # Stale-state eviction groups a user's rows: the 'user' row is keyed by the user id,
+    # conversation rows by a JSON [chat_id, user_id] list whose last element is the user.
+    # The expression must stay identical to the one in storage.evict_stale_states.
+    Migration(17, "bot state owner index", [
+        ConcurrentIndex(
+            "idx_bot_state_owner",
+            "bot_state ((CASE WHEN kind = 'user' THEN key ELSE key::jsonb ->> -1 END))",
+        ),
+    ], transactional=False),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+# =====================
+# Runner
+# =====================
+
+def current_version(conn: psycopg.Connection) -> int:
+    """Applied schema version; 0 for a database that predates versioning."""
+    with conn.cursor(row_factory=tuple_row) as cur:
+        cur.execute("SELECT to_regclass('schema_version') IS NOT NULL;")
+        if not cur.fetchone()[0]:
+            return 0
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;")
+        return int(cur.fetchone()[0])
+
+
+def _run_statement(cur, stmt: Statement):
+    if isinstance(stmt, str):
+        cur.execute(stmt)
+        return
+    cur.execute(
+        """
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid;
+        """,
+        (stmt.name,),
+    )
+    if cur.fetchone():
+        log.warning("Dropping invalid index %s left by an interrupted build", stmt.name)
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {stmt.name};")
+    unique = "UNIQUE " if stmt.unique else ""
+    cur.execute(f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {stmt.name} ON {stmt.definition};")
+
+
+def _apply(conn: psycopg.Connection, migration: Migration):
+    log.info("Applying schema migration %d: %s", migration.version, migration.name)
+    record = "INSERT INTO schema_version (version, name) VALUES (%s, %s);"
+    if migration.transactional:
+        with conn.transaction(), conn.cursor(row_factory=tuple_row) as cur:
+            for stmt in migration.statements:
+                _run_statement(cur, stmt)
+            cur.execute(record, (migration.version, migration.name))
+    else:
+        with conn.cursor(row_factory=tuple_row) as cur:
+            for stmt in migration.statements:
+                _run_statement(cur, stmt)
+            cur.execute(record, (migration.version, migration.name))
+
+
+def apply_migrations(conn: psycopg.Connection, target: Optional[int] = None) -> int:
+    """
+    Bring the schema up to `target` (default: latest). `conn` must be in autocommit
+    mode. Returns the resulting version.
+    """
+    if not conn.autocommit:
+        raise ValueError("apply_migrations needs an autocommit connection")
+    target = LATEST_VERSION if target is None else target
+
+    # Fast path on every start: one query, no lock
+    version = current_version(conn)
+    if version >= target:
+        return version
+
+    with conn.cursor(row_factory=tuple_row) as cur:
+        # Poll instead of a blocking pg_advisory_lock: a session blocked inside that
+        # call holds a snapshot, and CREATE INDEX CONCURRENTLY in the lock holder waits
+        # for all older snapshots to go away — two replicas starting during a
+        # ConcurrentIndex step would deadlock. Between polls the waiter holds none.
+        while True:
+            cur.execute("SELECT pg_try_advisory_lock(%s);", (MIGRATION_LOCK_ID,))
+            if cur.fetchone()[0]:
+                break
+            log.info("Another process is migrating the schema; waiting")
+            time.sleep(LOCK_POLL_INTERVAL)
+        try:
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+                """
+            )
+            # Another replica may have finished while we waited for the lock
+            version = current_version(conn)
+            for migration in MIGRATIONS:
+                if version < migration.version <= target:
+                    _apply(conn, migration)
+                    version = migration.version
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_ID,))
+    return version
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv(dotenv_path=".env")
+    logging.basicConfig(level=logging.INFO)
+    dsn = os.getenv("DATABASE_URL")
+    if not dsn:
+        raise SystemExit("DATABASE_URL env var is required.")
+    with psycopg.connect(dsn, autocommit=True) as c:
+        print(f"Schema version: {apply_migrations(c)}")
@@ -0,0 +1,222 @@
+import asyncio
+import json
+import logging
+from typing import Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application, BasePersistence, ConversationHandler, PersistenceInput
+
+from storage import load_states, load_state, load_states_by_key, save_states, evict_stale_states
+
+log = logging.getLogger(__name__)
+
+USER = "user"
+CONV_PREFIX = "conv:"
+
+
+def _conv_key(key: Tuple[int, ...]) -> str:
+    return json.dumps(list(key))
+
+
+class PostgresPersistence(BasePersistence):
+    """
+    user_data va ConversationHandler holatlarini bot_state jadvalida saqlaydi.
+
+    Application har update_interval soniyada o'zgargan ("dirty") foydalanuvchilar va
+    suhbatlar uchun update_* chaqiradi; bu yerda ular buferga yig'iladi va bitta
+    tranzaksiyada yoziladi. Qiymatlar JSON bo'lishi kerak (set emas, list).
+    refresh=True bo'lsa, har update oldidan user_data va shu chat/foydalanuvchining
+    suhbat bosqichlari DB'dan yangilanadi (refresh_conversations) — boshqa worker
+    yozgan holatni ko'rish uchun (ko'p workerli rejim, chat workerga bog'lanmagan).
+    """
+
+    def __init__(self, update_interval: float = 5, refresh: bool = False):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.refresh = refresh
+        self._upserts: Dict[Tuple[str, str], str] = {}
+        self._deletes: Dict[Tuple[str, str], None] = {}
+        self._lock = asyncio.Lock()
+
+    # ---------- Buferlangan yozish ----------
+
+    def _stage(self, kind: str, key: str, data) -> None:
+        try:
+            self._upserts[(kind, key)] = json.dumps(data)
+        except (TypeError, ValueError):
+            log.error("%s/%s holatini JSON'ga o'girib bo'lmadi, saqlanmadi", kind, key)
+            return
+        self._deletes.pop((kind, key), None)
+
+    def _stage_delete(self, kind: str, key: str) -> None:
+        self._upserts.pop((kind, key), None)
+        self._deletes[(kind, key)] = None
+
+    async def _write_batch(self) -> None:
+        async with self._lock:
+            # Bir tsikldagi boshqa update_* chaqiruvlari ham buferga tushib olsin
+            await asyncio.sleep(0)
+            if not self._upserts and not self._deletes:
+                return
+            upserts = [(k, key, data) for (k, key), data in self._upserts.items()]
+            deletes = list(self._deletes)
+            self._upserts, self._deletes = {}, {}
+            await asyncio.to_thread(save_states, upserts, deletes)
+
+    # ---------- O'qish ----------
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        rows = await asyncio.to_thread(load_states, USER)
+        return {int(r["key"]): r["data"] for r in rows}
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> Optional[tuple]:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict[Tuple[int, ...], object]:
+        rows = await asyncio.to_thread(load_states, CONV_PREFIX + name)
+        return {tuple(json.loads(r["key"])): r["data"] for r in rows}
+
+    # ---------- Yozish ----------
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        # Bo'sh user_data uchun qator saqlamaymiz — jadval faqat faol holatlar bilan o'sadi
+        if data:
+            self._stage(USER, str(user_id), data)
+        else:
+            self._stage_delete(USER, str(user_id))
+        await self._write_batch()
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key: Tuple[int, ...], new_state: Optional[object]) -> None:
+        if new_state is None:
+            self._stage_delete(CONV_PREFIX + name, _conv_key(key))
+        else:
+            self._stage(CONV_PREFIX + name, _conv_key(key), new_state)
+        await self._write_batch()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._stage_delete(USER, str(user_id))
+        await self._write_batch()
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if not self.refresh:
+            return
+        fresh = await asyncio.to_thread(load_state, USER, str(user_id))
+        user_data.clear()
+        if fresh:
+            user_data.update(fresh)
+
+    async def refresh_conversations(self, app: Application, update: Update) -> None:
+        """
+        PTB suhbat holatini faqat initialize'da o'qiydi. Oldingi qadamni boshqa worker
+        bajargan bo'lsa, bu jarayon xaritasi eskirgan — shuning uchun update bajarilishidan
+        oldin uning kalitlari bir so'rov bilan DB'dan olinadi (yo'q qator = suhbat yo'q).
+        """
+        if not self.refresh:
+            return
+        wanted = {}
+        for name, handler in _conversation_handlers(app).items():
+            key = _conversation_key_for(handler, update)
+            if key is not None:
+                wanted[(CONV_PREFIX + name, _conv_key(key))] = (handler, key)
+        if not wanted:
+            return
+        rows = await asyncio.to_thread(load_states_by_key, list(wanted))
+        found = {(r["kind"], r["key"]): r["data"] for r in rows}
+        for row_key, (handler, key) in wanted.items():
+            _set_conversation_state(handler, key, found.get(row_key))
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        await self._write_batch()
+
+
+def _conversation_handlers(app: Application) -> Dict[str, ConversationHandler]:
+    return {
+        h.name: h for group in app.handlers.values() for h in group
+        if isinstance(h, ConversationHandler) and h.name
+    }
+
+
+def _conversation_key_for(handler: ConversationHandler, update: Update) -> Optional[Tuple[int, ...]]:
+    """ConversationHandler kaliti (per_chat/per_user); kalit yasab bo'lmasa None."""
+    if handler.per_message:
+        return None
+    chat, user = update.effective_chat, update.effective_user
+    key = []
+    if handler.per_chat:
+        if chat is None:
+            return None
+        key.append(chat.id)
+    if handler.per_user:
+        if user is None:
+            return None
+        key.append(user.id)
+    return tuple(key)
+
+
+def _set_conversation_state(handler: ConversationHandler, key: Tuple[int, ...], state: Optional[object]) -> None:
+    """
+    DIQQAT: PTB'ning xususiy atributiga tayanadi — ConversationHandler._conversations
+    (PTB 22 da TrackingDict). Suhbat bosqichini tashqaridan o'rnatish/o'chirish uchun
+    ochiq API yo'q; bu xaritaga murojaat faqat shu funksiyada. PTB yangilanganda tekshiring.
+
+    O'zgarish kuzatilmaydi (.data orqali): holat DB'dan kelgan yoki u yerdan allaqachon
+    o'chirilgan, persistence uni qayta yozmasin. state=None — suhbat yo'q.
+    """
+    conversations = handler._conversations
+    store = getattr(conversations, "data", conversations)
+    if state is None:
+        store.pop(key, None)
+    else:
+        store[key] = state
+
+
+async def evict_stale_state_loop(app: Application, ttl_seconds: int, interval: float = 600):
+    """
+    Tashlab ketilgan holatlarni DB'dan va xotiradan o'chiradi. Bir foydalanuvchining
+    user_data'si va barcha suhbat bosqichlari birga: hech biri ttl_seconds davomida
+    o'zgarmagan bo'lsagina (storage.evict_stale_states). Alohida o'chirilsa, wizard
+    ma'lumotsiz bosqichda qolardi.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            evicted = await asyncio.to_thread(evict_stale_states, ttl_seconds)
+        except Exception:
+            log.exception("Eskirgan holatlarni tozalashda xato")
+            continue
+        conversations = _conversation_handlers(app)
+        for row in evicted:
+            if row["kind"] == USER:
+                app.drop_user_data(int(row["key"]))
+            elif row["kind"].startswith(CONV_PREFIX):
+                handler = conversations.get(row["kind"][len(CONV_PREFIX):])
+                if handler is not None:
+                    _set_conversation_state(handler, tuple(json.loads(row["key"])), None)
+        if evicted:
+            log.info("%d ta eskirgan holat tozalandi", len(evicted))
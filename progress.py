@@ -0,0 +1,81 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from storage import save_progress, get_resume_point
+
+log = logging.getLogger(__name__)
+
+
+class ProgressBuffer:
+    """
+    Har bir foydalanuvchining har kitobda oxirgi yuborilgan qismi.
+
+    note() faqat xotiradagi lug'atni yangilaydi: bir oraliqda bitta kitobdan
+    ketma-ket 10 qism tinglansa ham DB'ga bitta qator yoziladi. Fon vazifasi
+    (run) buferni har flush_interval'da bitta so'rov bilan saqlaydi. resume()
+    hali yozilmagan qatorni ham hisobga oladi — /start hech qachon eskirmaydi.
+    """
+
+    def __init__(self):
+        # user_id -> {book_id: (part_id, vaqt)}
+        self._pending: Dict[int, Dict[str, Tuple[int, datetime]]] = {}
+        self.counters: Dict[str, int] = {"notes": 0, "flushes": 0, "flushed_rows": 0}
+
+    def note(self, user_id: int, book_id: str, part_id: int) -> None:
+        self._pending.setdefault(user_id, {})[str(book_id)] = (part_id, datetime.now(timezone.utc))
+        self.counters["notes"] += 1
+
+    def _latest_pending(self, user_id: int) -> Optional[Tuple[str, int]]:
+        books = self._pending.get(user_id)
+        if not books:
+            return None
+        book_id, (part_id, _) = max(books.items(), key=lambda item: item[1][1])
+        return book_id, part_id
+
+    async def resume(self, user_id: int) -> Optional[Dict]:
+        """Keyingi qism (storage.get_resume_point) yoki None."""
+        return await asyncio.to_thread(get_resume_point, user_id, self._latest_pending(user_id))
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        rows = [
+            (user_id, book_id, part_id, at)
+            for user_id, books in batch.items()
+            for book_id, (part_id, at) in books.items()
+        ]
+        try:
+            await asyncio.to_thread(save_progress, rows)
+        except Exception:
+            # Qaytariladi; oraliqda kelgan yangiroq qismlar ustun
+            for user_id, books in batch.items():
+                current = self._pending.setdefault(user_id, {})
+                for book_id, entry in books.items():
+                    current.setdefault(book_id, entry)
+            raise
+        self.counters["flushes"] += 1
+        self.counters["flushed_rows"] += len(rows)
+
+    async def run(self, flush_interval: float = 30) -> None:
+        try:
+            while True:
+                await asyncio.sleep(flush_interval)
+                try:
+                    await self.flush()
+                except Exception:
+                    log.exception("Tinglash joylarini yozishda xato")
+        finally:
+            # To'xtatilganda (post_stop) bufer yo'qolmasin
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Tinglash joylari buferini yakuniy yozishda xato")
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counters, pending_users=len(self._pending))
+
+
+progress = ProgressBuffer()
@@ -0,0 +1,198 @@
+"""
+Ko'p jarayonli rejim: update'lar PostgreSQL'dagi updates_queue jadvali orqali o'tadi.
+
+  BOT_MODE=receiver  — bitta jarayon: webhook yoki getUpdates'dan kelganini navbatga yozadi.
+  BOT_MODE=worker    — N ta jarayon: navbatdan oladi va main.py'dagi handlerlar bilan bajaradi.
+
+Bitta chat update'lari qat'iy tartibda, turli chatlar parallel bajariladi
+(storage.claim_update). Worker qulasa, faqat u tasdiqlamagan update'lar qayta beriladi.
+"""
+import asyncio
+import contextlib
+import logging
+from typing import Optional
+
+from telegram import Update
+from telegram.error import NetworkError, TimedOut
+from telegram.ext import Application
+
+from config import (
+    RECEIVER_SOURCE, WEBHOOK_URL, WEBHOOK_SECRET,
+    WORKER_CONCURRENCY, WORKER_PARTITIONS, WORKER_INDEX,
+    BACKLOG_DRAIN, BACKLOG_FRESH_SECONDS, METRICS_LOG_SECONDS,
+)
+from storage import enqueue_update, claim_update
+from webhook import WebhookServer, wait_for_stop_signal
+from backlog import drain_backlog
+from persistence import PostgresPersistence
+import metrics
+
+log = logging.getLogger(__name__)
+
+IDLE_SLEEP_MIN = 0.05
+IDLE_SLEEP_MAX = 1.0
+ERROR_SLEEP_MAX = 30.0
+
+
+def _chat_key(payload: dict) -> Optional[int]:
+    """Tartib kaliti: chat id, chat bo'lmasa foydalanuvchi id."""
+    update = Update.de_json(payload, None)
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+
+async def _enqueue(payload: dict):
+    await asyncio.to_thread(enqueue_update, int(payload["update_id"]), _chat_key(payload), payload)
+
+
+# ==================== Receiver ====================
+
+async def _poll_into_queue(app: Application, stop: asyncio.Event):
+    offset = None
+    try:
+        while not stop.is_set():
+            try:
+                updates = await app.bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
+                for update in updates:
+                    # Navbatga yozilgandan keyingina offset suriladi — yo'qotish bo'lmaydi
+                    await _enqueue(update.to_dict())
+                    offset = update.update_id + 1
+            except (NetworkError, TimedOut):
+                await asyncio.sleep(1)
+            except Exception:
+                # Masalan, DB xatosi _enqueue'da: offset surilmagan, o'sha update qayta olinadi
+                log.exception("getUpdates → navbat: xato, %s s dan keyin qayta urinamiz", ERROR_SLEEP_MAX)
+                await asyncio.sleep(ERROR_SLEEP_MAX)
+    finally:
+        # To'xtatilganda oxirgi offset Telegram'ga tasdiqlanadi: aks holda qayta ishga
+        # tushganda oxirgi paket yana keladi, ular esa allaqachon ack qilinib o'chirilgan
+        # (UNIQUE(update_id) ularni ushlay olmaydi) — ikki marta bajarilardi.
+        if offset is not None:
+            try:
+                await app.bot.get_updates(offset=offset, timeout=0, allowed_updates=Update.ALL_TYPES)
+            except Exception:
+                log.exception("Oxirgi offset'ni (%s) tasdiqlab bo'lmadi", offset)
+
+
+async def _receive(app: Application):
+    # Secret'siz webhook'ni hech narsa boshlanmasidan oldin rad etamiz
+    server = WebhookServer(_enqueue) if RECEIVER_SOURCE != "polling" else None
+    if server is not None:
+        metrics.register("webhook", server.stats)
+    # Receiver post_init'ni chaqirmaydi: ko'rsatkichlar logi shu yerda
+    reporter = asyncio.create_task(metrics.run(METRICS_LOG_SECONDS), name="metrics")
+    await app.bot.initialize()
+    try:
+        if BACKLOG_DRAIN and (RECEIVER_SOURCE == "polling" or WEBHOOK_URL):
+            # Workerlar o'chiq paytdagi eskirgan tap'larni umuman ko'rmaydi
+            await drain_backlog(app.bot, lambda u: _enqueue(u.to_dict()), BACKLOG_FRESH_SECONDS)
+        if RECEIVER_SOURCE == "polling":
+            await app.bot.delete_webhook()
+            stop = asyncio.Event()
+            poller = asyncio.create_task(_poll_into_queue(app, stop))
+            await wait_for_stop_signal()
+            stop.set()
+            poller.cancel()
+            await asyncio.gather(poller, return_exceptions=True)
+        else:
+            if WEBHOOK_URL:
+                await app.bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET,
+                                          allowed_updates=Update.ALL_TYPES)
+            await server.start()
+            try:
+                await wait_for_stop_signal()
+            finally:
+                await server.stop()
+    finally:
+        reporter.cancel()
+        await app.bot.shutdown()
+
+
+def run_receiver(app: Application):
+    asyncio.run(_receive(app))
+
+
+# ==================== Worker ====================
+
+async def _worker_slot(app: Application, stop: asyncio.Event):
+    idle = IDLE_SLEEP_MIN
+    backoff = IDLE_SLEEP_MAX
+    while not stop.is_set():
+        try:
+            lease = await asyncio.to_thread(
+                claim_update, WORKER_CONCURRENCY, WORKER_PARTITIONS, WORKER_INDEX
+            )
+        except Exception:
+            # PoolTimeout, OperationalError va h.k.: slot o'lmasin — kutib, qayta urinadi
+            log.exception("Navbatdan update olishda xato, %.1f s dan keyin qayta urinamiz", backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, ERROR_SLEEP_MAX)
+            continue
+        backoff = IDLE_SLEEP_MAX
+        if lease is None:
+            await asyncio.sleep(idle)
+            idle = min(idle * 2, IDLE_SLEEP_MAX)
+            continue
+        idle = IDLE_SLEEP_MIN
+        update = Update.de_json(lease.payload, app.bot)
+        if isinstance(app.persistence, PostgresPersistence):
+            try:
+                # Oldingi qadam boshqa workerda bo'lgan bo'lishi mumkin: suhbat bosqichi DB'dan
+                await app.persistence.refresh_conversations(app, update)
+            except Exception:
+                # Eski bosqich bilan bajarmaymiz: update navbatga qaytadi
+                log.exception("Update %s uchun suhbat holatini o'qishda xato", lease.id)
+                with contextlib.suppress(Exception):
+                    await asyncio.to_thread(lease.release)
+                await asyncio.sleep(backoff)
+                continue
+        try:
+            await app.process_update(update)
+        except asyncio.CancelledError:
+            await asyncio.to_thread(lease.release)
+            raise
+        except Exception:
+            # Xato handler xatolari process_update ichida ushlanadi; bu yerga kelgani
+            # "zaharli" update — qayta-qayta aylanmasligi uchun baribir tasdiqlaymiz.
+            log.exception("Update %s ni bajarishda xato", lease.id)
+        try:
+            if app.persistence:
+                # Keyingi update boshqa workerga tushsa ham yangi holatni ko'rsin
+                await app.update_persistence()
+        except Exception:
+            log.exception("Update %s dan keyin holatni saqlashda xato", lease.id)
+        try:
+            await asyncio.to_thread(lease.ack)
+        except Exception:
+            # Ulanish pool'ga qaytadi va rollback bo'ladi — update qayta beriladi
+            log.exception("Update %s ni tasdiqlashda xato", lease.id)
+            await asyncio.sleep(backoff)
+
+
+async def _work(app: Application):
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    stop = asyncio.Event()
+    try:
+        await app.start()
+        slots = [asyncio.create_task(_worker_slot(app, stop)) for _ in range(max(1, WORKER_CONCURRENCY))]
+        await wait_for_stop_signal()
+        stop.set()
+        # Joriy update'lar tugashini kutamiz
+        await asyncio.gather(*slots, return_exceptions=True)
+    finally:
+        if app.running:
+            await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+def run_worker(app: Application):
+    asyncio.run(_work(app))
@@ -0,0 +1,149 @@
+import asyncio
+import contextlib
+import logging
+import random
+import time
+from typing import Any, Callable, Coroutine, Dict, Optional, Union
+
+from telegram.constants import FloodLimit
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+log = logging.getLogger(__name__)
+
+
+def _seconds(value) -> float:
+    """RetryAfter.retry_after int yoki timedelta bo'lishi mumkin."""
+    if hasattr(value, "total_seconds"):
+        return float(value.total_seconds())
+    return float(value)
+
+
+class _Bucket:
+    """Token bucket. Tokenni oldindan band qiladi va kutish vaqtini qaytaradi."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def idle(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """
+    Bot API so'rovlarini umumiy va chat bo'yicha tezlik chegarasida ushlab turadi.
+    RetryAfter kelsa, barcha so'rovlarni to'xtatib, jitter bilan qayta urinadi.
+    aiolimiter'ga bog'liq emas (AIORateLimiter o'rniga).
+    """
+
+    MAX_CHAT_BUCKETS = 4096
+
+    def __init__(
+        self,
+        overall_max_rate: float = FloodLimit.MESSAGES_PER_SECOND,
+        private_max_rate: float = FloodLimit.MESSAGES_PER_SECOND_PER_CHAT,
+        group_max_rate: float = FloodLimit.MESSAGES_PER_MINUTE_PER_GROUP / 60,
+        chat_burst: int = 3,
+        max_retries: int = 3,
+        jitter: float = 0.5,
+    ):
+        self._overall = _Bucket(overall_max_rate, overall_max_rate) if overall_max_rate else None
+        self._private_max_rate = private_max_rate
+        self._group_max_rate = group_max_rate
+        self._chat_burst = chat_burst
+        self._chats: Dict[Union[int, str], _Bucket] = {}
+        self._max_retries = max_retries
+        self._jitter = jitter
+        self._resume = asyncio.Event()
+        self._resume.set()
+        self.counters: Dict[str, int] = {
+            "requests": 0,
+            "throttled": 0,
+            "retries": 0,
+            "retry_failures": 0,
+        }
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counters, chats_tracked=len(self._chats))
+
+    def _chat_bucket(self, chat_id: Union[int, str], now: float) -> Optional[_Bucket]:
+        bucket = self._chats.get(chat_id)
+        if bucket is not None:
+            return bucket
+        # Guruh/kanal: manfiy id yoki @username
+        is_group = isinstance(chat_id, str) or chat_id < 0
+        rate = self._group_max_rate if is_group else self._private_max_rate
+        if not rate:
+            return None
+        if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+            for key in [k for k, b in self._chats.items() if b.idle(now)]:
+                del self._chats[key]
+        bucket = self._chats[chat_id] = _Bucket(rate, max(float(self._chat_burst), rate))
+        return bucket
+
+    async def _throttle(self, chat_id) -> None:
+        now = time.monotonic()
+        delay = 0.0
+        if chat_id is not None:
+            bucket = self._chat_bucket(chat_id, now)
+            if bucket is not None:
+                delay = bucket.reserve(now)
+            if self._overall is not None:
+                delay = max(delay, self._overall.reserve(now))
+        if delay > 0:
+            self.counters["throttled"] += 1
+            await asyncio.sleep(delay)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ):
+        max_retries = self._max_retries if rate_limit_args is None else rate_limit_args
+        chat_id = data.get("chat_id")
+        with contextlib.suppress(ValueError, TypeError):
+            chat_id = int(chat_id)
+
+        self.counters["requests"] += 1
+        for attempt in range(max_retries + 1):
+            await self._resume.wait()
+            await self._throttle(chat_id)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                if attempt == max_retries:
+                    self.counters["retry_failures"] += 1
+                    log.warning("%s: RetryAfter %d urinishdan keyin ham takrorlandi", endpoint, attempt + 1)
+                    raise
+                self.counters["retries"] += 1
+                pause = _seconds(exc.retry_after) + random.uniform(0, self._jitter) * (attempt + 1)
+                log.info("%s: RetryAfter, %.2f s kutamiz", endpoint, pause)
+                self._resume.clear()
+                try:
+                    await asyncio.sleep(pause)
+                finally:
+                    self._resume.set()
+        return None
@@ -0,0 +1,139 @@
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import BaseHandler
+
+# callback_data formati: "prefix:arg1:arg2" (masalan "part:12:3").
+# Eski tugmalar ("part_12_3") ham legacy prefiks orqali tan olinadi.
+SEP = ":"
+# Telegram callback_data chegarasi (baytlarda)
+MAX_DATA_BYTES = 64
+
+
+def cb(prefix: str, *args) -> str:
+    """callback_data yasash: cb("part", 12, 3) -> "part:12:3"."""
+    return SEP.join([prefix, *map(str, args)])
+
+
+def fits(data: str) -> bool:
+    """Tugmaga sig'adimi: uzun matnli id'lar 64 baytdan oshishi mumkin."""
+    return len(data.encode()) <= MAX_DATA_BYTES
+
+
+def parse(data: str, prefix: str, *types: type) -> Optional[list]:
+    """
+    cb() teskarisi — routerdan o'tmaydigan ConversationHandler callback'lari uchun:
+    parse("bulkbook:2:abc", "bulkbook", int, str) -> [2, "abc"]. Mos kelmasa None.
+    """
+    head, sep, rest = data.partition(SEP)
+    if head != prefix or not sep:
+        return None
+    return _convert(types, _split_args(rest, len(types), SEP))
+
+
+def _split_args(rest: str, arity: int, sep: str) -> list:
+    # Oxirgi argument qolgan qismni to'liq oladi (matnli id ichida ajratkich bo'lsa ham)
+    return rest.split(sep, max(arity - 1, 0)) if rest else []
+
+
+def _convert(types: Tuple[type, ...], raw_args: list) -> Optional[list]:
+    if len(raw_args) != len(types):
+        return None
+    try:
+        return [t(a) for t, a in zip(types, raw_args)]
+    except (TypeError, ValueError):
+        return None
+
+
+class CallbackRouter(BaseHandler):
+    """
+    Bitta CallbackQueryHandler o'rniga: callback_data bir marta ajratiladi va
+    dict orqali kerakli korutinaga yo'naltiriladi. Argumentlar turlarga o'giriladi
+    va handler ichida context.args orqali olinadi.
+    Marshrutlash vaqti marshrutlar soniga bog'liq emas (O(1) dict lookup).
+    """
+
+    def __init__(self):
+        super().__init__(self._unreachable)
+        self._exact: Dict[str, Callable] = {}
+        self._prefix: Dict[str, Tuple[Callable, Tuple[type, ...]]] = {}
+        self._legacy: Dict[str, str] = {}
+        self.hits: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {"routed": 0, "passed": 0, "resolve_ns": 0}
+
+    @staticmethod
+    async def _unreachable(update, context):
+        raise RuntimeError("CallbackRouter.handle_update must be used")
+
+    # ---------- Ro'yxatga olish ----------
+
+    def exact(self, data: str, handler: Callable) -> None:
+        self._exact[data] = handler
+
+    def prefix(self, prefix: str, handler: Callable, *types: type, legacy: Optional[str] = None) -> None:
+        self._prefix[prefix] = (handler, types)
+        if legacy:
+            # "book_" -> "book": eski "book_12" tugmalari ham ishlaydi.
+            # Legacy prefiksning o'zida "_" bo'lishi mumkin ("remove_admin_").
+            self._legacy[legacy.rstrip("_")] = prefix
+
+    # ---------- Marshrutlash ----------
+
+    def _decode(self, prefix: str, rest: str, sep: str) -> Optional[Tuple[Callable, list]]:
+        route = self._prefix.get(prefix)
+        if route is None:
+            return None
+        handler, types = route
+        args = _convert(types, _split_args(rest, len(types), sep))
+        return None if args is None else (handler, args)
+
+    def resolve(self, data: str) -> Optional[Tuple[Callable, list]]:
+        handler = self._exact.get(data)
+        if handler is not None:
+            return handler, []
+        if SEP in data:
+            prefix, _, rest = data.partition(SEP)
+            return self._decode(prefix, rest, SEP)
+        return self._resolve_legacy(data)
+
+    def _resolve_legacy(self, data: str) -> Optional[Tuple[Callable, list]]:
+        """
+        Eski "prefiks_arg1_arg2" formati. Prefiks har bir "_" chegarasida qidiriladi;
+        oxirgi argument qolgan qismni to'liq oladi (id ichida "_" bo'lsa ham).
+        """
+        pos = data.find("_")
+        while pos > 0:
+            prefix = self._legacy.get(data[:pos])
+            rest = data[pos + 1:]
+            if prefix is not None and rest:
+                result = self._decode(prefix, rest, "_")
+                if result is not None:
+                    return result
+            pos = data.find("_", pos + 1)
+        return None
+
+    def check_update(self, update: object):
+        if not isinstance(update, Update) or update.callback_query is None:
+            return None
+        data = update.callback_query.data
+        if not isinstance(data, str):
+            return None
+        started = time.perf_counter_ns()
+        result = self.resolve(data)
+        self.counters["resolve_ns"] += time.perf_counter_ns() - started
+        if result is None:
+            self.counters["passed"] += 1
+        return result
+
+    async def handle_update(self, update: Update, application, check_result, context) -> Any:
+        handler, args = check_result
+        context.args = args
+        self.counters["routed"] += 1
+        self.hits[handler.__name__] = self.hits.get(handler.__name__, 0) + 1
+        return await handler(update, context)
+
+    def stats(self) -> Dict[str, Any]:
+        checked = self.counters["routed"] + self.counters["passed"]
+        avg_ns = self.counters["resolve_ns"] // checked if checked else 0
+        return dict(self.counters, avg_resolve_ns=avg_ns, routes=len(self._exact) + len(self._prefix))
@@ -0,0 +1,361 @@
+"""
+Query-plan regression check for storage.py.
+
+Loads a large synthetic catalog into a scratch schema of a local PostgreSQL, captures
+the SQL of every public storage.py function (by running it against a recording
+connection) and runs EXPLAIN (FORMAT JSON) on each statement. Fails when:
+  - a plan seq-scans a large table (unless the function is a full listing by design);
+  - a plan's estimated cost grew more than --tolerance over the checked-in baseline;
+  - a storage.py function has no entry in CALLS (new queries must be covered).
+
+How to run (never against production — it only needs a throwaway database):
+  1) $env:PLAN_CHECK_DATABASE_URL = 'postgresql://postgres@localhost:5432/postgres'
+  2) python scripts/check_query_plans.py                    # check
+     python scripts/check_query_plans.py --update-baseline  # accept current costs
+"""
+
+import argparse
+import inspect
+import json
+import os
+import sys
+from contextlib import contextmanager
+from datetime import date, datetime
+from pathlib import Path
+
+import psycopg
+from psycopg.rows import dict_row
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+# Deliberately no DATABASE_URL fallback: that is production
+DSN = os.getenv("PLAN_CHECK_DATABASE_URL")
+# storage.py requires DATABASE_URL at import; its pool is never used here
+os.environ["DATABASE_URL"] = "postgresql://localhost/unused"
+
+import storage  # noqa: E402
+from migrations import apply_migrations  # noqa: E402
+
+SCHEMA = "plan_check"
+BASELINE_PATH = ROOT / "scripts" / "query_plans.baseline.json"
+SEQ_SCAN_MIN_ROWS = 1000
+
+# function name -> (args, allow_seq_scan). Args point at rows the loader creates.
+CALLS = {
+    "add_book": ((None, "Yangi kitob"), False),
+    "create_book": (("Yangi kitob", [1, 2], ["https://t.me/kanal/1", "https://t.me/kanal/2"]), False),
+    "get_book": (("777",), False),
+    "get_book_by_title": (("Kitob 777",), False),
+    "get_books": ((), True),          # full listing
+    "delete_book": (("777",), False),
+    "update_book_title": (("777", "Yangi nom"), False),
+    "add_part": (("777", "1-qism", "https://example.com/a.mp3"), False),
+    "get_parts": (("777",), False),
+    "delete_part_by_index": (("777", 3), False),
+    "set_part_duration": ((7770, 1800), False),
+    "get_book_summaries": ((["777", "778", "779"],), False),
+    "add_genre": (("Yangi janr",), False),
+    "get_genres": ((), True),
+    "delete_genre": ((7,), False),
+    "link_book_genre": (("777", 7), False),
+    "clear_book_genres": (("777",), False),
+    "get_genres_for_book": (("777",), False),
+    "set_book_genres": (("777", [1, 2, 3]), False),
+    "set_genres_for_books": (({"777": [1, 2], "778": [3], "779": []},), False),
+    "get_books_by_genre": ((7,), True),   # ~10% of the catalog: hash join over books is the cheaper plan
+    "update_genre_books": ((7, ["777", "778"], ["779"]), False),
+    "load_genre_index": ((), True),   # full catalog snapshot by design
+    "add_user": ((123456789, "Ali"), False),
+    "get_users": ((), True),
+    "add_admin": ((1, "Admin"), False),
+    "get_admins": ((), True),
+    "delete_admin": ((1,), False),
+    "add_feedback": ((777, "Ali", "ali", "Rahmat!"), False),
+    "get_feedback_page": (("open", "older", 50000, 10), False),
+    "set_feedback_status": ((50000, "archived"), False),
+    "get_counters": (("feedback_open", "feedback_archived"), False),
+    "touch_users": (([1, 2, 3],), False),
+    "rollup_activity": (("Asia/Tashkent",), True),  # users_total is a periodic full count
+    "increment_book_view": (("777",), False),
+    "get_book_stats_page": ((200, 20), False),
+    "get_genre_ids_for_books": ((["777", "778", "779"],), False),
+    "save_listener_sketches": ((date(2024, 1, 1), [("book", "777", b"\x01\x00\x01\x01")]), False),
+    "load_listener_sketches": (("genre", ["1", "2", "3"], date(2024, 1, 1)), False),
+    "load_recent_listener_sketches": (("book", date(2024, 1, 1)), True),  # background job, whole scope
+    "get_top_books_per_genre": ((10,), True),   # background job, ranks every genre
+    "replace_discovery_lists": (([("popular", "", "777", 5.0)],), True),  # DELETE of the small cache
+    "load_discovery_lists": ((), True),
+    "save_progress": (([(777, "777", 7770, datetime(2024, 1, 1))],), False),
+    "get_resume_point": ((777,), False),
+    "enqueue_update": ((10 ** 9, 777, {"update_id": 10 ** 9}), False),
+    "claim_update": ((), False),
+    "count_queued_updates": ((), True),
+    "load_states": (("user",), True),  # loads every state of a kind at startup
+    "load_state": (("user", "777"), False),
+    "load_states_by_key": (([("user", "777"), ("conv:add_book", "[777, 777]")],), False),
+    "save_states": (([("user", "777", "{}")], [("user", "778")]), False),
+    "evict_stale_states": ((86400,), False),
+}
+# Not query functions (or DDL only)
+SKIP = {
+    "init_db", "get_conn", "single_flight", "single_flight_stats", "apply_migrations", "catalog_work",
+    "catalog_version", "refresh_book_summary",
+}
+
+SYNTHETIC_DATA = [
+    "INSERT INTO books (id, nomi, sort_key) SELECT g::text, 'Kitob ' || g, g FROM generate_series(1, 20000 * %(scale)s) g;",
+    """
+    INSERT INTO parts (book_id, nomi, audio_url)
+    SELECT b::text, p || '-qism', 'https://example.com/' || b || '/' || p || '.mp3'
+    FROM generate_series(1, 20000 * %(scale)s) b, generate_series(1, 10) p;
+    """,
+    "INSERT INTO genres (nomi) SELECT 'Janr ' || g FROM generate_series(1, 40) g;",
+    """
+    INSERT INTO book_genres (book_id, genre_id)
+    SELECT b::text, 1 + (b * k) %% 40 FROM generate_series(1, 20000 * %(scale)s) b, generate_series(1, 3) k
+    ON CONFLICT DO NOTHING;
+    """,
+    """
+    INSERT INTO users (id, name, last_seen)
+    SELECT g, 'User ' || g, CASE WHEN g %% 10 = 0 THEN now() - (g %% 90) * interval '1 day' END
+    FROM generate_series(1, 100000 * %(scale)s) g;
+    """,
+    "INSERT INTO admins (id, name) SELECT g, 'Admin ' || g FROM generate_series(1, 5) g;",
+    """
+    INSERT INTO feedback (id, name, username, text, created_at)
+    SELECT g %% 5000, 'User', 'user', 'Fikr ' || g, now() - g * interval '1 minute'
+    FROM generate_series(1, 100000 * %(scale)s) g;
+    """,
+    """
+    INSERT INTO book_views (book_id, book_name, count)
+    SELECT g::text, 'Kitob ' || g, g %% 500 FROM generate_series(1, 20000 * %(scale)s) g;
+    """,
+    """
+    INSERT INTO listener_sketches (scope, key, day, registers)
+    SELECT s, k::text, current_date - d, '\\x0100000101'::bytea
+    FROM unnest(ARRAY['book', 'genre']) s, generate_series(1, 2000 * %(scale)s) k, generate_series(0, 29) d;
+    """,
+    """
+    INSERT INTO listening_progress (user_id, book_id, part_id, updated_at)
+    SELECT u, (1 + u * k %% (20000 * %(scale)s))::text, u * k, now() - k * interval '1 day'
+    FROM generate_series(1, 50000 * %(scale)s) u, generate_series(1, 3) k
+    ON CONFLICT DO NOTHING;
+    """,
+    "REFRESH MATERIALIZED VIEW book_summary;",
+    """
+    INSERT INTO updates_queue (update_id, chat_id, payload)
+    SELECT g, g %% 5000, jsonb_build_object('update_id', g) FROM generate_series(1, 50000 * %(scale)s) g;
+    """,
+    """
+    INSERT INTO bot_state (kind, key, data, updated_at)
+    SELECT 'user', g::text, '{}'::jsonb, now() - g * interval '1 second'
+    FROM generate_series(1, 50000 * %(scale)s) g;
+    """,
+]
+
+
+# ---------- Capturing storage.py SQL ----------
+
+class _AnyRow(dict):
+    """fetchone() result that lets code paths continue (every column reads as 0)."""
+
+    def __missing__(self, key):
+        return 0
+
+    def __bool__(self):
+        return True
+
+
+class _RecordingCursor:
+    rowcount = 0
+
+    def __init__(self, sink):
+        self.sink = sink
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.sink.append((query, params))
+
+    def executemany(self, query, params_seq):
+        params_seq = list(params_seq)
+        if params_seq:
+            self.sink.append((query, params_seq[0]))
+
+    def fetchone(self):
+        return _AnyRow()
+
+    def fetchall(self):
+        return []
+
+
+class _RecordingConn:
+    def __init__(self, sink):
+        self.sink = sink
+        self.row_factory = None
+
+    def cursor(self):
+        return _RecordingCursor(self.sink)
+
+    @contextmanager
+    def transaction(self):
+        yield
+
+    @contextmanager
+    def pipeline(self):
+        yield
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class _RecordingPool:
+    def __init__(self, sink):
+        self.sink = sink
+
+    def getconn(self):
+        return _RecordingConn(self.sink)
+
+    def putconn(self, conn):
+        pass
+
+
+def capture_statements(name, args):
+    sink = []
+
+    @contextmanager
+    def fake_get_conn():
+        yield _RecordingConn(sink)
+
+    real_get_conn, real_lease_pool = storage.get_conn, storage._get_lease_pool
+    storage.get_conn = fake_get_conn
+    storage._get_lease_pool = lambda size: _RecordingPool(sink)
+    try:
+        result = getattr(storage, name)(*args)
+        if hasattr(result, "ack"):
+            result.ack()
+    finally:
+        storage.get_conn, storage._get_lease_pool = real_get_conn, real_lease_pool
+    return sink
+
+
+def storage_functions():
+    return sorted(
+        name for name, fn in inspect.getmembers(storage, inspect.isfunction)
+        if fn.__module__ == "storage" and not name.startswith("_") and name not in SKIP
+    )
+
+
+# ---------- Plans ----------
+
+def _walk(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk(child)
+
+
+def explain(conn, query, params):
+    with psycopg.ClientCursor(conn) as cur:
+        cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+        plan = cur.fetchone()[0]
+    return plan[0]["Plan"]
+
+
+def table_rows(conn):
+    with conn.cursor(row_factory=dict_row) as cur:
+        cur.execute(
+            """
+            SELECT c.relname, c.reltuples::bigint AS n FROM pg_class c
+            JOIN pg_namespace ns ON ns.oid = c.relnamespace
+            WHERE ns.nspname = %s AND c.relkind = 'r';
+            """,
+            (SCHEMA,),
+        )
+        return {r["relname"]: r["n"] for r in cur.fetchall()}
+
+
+def load_catalog(conn, scale):
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+        cur.execute(f"CREATE SCHEMA {SCHEMA};")
+        cur.execute(f"SET search_path = {SCHEMA};")
+    apply_migrations(conn)
+    with conn.cursor() as cur:
+        for stmt in SYNTHETIC_DATA:
+            cur.execute(stmt, {"scale": scale})
+        cur.execute("ANALYZE;")
+    print(f"✔ synthetic catalog loaded into schema {SCHEMA} (scale {scale}).")
+
+
+def check(conn, baseline, tolerance):
+    rows = table_rows(conn)
+    costs, failures = {}, []
+
+    missing = [n for n in storage_functions() if n not in CALLS]
+    for name in missing:
+        failures.append(f"{name}: no entry in CALLS — add one so its queries are checked")
+
+    for name, (args, allow_seq) in CALLS.items():
+        for i, (query, params) in enumerate(capture_statements(name, args)):
+            key = f"{name}#{i}"
+            plan = explain(conn, query, params)
+            costs[key] = plan["Total Cost"]
+            for node in _walk(plan):
+                rel = node.get("Relation Name")
+                if (node["Node Type"] == "Seq Scan" and not allow_seq
+                        and rows.get(rel, 0) >= SEQ_SCAN_MIN_ROWS):
+                    failures.append(f"{key}: Seq Scan on {rel} (~{rows[rel]} rows)")
+            old = baseline.get(key)
+            if old is not None and costs[key] > old * (1 + tolerance):
+                failures.append(f"{key}: cost {costs[key]:.1f} > baseline {old:.1f} (+{tolerance:.0%})")
+            print(f"  {key:<28} cost={costs[key]:>12.2f}")
+    return costs, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=1, help="synthetic catalog size multiplier")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed cost growth vs baseline")
+    parser.add_argument("--update-baseline", action="store_true", help="write current costs to the baseline")
+    parser.add_argument("--keep", action="store_true", help=f"keep the {SCHEMA} schema for inspection")
+    opts = parser.parse_args()
+
+    if not DSN:
+        raise SystemExit("PLAN_CHECK_DATABASE_URL env var is required (a throwaway database, never production).")
+
+    baseline = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+    if not baseline and not opts.update_baseline:
+        raise SystemExit(f"{BASELINE_PATH.name} is missing; create it with --update-baseline and commit it.")
+
+    conn = psycopg.connect(DSN, autocommit=True)
+    try:
+        load_catalog(conn, opts.scale)
+        costs, failures = check(conn, baseline, opts.tolerance)
+        if opts.update_baseline:
+            BASELINE_PATH.write_text(json.dumps(costs, indent=2, sort_keys=True) + "\n")
+            print(f"✔ baseline written: {BASELINE_PATH}")
+    finally:
+        if not opts.keep:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+        conn.close()
+
+    if failures:
+        print("❌ Query plan check failed:")
+        for f in failures:
+            print("   -", f)
+        raise SystemExit(1)
+    print("✅ All storage.py query plans OK.")
+
+
+if __name__ == "__main__":
+    main()
@@ -29,6 +29,7 @@ from storage import (
     add_user,
     add_admin,
     add_feedback,
+    get_book_by_title,
     increment_book_view,
 )
 
@@ -174,10 +175,13 @@ def migrate_book_views() -> Tuple[int, int]:
         if not book_name:
             skipped += 1
             continue
+        # Ko'rishlar endi kitob id'siga bog'langan — nomi bo'yicha topamiz
+        book = get_book_by_title(book_name)
+        if not book:
+            skipped += 1
+            continue
         try:
-            # count marta increment qilamiz (kichik son bo'lsa ok; juda katta bo'lsa sekinlashishi mumkin)
-            for _ in range(cnt):
-                increment_book_view(book_name)
+            increment_book_view(book["id"], cnt)
             added += 1
         except Exception:
             skipped += 1
@@ -12,6 +12,7 @@ import sys
 import sqlite3
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
 
 import psycopg
 from psycopg.rows import dict_row
@@ -38,75 +39,10 @@ def ensure_schema_with_storage():
 
 
 def ensure_schema_with_fallback(conn: psycopg.Connection):
-    """Create tables and indexes directly (fallback if storage not importable)."""
-    ddl = [
-        # Books
-        """
-        CREATE TABLE IF NOT EXISTS books (
-            id TEXT PRIMARY KEY,
-            nomi TEXT NOT NULL
-        );
-        """,
-        # Parts (audio chapters)
-        """
-        CREATE TABLE IF NOT EXISTS parts (
-            id SERIAL PRIMARY KEY,
-            book_id TEXT NOT NULL REFERENCES books(id) ON DELETE CASCADE,
-            nomi TEXT NOT NULL,
-            audio_url TEXT NOT NULL
-        );
-        """,
-        # Genres and M2M link
-        """
-        CREATE TABLE IF NOT EXISTS genres (
-            id SERIAL PRIMARY KEY,
-            nomi TEXT UNIQUE NOT NULL
-        );
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS book_genres (
-            book_id TEXT NOT NULL REFERENCES books(id) ON DELETE CASCADE,
-            genre_id INTEGER NOT NULL REFERENCES genres(id) ON DELETE CASCADE,
-            PRIMARY KEY (book_id, genre_id)
-        );
-        """,
-        # Users & Admins
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id BIGINT PRIMARY KEY,
-            name TEXT
-        );
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS admins (
-            id BIGINT PRIMARY KEY,
-            name TEXT
-        );
-        """,
-        # Feedback
-        """
-        CREATE TABLE IF NOT EXISTS feedback (
-            id BIGINT,               -- user_id
-            name TEXT,
-            username TEXT,
-            text TEXT,
-            created_at TIMESTAMPTZ
-        );
-        """,
-        # Book views
-        """
-        CREATE TABLE IF NOT EXISTS book_views (
-            book_name TEXT PRIMARY KEY,
-            count INTEGER NOT NULL DEFAULT 0
-        );
-        """,
-        # Helpful index
-        "CREATE INDEX IF NOT EXISTS idx_feedback_user_text ON feedback (id, text);",
-    ]
-    with conn.cursor() as cur:
-        for stmt in ddl:
-            cur.execute(stmt)
-    print("Schema created via fallback DDL.")
+    """Apply schema migrations directly on this connection (fallback if storage not importable)."""
+    from migrations import apply_migrations
+    version = apply_migrations(conn)
+    print(f"Schema created via migrations (version {version}).")
 
 
 def try_parse_dt(value):
@@ -160,11 +96,30 @@ def _bump_seq(conn: psycopg.Connection, table: str, col: str = "id"):
             cur.execute("SELECT setval(%s, %s, %s);", (seq, int(max_id), True))
 
 
+def _sort_key(book_id) -> Optional[int]:
+    """Numeric book ids sort (and allocate) by number; same rule as storage.add_book."""
+    txt = str(book_id)
+    return int(txt) if txt.isascii() and txt.isdigit() and len(txt) <= 18 else None
+
+
+def _bump_books_seq(conn: psycopg.Connection):
+    """books.id is TEXT, so books_id_seq is not a serial: move it past the imported numeric ids."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT setval('books_id_seq', m)
+            FROM (SELECT MAX(sort_key) AS m FROM books) s
+            WHERE m > (SELECT last_value FROM books_id_seq);
+            """
+        )
+
+
 def fix_sequences(conn: psycopg.Connection):
     """Fix sequences for tables with SERIAL ids after explicit inserts."""
     _bump_seq(conn, "parts", "id")
     _bump_seq(conn, "genres", "id")
-    print("Sequences fixed (parts.id, genres.id).")
+    _bump_books_seq(conn)
+    print("Sequences fixed (parts.id, genres.id, books_id_seq).")
 
 
 def main():
@@ -193,8 +148,8 @@ def main():
         # --- books ---
         for r in sc.execute("SELECT id, nomi FROM books"):
             pc.execute(
-                "INSERT INTO books (id, nomi) VALUES (%s, %s) ON CONFLICT (id) DO NOTHING;",
-                (r["id"], r["nomi"])
+                "INSERT INTO books (id, nomi, sort_key) VALUES (%s, %s, %s) ON CONFLICT (id) DO NOTHING;",
+                (str(r["id"]), r["nomi"], _sort_key(r["id"]))
             )
         print("✔ books migrated.")
 
@@ -244,18 +199,22 @@ def main():
             dt = try_parse_dt(r["created_at"])
             if dt is None:
                 dt = datetime.utcnow()
+            # Same text from the same user is stored once (uq_feedback_user_hash), as in add_feedback
             pc.execute(
-                "INSERT INTO feedback (id, name, username, text, created_at) VALUES (%s, %s, %s, %s, %s);",
+                "INSERT INTO feedback (id, name, username, text, created_at) VALUES (%s, %s, %s, %s, %s) "
+                "ON CONFLICT (id, text_hash) DO NOTHING;",
                 (r["id"], r["name"], r["username"], r["text"], dt)
             )
         print("✔ feedback migrated.")
 
         # --- book_views ---
         for r in sc.execute("SELECT book_name, count FROM book_views"):
+            # views are keyed by book id now: resolve the title to a book
             pc.execute(
-                "INSERT INTO book_views (book_name, count) VALUES (%s, %s) "
-                "ON CONFLICT (book_name) DO UPDATE SET count = EXCLUDED.count;",
-                (r["book_name"], r["count"])
+                "INSERT INTO book_views (book_id, book_name, count) "
+                "SELECT id, nomi, %s FROM books WHERE nomi = %s ORDER BY id LIMIT 1 "
+                "ON CONFLICT (book_id) DO UPDATE SET count = EXCLUDED.count;",
+                (r["count"], r["book_name"])
             )
         print("✔ book_views migrated.")
 
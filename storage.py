@@ -1,12 +1,20 @@
 import os
+import copy
+import functools
+import threading
 from contextlib import contextmanager
-from datetime import datetime
-from typing import List, Dict, Optional
+from datetime import date, datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
 import psycopg
 from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
 from psycopg_pool import ConnectionPool
 
+from genre_index import genre_index
+from hll import merge_bytes
+from migrations import apply_migrations
+
 # --- Connection pool ---
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
@@ -21,102 +29,134 @@ def get_conn():
         conn.row_factory = dict_row
         yield conn
 
+# =====================
+# 🛬 Single-flight reads
+# =====================
+
+class _Flight:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+_flights: Dict[tuple, _Flight] = {}
+_flights_lock = threading.Lock()
+single_flight_stats = {"queries": 0, "shared": 0}
+
+def single_flight(fn):
+    """
+    Concurrent identical calls (same function and arguments) share one in-flight
+    query: the first caller runs it, the others wait and get a deep copy of its
+    result, so no caller can mutate rows another caller is holding.
+    Nothing is cached after the query finishes. Only for read-only functions.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = (fn.__name__, args, tuple(sorted(kwargs.items())))
+        with _flights_lock:
+            flight = _flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _flights[key] = _Flight()
+                single_flight_stats["queries"] += 1
+            else:
+                flight.waiters += 1
+                single_flight_stats["shared"] += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            flight.error = e
+            with _flights_lock:
+                _flights.pop(key, None)
+            flight.done.set()
+            raise
+        with _flights_lock:
+            _flights.pop(key, None)
+        # no new waiters after the pop; keep a pristine copy only if someone is waiting
+        if flight.waiters:
+            flight.result = copy.deepcopy(result)
+        flight.done.set()
+        return result
+    return wrapper
+
 # =====================
 # 🔧 Init & Schema
 # =====================
 
 def init_db():
-    """Create tables and indexes if not exist (PostgreSQL version)."""
-    ddl_statements = [
-        # Books
-        """
-        CREATE TABLE IF NOT EXISTS books (
-            id TEXT PRIMARY KEY,
-            nomi TEXT NOT NULL
-        );
-        """,
-        # Parts (audio chapters)
-        """
-        CREATE TABLE IF NOT EXISTS parts (
-            id SERIAL PRIMARY KEY,
-            book_id TEXT NOT NULL REFERENCES books(id) ON DELETE CASCADE,
-            nomi TEXT NOT NULL,
-            audio_url TEXT NOT NULL
-        );
-        """,
-        # Genres and M2M link
-        """
-        CREATE TABLE IF NOT EXISTS genres (
-            id SERIAL PRIMARY KEY,
-            nomi TEXT UNIQUE NOT NULL
-        );
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS book_genres (
-            book_id TEXT NOT NULL REFERENCES books(id) ON DELETE CASCADE,
-            genre_id INTEGER NOT NULL REFERENCES genres(id) ON DELETE CASCADE,
-            PRIMARY KEY (book_id, genre_id)
-        );
-        """,
-        # Users & Admins
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id BIGINT PRIMARY KEY,
-            name TEXT
-        );
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS admins (
-            id BIGINT PRIMARY KEY,
-            name TEXT
-        );
-        """,
-        # Feedback
-        """
-        CREATE TABLE IF NOT EXISTS feedback (
-            id BIGINT,               -- user_id
-            name TEXT,
-            username TEXT,
-            text TEXT,
-            created_at TIMESTAMPTZ   -- ISO time
-        );
-        """,
-        # Book views
-        """
-        CREATE TABLE IF NOT EXISTS book_views (
-            book_name TEXT PRIMARY KEY,
-            count INTEGER NOT NULL DEFAULT 0
-        );
-        """,
-        # Helpful index for feedback dedupe
-        """
-        CREATE INDEX IF NOT EXISTS idx_feedback_user_text ON feedback (id, text);
-        """,
-    ]
+    """Bring the schema up to date (see migrations.py). A no-op version check when current."""
     with get_conn() as conn:
-        with conn.cursor() as cur:
-            for stmt in ddl_statements:
-                cur.execute(stmt)
+        apply_migrations(conn)
 
 # =====================
 # 📚 Books
 # =====================
 
-def get_next_book_id() -> str:
-    """Return next numeric string id based on max(id::int)."""
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("SELECT MAX(CASE WHEN id ~ '^\\d+$' THEN id::int ELSE NULL END) AS m FROM books;")
-        row = cur.fetchone()
-        mx = row["m"] if row and row["m"] is not None else 0
-        return str(int(mx) + 1)
+# Bumped by every catalog write in this process; summary.py refreshes book_summary when it moves
+_catalog_version = 0
 
-def add_book(book_id: str, nomi: str):
-    with get_conn() as conn, conn.cursor() as cur:
+def _catalog_changed():
+    global _catalog_version
+    _catalog_version += 1
+
+def catalog_version() -> int:
+    return _catalog_version
+
+def _numeric_id(book_id: str) -> Optional[int]:
+    return int(book_id) if book_id.isascii() and book_id.isdigit() and len(book_id) <= 18 else None
+
+def _insert_book(cur, book_id: Optional[str], nomi: str) -> Tuple[str, Optional[int], bool]:
+    """Insert a book on `cur`; returns (id, sort_key, inserted). See add_book."""
+    if book_id is None:
+        while True:
+            cur.execute(
+                """
+                INSERT INTO books (id, nomi, sort_key)
+                SELECT n::text, %s, n FROM nextval('books_id_seq') AS n
+                ON CONFLICT (id) DO NOTHING
+                RETURNING id, sort_key;
+                """,
+                (nomi,)
+            )
+            row = cur.fetchone()
+            if row:
+                return row["id"], row["sort_key"], True
+    sort_key = _numeric_id(book_id)
+    cur.execute(
+        "INSERT INTO books (id, nomi, sort_key) VALUES (%s, %s, %s) ON CONFLICT (id) DO NOTHING RETURNING id;",
+        (book_id, nomi, sort_key)
+    )
+    inserted = cur.fetchone() is not None
+    if sort_key is not None:
         cur.execute(
-            "INSERT INTO books (id, nomi) VALUES (%s, %s) ON CONFLICT (id) DO NOTHING;",
-            (book_id, nomi)
+            "SELECT setval('books_id_seq', %s) WHERE %s > (SELECT last_value FROM books_id_seq);",
+            (sort_key, sort_key)
         )
+    return book_id, sort_key, inserted
 
+def add_book(book_id: Optional[str], nomi: str) -> str:
+    """
+    Insert a book and return its id. With book_id=None the id is allocated from
+    books_id_seq in the same statement, so concurrent admins never collide;
+    numbers already taken by imported ids are skipped.
+    Explicit ids (imports) are kept; numeric ones move the sequence past them.
+    """
+    with get_conn() as conn, conn.cursor() as cur:
+        book_id, sort_key, inserted = _insert_book(cur, book_id, nomi)
+    if inserted:
+        genre_index.book_added(book_id, nomi, sort_key)
+        _catalog_changed()
+    return book_id
+
+@single_flight
 def get_book(book_id: str) -> Optional[Dict]:
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute("SELECT * FROM books WHERE id = %s;", (book_id,))
@@ -129,18 +169,23 @@ def get_book_by_title(title: str) -> Optional[Dict]:
         row = cur.fetchone()
         return dict(row) if row else None
 
+@single_flight
 def get_books() -> List[Dict]:
     with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("SELECT * FROM books ORDER BY (CASE WHEN id ~ '^\\d+$' THEN id::int ELSE NULL END), id;")
+        cur.execute("SELECT * FROM books ORDER BY sort_key, id;")
         return list(cur.fetchall())
 
 def delete_book(book_id: str):
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute("DELETE FROM books WHERE id = %s;", (book_id,))
+    genre_index.book_deleted(book_id)
+    _catalog_changed()
 
 def update_book_title(book_id: str, new_title: str):
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute("UPDATE books SET nomi = %s WHERE id = %s;", (new_title, book_id))
+    genre_index.book_renamed(book_id, new_title)
+    _catalog_changed()
 
 # =====================
 # 🎧 Parts
@@ -152,12 +197,24 @@ def add_part(book_id: str, nomi: str, audio_url: str):
             "INSERT INTO parts (book_id, nomi, audio_url) VALUES (%s, %s, %s);",
             (book_id, nomi, audio_url)
         )
+    _catalog_changed()
 
+@single_flight
 def get_parts(book_id: str) -> List[Dict]:
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute("SELECT * FROM parts WHERE book_id = %s ORDER BY id;", (book_id,))
         return list(cur.fetchall())
 
+def set_part_duration(part_id: int, seconds: int):
+    """Record a part's length (known once Telegram has sent it); set only once."""
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            "UPDATE parts SET duration = %s WHERE id = %s AND duration IS NULL;",
+            (seconds, part_id)
+        )
+        if cur.rowcount:
+            _catalog_changed()
+
 def delete_part_by_index(book_id: str, index: int):
     """Delete the N-th part (0-based) within a book by order of id."""
     with get_conn() as conn, conn.cursor() as cur:
@@ -168,6 +225,7 @@ def delete_part_by_index(book_id: str, index: int):
         row = cur.fetchone()
         if row:
             cur.execute("DELETE FROM parts WHERE id = %s;", (row["id"],))
+    _catalog_changed()
 
 # =====================
 # 🏷 Genres
@@ -176,10 +234,14 @@ def delete_part_by_index(book_id: str, index: int):
 def add_genre(nomi: str):
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
-            "INSERT INTO genres (nomi) VALUES (%s) ON CONFLICT (nomi) DO NOTHING;",
+            "INSERT INTO genres (nomi) VALUES (%s) ON CONFLICT (nomi) DO NOTHING RETURNING id;",
             (nomi,)
         )
+        row = cur.fetchone()
+    if row:
+        genre_index.genre_added(row["id"], nomi)
 
+@single_flight
 def get_genres() -> List[Dict]:
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute("SELECT * FROM genres ORDER BY nomi;")
@@ -188,6 +250,8 @@ def get_genres() -> List[Dict]:
 def delete_genre(genre_id: int):
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute("DELETE FROM genres WHERE id = %s;", (genre_id,))
+    genre_index.genre_deleted(genre_id)
+    _catalog_changed()
 
 def link_book_genre(book_id: str, genre_id: int):
     with get_conn() as conn, conn.cursor() as cur:
@@ -195,11 +259,16 @@ def link_book_genre(book_id: str, genre_id: int):
             "INSERT INTO book_genres (book_id, genre_id) VALUES (%s, %s) ON CONFLICT DO NOTHING;",
             (book_id, genre_id)
         )
+    genre_index.genre_linked(book_id, genre_id)
+    _catalog_changed()
 
 def clear_book_genres(book_id: str):
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute("DELETE FROM book_genres WHERE book_id = %s;", (book_id,))
+    genre_index.genres_set(book_id, [])
+    _catalog_changed()
 
+@single_flight
 def get_genres_for_book(book_id: str) -> List[Dict]:
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
@@ -213,15 +282,113 @@ def get_genres_for_book(book_id: str) -> List[Dict]:
         )
         return list(cur.fetchall())
 
-def set_book_genres(book_id: str, genre_ids: List[int]):
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("DELETE FROM book_genres WHERE book_id = %s;", (book_id,))
-        for gid in genre_ids:
-            cur.execute(
-                "INSERT INTO book_genres (book_id, genre_id) VALUES (%s, %s) ON CONFLICT DO NOTHING;",
-                (book_id, gid)
+def set_book_genres(book_id: str, genre_ids: List[int]) -> Dict[str, int]:
+    return set_genres_for_books({book_id: genre_ids})
+
+def _lock_books(cur, book_ids: List[str]) -> List[str]:
+    """
+    Row-lock the given books in id order (so concurrent writers serialize instead of
+    deadlocking) and return the ids that exist. Must run as its own statement inside
+    a transaction: under READ COMMITTED only the *next* statement gets a snapshot that
+    includes whatever a writer we waited for has just committed.
+    """
+    cur.execute("SELECT id FROM books WHERE id = ANY(%s) ORDER BY id FOR UPDATE;", (book_ids,))
+    return [r["id"] for r in cur.fetchall()]
+
+def set_genres_for_books(genres_by_book: Dict[str, List[int]]) -> Dict[str, int]:
+    """
+    Make each book's genres exactly the given list, for many books in one transaction.
+    Only the difference is written: links that are no longer wanted are deleted,
+    missing ones inserted, untouched ones stay. Readers never see a book without its
+    genres mid-update. The books are locked first (see _lock_books), so concurrent
+    edits of the same book serialize and the last one wins exactly.
+    Unknown books and genres are ignored. Returns {"added": n, "removed": m}.
+    """
+    if not genres_by_book:
+        return {"added": 0, "removed": 0}
+    pairs = sorted({(b, int(g)) for b, gids in genres_by_book.items() for g in gids})
+    with get_conn() as conn, conn.transaction(), conn.cursor() as cur:
+        locked = _lock_books(cur, sorted(genres_by_book))
+        cur.execute(
+            """
+            WITH desired AS (
+                SELECT d.book_id, d.genre_id
+                FROM unnest(%(pair_books)s::text[], %(pair_genres)s::int[]) AS d(book_id, genre_id)
+                JOIN genres g ON g.id = d.genre_id
+                WHERE d.book_id = ANY(%(books)s)
+            ), removed AS (
+                DELETE FROM book_genres bg
+                WHERE bg.book_id = ANY(%(books)s)
+                  AND NOT EXISTS (
+                      SELECT 1 FROM desired d WHERE d.book_id = bg.book_id AND d.genre_id = bg.genre_id
+                  )
+                RETURNING bg.book_id, bg.genre_id
+            ), added AS (
+                INSERT INTO book_genres (book_id, genre_id)
+                SELECT book_id, genre_id FROM desired
+                ON CONFLICT DO NOTHING
+                RETURNING book_id, genre_id
+            )
+            SELECT false AS added, book_id, genre_id FROM removed
+            UNION ALL
+            SELECT true, book_id, genre_id FROM added;
+            """,
+            {
+                "books": locked,
+                "pair_books": [b for b, _ in pairs],
+                "pair_genres": [g for _, g in pairs],
+            }
+        )
+        rows = cur.fetchall()
+    added = [(r["book_id"], r["genre_id"]) for r in rows if r["added"]]
+    removed = [(r["book_id"], r["genre_id"]) for r in rows if not r["added"]]
+    genre_index.links_changed(added, removed)
+    if added or removed:
+        _catalog_changed()
+    return {"added": len(added), "removed": len(removed)}
+
+def update_genre_books(genre_id: int, add: List[str], remove: List[str]) -> Dict[str, int]:
+    """
+    Link `add` books to one genre and unlink `remove` books, in one transaction
+    (books locked first, like set_genres_for_books). Links to other genres are
+    never touched. Unknown books are ignored. Returns {"added": n, "removed": m}.
+    """
+    if not add and not remove:
+        return {"added": 0, "removed": 0}
+    with get_conn() as conn, conn.transaction(), conn.cursor() as cur:
+        locked = set(_lock_books(cur, sorted(set(add) | set(remove))))
+        cur.execute(
+            """
+            WITH removed AS (
+                DELETE FROM book_genres
+                WHERE genre_id = %(genre_id)s AND book_id = ANY(%(remove)s)
+                RETURNING book_id
+            ), added AS (
+                INSERT INTO book_genres (book_id, genre_id)
+                SELECT b.id, g.id FROM unnest(%(add)s::text[]) AS b(id)
+                JOIN genres g ON g.id = %(genre_id)s
+                ON CONFLICT DO NOTHING
+                RETURNING book_id
             )
+            SELECT false AS added, book_id FROM removed
+            UNION ALL
+            SELECT true, book_id FROM added;
+            """,
+            {
+                "genre_id": genre_id,
+                "add": sorted(locked.intersection(add)),
+                "remove": sorted(locked.intersection(remove)),
+            }
+        )
+        rows = cur.fetchall()
+    added = [(r["book_id"], genre_id) for r in rows if r["added"]]
+    removed = [(r["book_id"], genre_id) for r in rows if not r["added"]]
+    genre_index.links_changed(added, removed)
+    if added or removed:
+        _catalog_changed()
+    return {"added": len(added), "removed": len(removed)}
 
+@single_flight
 def get_books_by_genre(genre_id: int) -> List[Dict]:
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
@@ -229,20 +396,130 @@ def get_books_by_genre(genre_id: int) -> List[Dict]:
             SELECT b.* FROM books b
             JOIN book_genres bg ON bg.book_id = b.id
             WHERE bg.genre_id = %s
-            ORDER BY (CASE WHEN b.id ~ '^\\d+$' THEN b.id::int ELSE NULL END), b.id;
+            ORDER BY b.sort_key, b.id;
             """,
             (genre_id,)
         )
         return list(cur.fetchall())
 
+def load_genre_index() -> bool:
+    """
+    (Re)build the in-memory genre index (genre_index.py) from the catalog.
+    Returns False if a local write raced the snapshot; the next load picks it up.
+    """
+    generation = genre_index.generation
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT id, nomi, sort_key FROM books;")
+        books = cur.fetchall()
+        cur.execute("SELECT id, nomi FROM genres;")
+        genres = cur.fetchall()
+        cur.execute("SELECT book_id, genre_id FROM book_genres;")
+        links = cur.fetchall()
+    return genre_index.load(books, genres, links, generation)
+
+# =====================
+# 🧮 Book summary
+# =====================
+
+def refresh_book_summary():
+    """Recompute book_summary without blocking readers (needs idx_book_summary_id)."""
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY book_summary;")
+
+def get_book_summaries(book_ids: Optional[List[str]] = None) -> List[Dict]:
+    """
+    {book_id, nomi, sort_key, part_count, total_duration, genre_ids, views} per book,
+    in list order, as of the last refresh. All books, or only `book_ids`.
+    """
+    with get_conn() as conn, conn.cursor() as cur:
+        if book_ids is None:
+            cur.execute("SELECT * FROM book_summary ORDER BY sort_key, book_id;")
+        else:
+            cur.execute(
+                "SELECT * FROM book_summary WHERE book_id = ANY(%s) ORDER BY sort_key, book_id;",
+                (list(book_ids),)
+            )
+        return list(cur.fetchall())
+
+# =====================
+# 🧾 Unit of work
+# =====================
+
+class CatalogWork:
+    """
+    Catalog writes queued on one connection inside one transaction (see catalog_work).
+    Statements are pipelined: only add_book waits for its result (the new id);
+    everything else goes out without a round trip each and is confirmed at COMMIT.
+    In-memory genre index updates are deferred until the commit succeeded.
+    """
+
+    def __init__(self, cur):
+        self._cur = cur
+        self._after_commit: List[Callable[[], None]] = []
+
+    def add_book(self, book_id: Optional[str], nomi: str) -> str:
+        book_id, sort_key, inserted = _insert_book(self._cur, book_id, nomi)
+        if inserted:
+            self._after_commit.append(lambda: genre_index.book_added(book_id, nomi, sort_key))
+        return book_id
+
+    def link_genres(self, book_id: str, genre_ids: List[int]):
+        """Add links to existing genres (unknown ids are skipped)."""
+        if not genre_ids:
+            return
+        genre_ids = sorted({int(g) for g in genre_ids})
+        self._cur.execute(
+            """
+            INSERT INTO book_genres (book_id, genre_id)
+            SELECT %s, id FROM genres WHERE id = ANY(%s)
+            ON CONFLICT DO NOTHING;
+            """,
+            (book_id, genre_ids)
+        )
+        self._after_commit.append(
+            lambda: genre_index.links_changed([(book_id, g) for g in genre_ids if genre_index.genre_name(g)], [])
+        )
+
+    def add_parts(self, book_id: str, parts: List[Tuple[str, str]]):
+        """Append (nomi, audio_url) parts in the given order."""
+        if parts:
+            self._cur.executemany(
+                "INSERT INTO parts (book_id, nomi, audio_url) VALUES (%s, %s, %s);",
+                [(book_id, nomi, url) for nomi, url in parts]
+            )
+
+@contextmanager
+def catalog_work():
+    """
+    with catalog_work() as work: ...  — all statements commit together or not at all.
+    Uses psycopg pipeline mode, so a whole add-book flow costs about two round trips
+    (the id allocation, then the rest with COMMIT) instead of one per statement.
+    """
+    with get_conn() as conn:
+        with conn.pipeline(), conn.transaction(), conn.cursor() as cur:
+            work = CatalogWork(cur)
+            yield work
+        for apply in work._after_commit:
+            apply()
+        _catalog_changed()
+
+def create_book(nomi: str, genre_ids: List[int], part_urls: List[str]) -> str:
+    """The add-book flow as one unit of work: new book, its genres and its parts ("1-qism", ...)."""
+    with catalog_work() as work:
+        book_id = work.add_book(None, nomi)
+        work.link_genres(book_id, genre_ids)
+        work.add_parts(book_id, [(f"{i}-qism", url) for i, url in enumerate(part_urls, start=1)])
+    return book_id
+
 # =====================
 # 👥 Users & Admins
 # =====================
 
 def add_user(user_id: int, name: str):
     with get_conn() as conn, conn.cursor() as cur:
+        # last_seen is set here so a new user counts before the next activity flush
         cur.execute(
-            "INSERT INTO users (id, name) VALUES (%s, %s) ON CONFLICT (id) DO NOTHING;",
+            "INSERT INTO users (id, name, last_seen) VALUES (%s, %s, now()) ON CONFLICT (id) DO NOTHING;",
             (user_id, name)
         )
 
@@ -271,64 +548,561 @@ def delete_admin(admin_id: int):
 # 💬 Feedback
 # =====================
 
-def add_feedback(user_id: int, name: str, username: Optional[str], text: str):
+def add_feedback(user_id: int, name: str, username: Optional[str], text: str) -> bool:
+    """
+    Store feedback; return False if it is empty or this user already sent the same
+    text (compared by feedback.text_hash, see migration 7).
+    """
     text_norm = (text or "").strip()
     if not text_norm:
-        return
+        return False
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
-            "INSERT INTO feedback (id, name, username, text, created_at) VALUES (%s, %s, %s, %s, %s);",
+            """
+            INSERT INTO feedback (id, name, username, text, created_at) VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (id, text_hash) DO NOTHING
+            RETURNING 1 AS added;
+            """,
             (user_id, name, username, text_norm, datetime.utcnow())
         )
+        return cur.fetchone() is not None
 
-def get_feedback(limit: int = 10) -> List[Dict]:
+FEEDBACK_STATUSES = ("open", "archived")
+
+def get_feedback_page(status: str = "open", direction: str = "older",
+                      cursor: Optional[int] = None, limit: int = 10) -> List[Dict]:
+    """
+    One page of feedback with `status`, newest first, by (created_at, fid) keyset
+    (partial index per status). `cursor` is the fid of the last row shown when
+    going "older", or of the first row shown when going "newer".
+    Returns up to limit + 1 rows: the extra one only means more exist that way.
+    """
     with get_conn() as conn, conn.cursor() as cur:
+        if cursor is None:
+            cur.execute(
+                """
+                SELECT * FROM feedback WHERE status = %s
+                ORDER BY created_at DESC, fid DESC
+                LIMIT %s;
+                """,
+                (status, limit + 1)
+            )
+            return list(cur.fetchall())
+        if direction == "older":
+            cur.execute(
+                """
+                SELECT * FROM feedback
+                WHERE status = %s
+                  AND (created_at, fid) < (SELECT created_at, fid FROM feedback WHERE fid = %s)
+                ORDER BY created_at DESC, fid DESC
+                LIMIT %s;
+                """,
+                (status, cursor, limit + 1)
+            )
+            return list(cur.fetchall())
         cur.execute(
             """
             SELECT * FROM feedback
-            ORDER BY created_at DESC NULLS LAST, id DESC
+            WHERE status = %s
+              AND (created_at, fid) > (SELECT created_at, fid FROM feedback WHERE fid = %s)
+            ORDER BY created_at, fid
             LIMIT %s;
             """,
+            (status, cursor, limit + 1)
+        )
+        return list(cur.fetchall())
+
+def set_feedback_status(fid: int, status: str) -> bool:
+    if status not in FEEDBACK_STATUSES:
+        raise ValueError(f"unknown feedback status: {status}")
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            "UPDATE feedback SET status = %s WHERE fid = %s AND status <> %s;",
+            (status, fid, status)
+        )
+        return cur.rowcount > 0
+
+# =====================
+# 🔢 Counters
+# =====================
+
+def get_counters(*names: str) -> Dict[str, int]:
+    """Current values of trigger-maintained counters (missing ones read as 0)."""
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT name, value FROM counters WHERE name = ANY(%s);", (list(names),))
+        found = {r["name"]: int(r["value"]) for r in cur.fetchall()}
+    return {n: found.get(n, 0) for n in names}
+
+# =====================
+# 📈 Activity
+# =====================
+
+def touch_users(user_ids: List[int]):
+    """
+    Set last_seen = now() for a batch of users in one statement.
+    Only existing users are touched: registration stays with add_user (/start).
+    """
+    if not user_ids:
+        return
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE users AS u SET last_seen = now()
+            FROM unnest(%s::bigint[]) AS t(id)
+            WHERE u.id = t.id;
+            """,
+            (sorted(user_ids),)  # fixed lock order: replicas never deadlock each other
+        )
+
+def rollup_activity(tz: str) -> Dict[str, int]:
+    """
+    Recompute DAU (since midnight in `tz`), MAU (last 30 days) and the user total,
+    store them in counters ('dau', 'mau', 'users_total') and in activity_daily.
+    DAU/MAU read only the recent range of idx_users_last_seen.
+    """
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            WITH c AS (
+                SELECT
+                    COUNT(*) FILTER (
+                        WHERE last_seen >= date_trunc('day', now() AT TIME ZONE %(tz)s) AT TIME ZONE %(tz)s
+                    ) AS dau,
+                    COUNT(*) AS mau
+                FROM users
+                WHERE last_seen >= now() - interval '30 days'
+            ), daily AS (
+                INSERT INTO activity_daily (day, dau, mau)
+                SELECT (now() AT TIME ZONE %(tz)s)::date, dau, mau FROM c
+                ON CONFLICT (day) DO UPDATE
+                    SET dau = EXCLUDED.dau, mau = EXCLUDED.mau, updated_at = now()
+            )
+            INSERT INTO counters (name, value)
+            SELECT name, value FROM c, LATERAL (VALUES
+                ('dau', c.dau),
+                ('mau', c.mau),
+                ('users_total', (SELECT COUNT(*) FROM users))
+            ) AS v(name, value)
+            ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value
+            RETURNING name, value;
+            """,
+            {"tz": tz}
+        )
+        return {r["name"]: int(r["value"]) for r in cur.fetchall()}
+
+# =====================
+# 👁 Book Views
+# =====================
+
+def increment_book_view(book_id: str, by: int = 1):
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO book_views (book_id, count) VALUES (%s, %s)
+            ON CONFLICT (book_id) DO UPDATE SET count = book_views.count + EXCLUDED.count;
+            """,
+            (book_id, by)
+        )
+
+def get_book_stats_page(offset: int = 0, limit: int = 20) -> List[Dict]:
+    """
+    Most viewed books first: {id, nomi, count} for positions offset+1 .. offset+limit,
+    plus one extra row if another page exists. Walks idx_book_views_rank.
+    """
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT b.id, b.nomi, v.count
+            FROM book_views v
+            JOIN books b ON b.id = v.book_id
+            ORDER BY v.count DESC, v.book_id
+            LIMIT %s OFFSET %s;
+            """,
+            (limit + 1, offset)
+        )
+        return list(cur.fetchall())
+
+# =====================
+# 👂 Unique listeners
+# =====================
+
+def get_genre_ids_for_books(book_ids: List[str]) -> Dict[str, List[int]]:
+    """{book_id: [genre_id, ...]} for a batch of books in one query (books without genres are omitted)."""
+    if not book_ids:
+        return {}
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT book_id, array_agg(genre_id ORDER BY genre_id) AS genre_ids
+            FROM book_genres
+            WHERE book_id = ANY(%s)
+            GROUP BY book_id;
+            """,
+            (list(book_ids),)
+        )
+        return {r["book_id"]: r["genre_ids"] for r in cur.fetchall()}
+
+def save_listener_sketches(day: date, items: Iterable[Tuple[str, str, bytes]]):
+    """
+    Merge (scope, key, sketch bytes) into the stored sketches of `day` in one
+    transaction. Existing rows are locked in key order and merged register-wise,
+    so concurrent writers (replicas) never lose each other's listeners.
+    """
+    merged: Dict[Tuple[str, str], bytes] = {}
+    for scope, key, blob in items:
+        merged[(scope, str(key))] = merge_bytes(merged.get((scope, str(key))), blob)
+    if not merged:
+        return
+    keys = sorted(merged)
+    with get_conn() as conn, conn.transaction(), conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT s.scope, s.key, s.registers
+            FROM listener_sketches s
+            JOIN unnest(%s::text[], %s::text[]) AS k(scope, key)
+              ON s.scope = k.scope AND s.key = k.key
+            WHERE s.day = %s
+            ORDER BY s.scope, s.key
+            FOR UPDATE OF s;
+            """,
+            ([k[0] for k in keys], [k[1] for k in keys], day)
+        )
+        for r in cur.fetchall():
+            k = (r["scope"], r["key"])
+            merged[k] = merge_bytes(bytes(r["registers"]), merged[k])
+        cur.executemany(
+            """
+            INSERT INTO listener_sketches (scope, key, day, registers) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (scope, key, day) DO UPDATE SET registers = EXCLUDED.registers;
+            """,
+            [(scope, key, day, merged[(scope, key)]) for scope, key in keys]
+        )
+
+def load_listener_sketches(scope: str, keys: List[str], since: date) -> Dict[str, List[bytes]]:
+    """{key: [sketch bytes per day]} for days >= since; merge them with hll.HyperLogLog.union."""
+    if not keys:
+        return {}
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT key, registers FROM listener_sketches
+            WHERE scope = %s AND key = ANY(%s) AND day >= %s;
+            """,
+            (scope, [str(k) for k in keys], since)
+        )
+        out: Dict[str, List[bytes]] = {}
+        for r in cur.fetchall():
+            out.setdefault(r["key"], []).append(bytes(r["registers"]))
+        return out
+
+def load_recent_listener_sketches(scope: str, since: date) -> List[Dict]:
+    """All {key, day, registers} of a scope for days >= since (background jobs only)."""
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT key, day, registers FROM listener_sketches
+            WHERE scope = %s AND day >= %s;
+            """,
+            (scope, since)
+        )
+        return [dict(r, registers=bytes(r["registers"])) for r in cur.fetchall()]
+
+# =====================
+# 🔥 Discovery lists
+# =====================
+
+def get_top_books_per_genre(limit: int = 10) -> List[Dict]:
+    """Most viewed books of every genre: {genre_id, book_id, count}, `limit` per genre."""
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT genre_id, book_id, count FROM (
+                SELECT bg.genre_id, bg.book_id, v.count,
+                       row_number() OVER (PARTITION BY bg.genre_id ORDER BY v.count DESC, bg.book_id) AS rn
+                FROM book_genres bg
+                JOIN book_views v ON v.book_id = bg.book_id
+            ) ranked
+            WHERE rn <= %s
+            ORDER BY genre_id, rn;
+            """,
             (limit,)
         )
         return list(cur.fetchall())
 
-def deduplicate_feedback() -> int:
-    """Remove duplicate rows with same (id, text); keep the oldest (smallest ctid). Return removed count."""
+def replace_discovery_lists(rows: List[Tuple[str, str, str, float]]):
+    """Swap in a new set of (list, key, book_id, score) rows, positions in given order, atomically."""
+    positions: Dict[Tuple[str, str], int] = {}
+    params = []
+    for list_name, key, book_id, score in rows:
+        pos = positions[(list_name, key)] = positions.get((list_name, key), 0) + 1
+        params.append((list_name, key, pos, book_id, score))
+    with get_conn() as conn, conn.transaction(), conn.cursor() as cur:
+        cur.execute("DELETE FROM discovery_lists;")
+        if params:
+            # A book deleted since the lists were computed is simply left out
+            cur.executemany(
+                """
+                INSERT INTO discovery_lists (list, key, position, book_id, score)
+                SELECT %s, %s, %s, id, %s FROM books WHERE id = %s;
+                """,
+                [(l, k, p, sc, b) for l, k, p, b, sc in params]
+            )
+
+def load_discovery_lists() -> List[Dict]:
+    """All cached rows with book titles: {list, key, position, book_id, nomi, score, refreshed_at}."""
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT d.list, d.key, d.position, d.book_id, b.nomi, d.score, d.refreshed_at
+            FROM discovery_lists d
+            JOIN books b ON b.id = d.book_id
+            ORDER BY d.list, d.key, d.position;
+            """
+        )
+        return list(cur.fetchall())
+
+# =====================
+# ▶️ Listening progress
+# =====================
+
+def save_progress(rows: List[Tuple[int, str, int, datetime]]):
+    """
+    Upsert (user_id, book_id, part_id, listened_at) rows in one statement.
+    Rows for books deleted meanwhile are skipped; an older timestamp (a late
+    flush from another replica) never overwrites a newer one.
+    """
+    if not rows:
+        return
+    rows = sorted(rows, key=lambda r: (r[0], r[1]))  # fixed lock order
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
             """
-            WITH deleted AS (
-                DELETE FROM feedback a
-                USING feedback b
-                WHERE a.id = b.id
-                  AND a.text = b.text
-                  AND a.ctid > b.ctid
-                RETURNING 1
+            INSERT INTO listening_progress (user_id, book_id, part_id, updated_at)
+            SELECT r.user_id, r.book_id, r.part_id, r.updated_at
+            FROM unnest(%s::bigint[], %s::text[], %s::int[], %s::timestamptz[])
+                AS r(user_id, book_id, part_id, updated_at)
+            JOIN books b ON b.id = r.book_id
+            ON CONFLICT (user_id, book_id) DO UPDATE
+                SET part_id = EXCLUDED.part_id, updated_at = EXCLUDED.updated_at
+                WHERE listening_progress.updated_at <= EXCLUDED.updated_at;
+            """,
+            ([r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows], [r[3] for r in rows])
+        )
+
+def get_resume_point(user_id: int, pending: Optional[Tuple[str, int]] = None) -> Optional[Dict]:
+    """
+    Where the user should continue: {book_id, book_nomi, part_id, part_nomi, part_index}
+    of the part after the most recently listened one, skipping finished books
+    (checks the 5 latest books). `pending` is a (book_id, part_id) not yet flushed;
+    it takes precedence over stored rows. One statement over the user's PK range.
+    """
+    book_id, part_id = pending or (None, None)
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT c.book_id, b.nomi AS book_nomi, n.id AS part_id, n.nomi AS part_nomi,
+                   (SELECT COUNT(*) FROM parts p WHERE p.book_id = c.book_id AND p.id < n.id) AS part_index
+            FROM (
+                (SELECT book_id, part_id, updated_at FROM listening_progress
+                 WHERE user_id = %(user_id)s ORDER BY updated_at DESC LIMIT 5)
+                UNION ALL
+                SELECT %(book_id)s::text, %(part_id)s::int, 'infinity'::timestamptz
+                WHERE %(book_id)s::text IS NOT NULL
+            ) c
+            JOIN books b ON b.id = c.book_id
+            CROSS JOIN LATERAL (
+                SELECT id, nomi FROM parts
+                WHERE book_id = c.book_id AND id > c.part_id
+                ORDER BY id LIMIT 1
+            ) n
+            ORDER BY c.updated_at DESC
+            LIMIT 1;
+            """,
+            {"user_id": user_id, "book_id": book_id, "part_id": part_id}
+        )
+        return cur.fetchone()
+
+# =====================
+# 📮 Updates queue
+# =====================
+
+# Leases keep a transaction open while a worker handles the update, so they use
+# their own non-autocommit pool (created on first use, only in worker mode).
+_lease_pool: Optional[ConnectionPool] = None
+_lease_pool_lock = threading.Lock()
+
+def _get_lease_pool(size: int) -> ConnectionPool:
+    global _lease_pool
+    with _lease_pool_lock:
+        if _lease_pool is None:
+            _lease_pool = ConnectionPool(
+                conninfo=DATABASE_URL, min_size=1, max_size=max(1, size),
+                kwargs={"autocommit": False},
             )
-            SELECT COUNT(*) AS removed FROM deleted;
+        return _lease_pool
+
+def enqueue_update(update_id: int, chat_id: Optional[int], payload: dict):
+    """Store a raw update. Telegram re-deliveries of the same update_id are ignored."""
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
             """
+            INSERT INTO updates_queue (update_id, chat_id, payload) VALUES (%s, %s, %s)
+            ON CONFLICT (update_id) DO NOTHING;
+            """,
+            (update_id, chat_id, Jsonb(payload))
         )
-        row = cur.fetchone()
-        return int(row["removed"] if row and row["removed"] is not None else 0)
+
+class UpdateLease:
+    """A claimed queue row. The row stays locked until ack() or release()."""
+
+    __slots__ = ("_pool", "_conn", "id", "payload")
+
+    def __init__(self, pool: ConnectionPool, conn, row_id: int, payload: dict):
+        self._pool = pool
+        self._conn = conn
+        self.id = row_id
+        self.payload = payload
+
+    def ack(self):
+        """Delete the row and commit: the update will not be delivered again."""
+        try:
+            with self._conn.cursor() as cur:
+                cur.execute("DELETE FROM updates_queue WHERE id = %s;", (self.id,))
+            self._conn.commit()
+        finally:
+            self._pool.putconn(self._conn)
+
+    def release(self):
+        """Give the row back to the queue (another worker may claim it)."""
+        try:
+            self._conn.rollback()
+        finally:
+            self._pool.putconn(self._conn)
+
+def claim_update(pool_size: int = 4, partitions: int = 0, partition: int = 0) -> Optional[UpdateLease]:
+    """
+    Lock the oldest queued update whose chat has no earlier pending update, so
+    one chat's updates are handled strictly in order while other chats run in
+    parallel. FOR UPDATE SKIP LOCKED lets many workers claim without blocking.
+    If a worker dies, its connection drops and the row becomes claimable again.
+    With partitions > 0, only chats where |chat_id| % partitions == partition
+    are claimed (sticky chat -> worker assignment).
+    """
+    pool = _get_lease_pool(pool_size)
+    conn = pool.getconn()
+    try:
+        conn.row_factory = dict_row
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT q.id, q.payload FROM updates_queue q
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM updates_queue p
+                    WHERE p.chat_id = q.chat_id AND p.id < q.id
+                )
+                  AND (%(n)s = 0 OR mod(abs(COALESCE(q.chat_id, 0)), %(n)s) = %(k)s)
+                ORDER BY q.id
+                LIMIT 1
+                FOR UPDATE OF q SKIP LOCKED;
+                """,
+                {"n": partitions, "k": partition}
+            )
+            row = cur.fetchone()
+    except BaseException:
+        conn.rollback()
+        pool.putconn(conn)
+        raise
+    if not row:
+        conn.rollback()
+        pool.putconn(conn)
+        return None
+    return UpdateLease(pool, conn, row["id"], row["payload"])
+
+def count_queued_updates() -> int:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) AS n FROM updates_queue;")
+        return int(cur.fetchone()["n"])
 
 # =====================
-# 👁 Book Views
+# 💾 Bot state (persistence)
 # =====================
 
-def increment_book_view(book_name: str):
+def load_states(kind: str) -> List[Dict]:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT key, data FROM bot_state WHERE kind = %s;", (kind,))
+        return list(cur.fetchall())
+
+def load_state(kind: str, key: str):
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT data FROM bot_state WHERE kind = %s AND key = %s;", (kind, key))
+        row = cur.fetchone()
+        return row["data"] if row else None
+
+def load_states_by_key(keys: List[Tuple[str, str]]) -> List[Dict]:
+    """Fetch the (kind, key) rows that exist among `keys`, in one primary-key lookup."""
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
             """
-            INSERT INTO book_views (book_name, count) VALUES (%s, 1)
-            ON CONFLICT (book_name) DO UPDATE SET count = book_views.count + 1;
+            SELECT s.kind, s.key, s.data
+            FROM unnest(%s::text[], %s::text[]) AS k(kind, key)
+            JOIN bot_state s ON s.kind = k.kind AND s.key = k.key;
             """,
-            (book_name,)
+            ([kind for kind, _ in keys], [key for _, key in keys])
         )
+        return list(cur.fetchall())
 
-def get_book_views() -> List[Dict]:
+def save_states(upserts: List[tuple], deletes: List[tuple]):
+    """Apply a batch of (kind, key, json_text) upserts and (kind, key) deletes in one transaction."""
+    with get_conn() as conn:
+        with conn.transaction(), conn.cursor() as cur:
+            if upserts:
+                cur.executemany(
+                    """
+                    INSERT INTO bot_state (kind, key, data, updated_at) VALUES (%s, %s, %s::jsonb, now())
+                    ON CONFLICT (kind, key) DO UPDATE SET data = EXCLUDED.data, updated_at = now();
+                    """,
+                    upserts
+                )
+            if deletes:
+                cur.execute(
+                    """
+                    DELETE FROM bot_state s
+                    USING unnest(%s::text[], %s::text[]) AS d(kind, key)
+                    WHERE s.kind = d.kind AND s.key = d.key;
+                    """,
+                    ([k for k, _ in deletes], [key for _, key in deletes])
+                )
+
+def evict_stale_states(ttl_seconds: int) -> List[Dict]:
+    """
+    Delete the states of users none of whose rows (user_data and every conversation
+    step) were touched for ttl_seconds; return the evicted (kind, key) rows.
+    A user's rows go together, so a wizard never keeps its step without its data.
+    The owner expression is the one indexed by idx_bot_state_owner (migration 17).
+    """
     with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("SELECT * FROM book_views ORDER BY count DESC, book_name;")
+        cur.execute(
+            """
+            WITH stale AS (
+                SELECT DISTINCT CASE WHEN kind = 'user' THEN key ELSE key::jsonb ->> -1 END AS owner
+                FROM bot_state
+                WHERE updated_at < now() - make_interval(secs => %(ttl)s)
+            ),
+            evictable AS (
+                SELECT owner FROM stale
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM bot_state
+                    WHERE (CASE WHEN kind = 'user' THEN key ELSE key::jsonb ->> -1 END) = stale.owner
+                      AND updated_at >= now() - make_interval(secs => %(ttl)s)
+                )
+            )
+            DELETE FROM bot_state s
+            USING evictable e
+            WHERE (CASE WHEN s.kind = 'user' THEN s.key ELSE s.key::jsonb ->> -1 END) = e.owner
+            RETURNING s.kind, s.key;
+            """,
+            {"ttl": ttl_seconds}
+        )
         return list(cur.fetchall())
 
 
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+from genre_index import genre_index
+from storage import catalog_version, refresh_book_summary, get_book_summaries
+
+log = logging.getLogger(__name__)
+
+
+def format_duration(seconds: int) -> str:
+    hours, minutes = divmod(int(seconds) // 60, 60)
+    if hours:
+        return f"{hours} soat {minutes} daq"
+    return f"{minutes} daq"
+
+
+class BookSummaries:
+    """
+    Ro'yxat ekranlaridagi boy yorliqlar uchun book_summary (materialized view)
+    nusxasi xotirada: qismlar soni, umumiy davomiylik, janrlar, ko'rishlar.
+    Bitta so'rov bilan to'liq yuklanadi — ekranlar har kitob uchun get_parts /
+    get_genres_for_book chaqirmaydi.
+
+    Fon vazifasi (run): shu jarayonda katalog o'zgargan bo'lsa (storage.catalog_version)
+    view CONCURRENTLY yangilanadi va qayta yuklanadi; aks holda ham har max_age'da
+    (ko'rishlar soni va boshqa replikalar yozuvlari uchun).
+    """
+
+    def __init__(self):
+        self._rows: Dict[str, Dict] = {}
+        self._version: Optional[int] = None
+        self._refreshed = float("-inf")
+        self.counters: Dict[str, int] = {"refreshes": 0, "loads": 0}
+
+    def get(self, book_id: str) -> Optional[Dict]:
+        return self._rows.get(str(book_id))
+
+    def label(self, book_id: str, nomi: str, detailed: bool = False) -> str:
+        """Tugma yozuvi: "Nomi (24 qism)"; detailed=True bo'lsa davomiylik va janrlar ham."""
+        row = self.get(book_id)
+        if not row or not row["part_count"]:
+            return nomi
+        label = f"{nomi} ({row['part_count']} qism"
+        if detailed and row["total_duration"]:
+            label += f", {format_duration(row['total_duration'])}"
+        label += ")"
+        if detailed:
+            names = [n for n in map(genre_index.genre_name, row["genre_ids"]) if n]
+            if names:
+                label += " · " + ", ".join(names[:2])
+        return label
+
+    def load(self) -> None:
+        """Sinxron: butun view'ni bitta so'rov bilan o'qiydi."""
+        self._rows = {r["book_id"]: r for r in get_book_summaries()}
+        self.counters["loads"] += 1
+
+    def refresh(self) -> None:
+        """Sinxron: view'ni yangilab, qayta yuklaydi."""
+        version = catalog_version()
+        refresh_book_summary()
+        self._version = version
+        self._refreshed = time.monotonic()
+        self.counters["refreshes"] += 1
+        self.load()
+
+    async def run(self, check_interval: float = 10, max_age: float = 900) -> None:
+        try:
+            await asyncio.to_thread(self.load)
+        except Exception:
+            log.exception("Kitob xulosalarini yuklashda xato")
+        self._version = catalog_version()
+        self._refreshed = time.monotonic()
+        while True:
+            await asyncio.sleep(check_interval)
+            if catalog_version() == self._version and time.monotonic() - self._refreshed < max_age:
+                continue
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception:
+                log.exception("book_summary'ni yangilashda xato")
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counters, books=len(self._rows))
+
+
+summaries = BookSummaries()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Modullar repo ildizida joylashgan (paket emas)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# storage.py import paytida pool yaratadi; testlar unga ulanmaydi (get_conn almashtiriladi)
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost:1/unused?connect_timeout=1")
@@ -0,0 +1,100 @@
+import pytest
+from telegram import Update
+
+from backlog import _ages, plan_backlog
+
+NOW = 1_700_000_000
+
+
+def _message(update_id, chat_id, text, sent):
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": sent, "text": text,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "a"},
+        },
+    }, None)
+
+
+def _tap(update_id, chat_id, data):
+    return Update.de_json({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id), "chat_instance": "c", "data": data,
+            "from": {"id": chat_id, "is_bot": False, "first_name": "a"},
+            "message": {"message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"}},
+        },
+    }, None)
+
+
+def _ids(updates):
+    return [u.update_id for u in updates]
+
+
+# ---------- Yosh chegarasi ----------
+
+def test_tap_age_is_bounded_by_the_next_dated_update():
+    updates = [
+        _tap(1, 10, "part:1:1"),
+        _message(2, 10, "salom", NOW - 300),
+        _tap(3, 10, "part:1:2"),
+        _message(4, 20, "x", NOW - 30),
+        _tap(5, 10, "part:1:3"),
+    ]
+    assert _ages(updates, NOW) == [300, 300, 30, 30, None]
+
+
+def test_dated_update_age_is_its_own():
+    assert _ages([_message(1, 10, "x", NOW - 5)], NOW) == [5]
+
+
+# ---------- Eskirgan callback'lar ----------
+
+def test_stale_tap_is_answered_only():
+    updates = [_tap(1, 10, "part:1:1"), _message(2, 20, "x", NOW - 600)]
+    replay, answer_only = plan_backlog(updates, fresh_seconds=120, now=NOW)
+    assert _ids(replay) == [2]
+    assert _ids(answer_only) == [1]
+
+
+def test_tap_within_fresh_window_is_replayed():
+    updates = [_tap(1, 10, "part:1:1"), _message(2, 20, "x", NOW - 60)]
+    replay, answer_only = plan_backlog(updates, fresh_seconds=120, now=NOW)
+    assert _ids(replay) == [1, 2]
+    assert answer_only == []
+
+
+def test_tap_without_later_dated_update_is_kept():
+    # Yoshini bilib bo'lmaydi: eskirgan deb tashlamaymiz
+    updates = [_message(1, 20, "x", NOW - 600), _tap(2, 10, "part:1:1"), _tap(3, 10, "confirm_delete_book")]
+    replay, answer_only = plan_backlog(updates, fresh_seconds=120, now=NOW)
+    assert _ids(replay) == [1, 2, 3]
+    assert answer_only == []
+
+
+# ---------- Navigatsiyani siqish ----------
+
+def test_only_last_navigation_per_chat_is_replayed():
+    updates = [
+        _message(1, 10, "/start", NOW - 50),
+        _tap(2, 10, "books"),
+        _tap(3, 20, "genres"),
+        _message(4, 10, "matnli javob", NOW - 40),
+        _tap(5, 10, "book:7"),
+        _tap(6, 20, "genre:3"),
+        _message(7, 20, "/start@bot", NOW - 10),
+    ]
+    replay, answer_only = plan_backlog(updates, fresh_seconds=600, now=NOW)
+    # Matnli javob saqlanadi; har chatda oxirgi navigatsiya qoladi
+    assert _ids(replay) == [4, 5, 7]
+    # Oldingi navigatsiya tap'lari faqat answer() qilinadi, eski /start esa tashlanadi
+    assert _ids(answer_only) == [2, 3, 6]
+
+
+@pytest.mark.parametrize("data", ["part:1:1", "toggle_genre_3", "confirm_delete_book"])
+def test_action_taps_are_never_coalesced(data):
+    updates = [_tap(1, 10, data), _tap(2, 10, data), _tap(3, 10, "books")]
+    replay, answer_only = plan_backlog(updates, fresh_seconds=600, now=NOW)
+    assert _ids(replay) == [1, 2, 3]
+    assert answer_only == []
@@ -0,0 +1,104 @@
+from contextlib import contextmanager
+
+import pytest
+
+import storage
+from genre_index import genre_index
+
+
+class FakeCursor:
+    def __init__(self, events, fail_on=None):
+        self.events = events
+        self.fail_on = fail_on
+
+    def execute(self, sql, params=None):
+        self.events.append(("execute", " ".join(sql.split())[:30]))
+
+    def executemany(self, sql, rows):
+        if self.fail_on == "executemany":
+            raise RuntimeError("boom")
+        self.events.append(("executemany", len(rows)))
+
+    def fetchone(self):
+        return {"id": "41", "sort_key": 41}
+
+
+class FakeConn:
+    """Tranzaksiya qanday tugaganini (commit / rollback) yozib boradi."""
+
+    def __init__(self, fail_on=None):
+        self.events = []
+        self.fail_on = fail_on
+
+    @contextmanager
+    def pipeline(self):
+        yield
+
+    @contextmanager
+    def transaction(self):
+        self.events.append("begin")
+        try:
+            yield
+        except BaseException:
+            self.events.append("rollback")
+            raise
+        self.events.append("commit")
+
+    @contextmanager
+    def cursor(self):
+        yield FakeCursor(self.events, self.fail_on)
+
+
+@pytest.fixture
+def fake_conn(monkeypatch):
+    def install(fail_on=None):
+        conn = FakeConn(fail_on)
+
+        @contextmanager
+        def get_conn():
+            yield conn
+
+        monkeypatch.setattr(storage, "get_conn", get_conn)
+        return conn
+    return install
+
+
+@pytest.fixture(autouse=True)
+def fresh_genre_index():
+    genre_index.load([], [{"id": 1, "nomi": "Roman"}], [])
+    yield
+    genre_index.load([], [], [])
+
+
+def test_create_book_commits_and_updates_index(fake_conn):
+    conn = fake_conn()
+    version = storage.catalog_version()
+    assert storage.create_book("Yangi", [1], ["u1", "u2"]) == "41"
+    assert conn.events[0] == "begin" and conn.events[-1] == "commit"
+    assert ("executemany", 2) in conn.events
+    assert genre_index.books() == [{"id": "41", "nomi": "Yangi"}]
+    assert [b["id"] for b in genre_index.books_with_genres([1])] == ["41"]
+    assert storage.catalog_version() == version + 1
+
+
+def test_failed_statement_rolls_back_and_leaves_index_untouched(fake_conn):
+    conn = fake_conn(fail_on="executemany")
+    generation = genre_index.generation
+    version = storage.catalog_version()
+    with pytest.raises(RuntimeError):
+        storage.create_book("Yangi", [1], ["u1"])
+    assert conn.events[-1] == "rollback" and "commit" not in conn.events
+    assert genre_index.books() == []
+    assert genre_index.books_with_genres([1]) == []
+    assert genre_index.generation == generation
+    assert storage.catalog_version() == version
+
+
+def test_error_in_caller_block_rolls_back(fake_conn):
+    conn = fake_conn()
+    with pytest.raises(ValueError):
+        with storage.catalog_work() as work:
+            work.add_book(None, "Yangi")
+            raise ValueError("bekor")
+    assert conn.events[-1] == "rollback"
+    assert genre_index.books() == []
@@ -0,0 +1,171 @@
+import asyncio
+
+from telegram import Update
+
+import dispatch
+from dispatch import ChatOrderedUpdateProcessor, EditCoalescer
+
+
+def _message(update_id, chat_id):
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "x",
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "a"},
+        },
+    }, None)
+
+
+def _tap(update_id, chat_id, message_id, data):
+    return Update.de_json({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id), "chat_instance": "c", "data": data,
+            "from": {"id": chat_id, "is_bot": False, "first_name": "a"},
+            "message": {"message_id": message_id, "date": 0, "chat": {"id": chat_id, "type": "private"}},
+        },
+    }, None)
+
+
+# ---------- ChatOrderedUpdateProcessor ----------
+
+def _run_interleaved(processor, updates, work):
+    """Update'larni Application kabi kelish tartibida alohida task'larda uzatadi."""
+    async def main():
+        tasks = []
+        for update in updates:
+            tasks.append(asyncio.create_task(processor.process_update(update, work(update))))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+    asyncio.run(main())
+
+
+def test_fifo_within_chat_and_parallel_across_chats():
+    processor = ChatOrderedUpdateProcessor(max_concurrent=8)
+    log, running, overlap = [], set(), []
+    updates = [_message(1, 10), _message(2, 20), _message(3, 10), _message(4, 20), _message(5, 10)]
+
+    def work(update):
+        async def handle():
+            chat = update.effective_chat.id
+            assert chat not in running  # bitta chatdan ikkitasi bir vaqtda emas
+            running.add(chat)
+            overlap.append(len(running))
+            await asyncio.sleep(0.01)
+            log.append((chat, update.update_id))
+            running.discard(chat)
+        return handle()
+
+    _run_interleaved(processor, updates, work)
+    assert [u for c, u in log if c == 10] == [1, 3, 5]
+    assert [u for c, u in log if c == 20] == [2, 4]
+    assert max(overlap) == 2
+    assert processor.counters["processed"] == 5
+    assert processor.counters["queued_behind_chat"] == 3
+
+
+def test_chat_queue_does_not_hold_global_slots():
+    # Bitta global slot: 10-chat navbatida kutayotganlar 20-chatni to'sib qo'ymasin
+    processor = ChatOrderedUpdateProcessor(max_concurrent=1)
+    order = []
+
+    def work(update):
+        async def handle():
+            await asyncio.sleep(0.01)
+            order.append(update.update_id)
+        return handle()
+
+    _run_interleaved(processor, [_message(1, 10), _message(2, 10), _message(3, 10), _message(4, 20)], work)
+    assert order.index(4) < order.index(3)
+
+
+def test_lanes_are_evicted_when_drained():
+    processor = ChatOrderedUpdateProcessor()
+
+    def work(update):
+        async def handle():
+            assert processor.chat_depths()[0][0] == update.effective_chat.id
+        return handle()
+
+    _run_interleaved(processor, [_message(1, 10), _message(2, 10), _message(3, 20)], work)
+    assert processor.chat_depths() == []
+    assert processor.stats()["active_chats"] == 0
+    assert processor.stats()["pending"] == 0
+
+
+def test_failed_update_frees_its_lane():
+    processor = ChatOrderedUpdateProcessor()
+
+    async def boom():
+        raise RuntimeError("x")
+
+    async def main():
+        try:
+            await processor.process_update(_message(1, 10), boom())
+        except RuntimeError:
+            pass
+        await processor.process_update(_message(2, 10), asyncio.sleep(0))
+
+    asyncio.run(main())
+    assert processor.stats()["active_chats"] == 0
+    assert processor.counters["processed"] == 2
+
+
+def test_superseded_tap_is_not_run():
+    processor = ChatOrderedUpdateProcessor()
+    ran = []
+
+    def work(update):
+        async def handle():
+            await asyncio.sleep(0.01)
+            ran.append(update.update_id)
+        return handle()
+
+    # 1 bajarilayotganda 2 va 3 bitta xabarga keladi: 2 eskirgan, faqat 3 chiziladi
+    _run_interleaved(processor, [
+        _message(1, 10), _tap(2, 10, 77, "books"), _tap(3, 10, 77, "books"),
+    ], work)
+    assert ran == [1, 3]
+    assert processor.coalescer.counters["coalesced"] == 1
+
+
+# ---------- EditCoalescer ----------
+
+def test_older_render_tap_is_superseded_within_window(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(dispatch.time, "monotonic", lambda: now[0])
+    coalescer = EditCoalescer(window=0.5)
+    old, new = _tap(1, 10, 77, "book:5"), _tap(2, 10, 77, "book:6")
+    coalescer.note_arrival(old)
+    coalescer.note_arrival(new)
+    now[0] += 0.2
+    assert coalescer.is_superseded(old)
+    assert not coalescer.is_superseded(new)
+    # Oxirgisi bajarilgach kalit tozalanadi
+    assert coalescer.stats()["pending_keys"] == 0
+
+
+def test_newer_tap_outside_window_does_not_supersede(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(dispatch.time, "monotonic", lambda: now[0])
+    coalescer = EditCoalescer(window=0.5)
+    old, new = _tap(1, 10, 77, "books"), _tap(2, 10, 77, "books")
+    coalescer.note_arrival(old)
+    coalescer.note_arrival(new)
+    now[0] += 1.0
+    assert not coalescer.is_superseded(old)
+
+
+def test_only_render_taps_on_the_same_message_coalesce():
+    coalescer = EditCoalescer(window=60)
+    taps = [_tap(1, 10, 77, "part:5:1"), _tap(2, 10, 77, "part:5:2")]
+    for t in taps:
+        coalescer.note_arrival(t)
+    # Amal bajaradigan tap'lar hech qachon tashlanmaydi
+    assert not coalescer.is_superseded(taps[0])
+    other_message = [_tap(3, 10, 77, "books"), _tap(4, 10, 78, "books"), _tap(5, 20, 77, "books")]
+    for t in other_message:
+        coalescer.note_arrival(t)
+    assert not any(coalescer.is_superseded(t) for t in other_message)
+    assert not coalescer.is_superseded(_message(6, 10))
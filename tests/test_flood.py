@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop
+
+import flood
+from flood import FloodControl
+
+
+def test_burst_then_refill():
+    fc = FloodControl(rate=2.0, burst=3)
+    assert [fc.allow(1, 0.0) for _ in range(4)] == [True, True, True, False]
+    # 0.5 s da bitta token tiklanadi
+    assert fc.allow(1, 0.5)
+    assert not fc.allow(1, 0.5)
+
+
+def test_refill_is_capped_at_burst():
+    fc = FloodControl(rate=2.0, burst=3)
+    fc.allow(1, 0.0)
+    assert [fc.allow(1, 3600.0) for _ in range(4)] == [True, True, True, False]
+
+
+def test_users_have_separate_buckets():
+    fc = FloodControl(rate=0.001, burst=1)
+    assert fc.allow(1, 0.0)
+    assert not fc.allow(1, 0.0)
+    assert fc.allow(2, 0.0)
+
+
+def test_lru_cap_evicts_least_recently_active():
+    fc = FloodControl(rate=0.001, burst=1, max_users=2)
+    fc.allow(1, 0.0)
+    fc.allow(2, 0.0)
+    fc.allow(1, 1.0)          # 1 yana faol: eng eskisi endi 2
+    fc.allow(3, 2.0)
+    assert list(fc._buckets) == [1, 3]
+    assert fc.counters["evicted"] == 1
+    # 2 to'la bucket bilan qaytadi
+    assert fc.allow(2, 3.0)
+
+
+# ---------- __call__ (TypeHandler) ----------
+
+class _Bot:
+    """Faqat answerCallbackQuery'ni yozib oladi."""
+
+    def __init__(self):
+        self.answers = []
+
+    async def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        self.answers.append(text)
+
+
+@pytest.fixture
+def bot():
+    return _Bot()
+
+
+def _tap(user_id, bot):
+    return Update.de_json({
+        "update_id": 1,
+        "callback_query": {
+            "id": "1", "chat_instance": "c", "data": "books",
+            "from": {"id": user_id, "is_bot": False, "first_name": "a"},
+        },
+    }, bot)
+
+
+def _feed(fc, updates, clock, monkeypatch):
+    monkeypatch.setattr(flood.time, "monotonic", lambda: clock[0])
+    results = []
+
+    async def main():
+        for update in updates:
+            try:
+                await fc(update, None)
+                results.append("ok")
+            except ApplicationHandlerStop:
+                results.append("stop")
+            if fc._exempt_task is not None:
+                await fc._exempt_task
+    asyncio.run(main())
+    return results
+
+
+def test_every_throttled_tap_is_answered_but_warned_once(bot, monkeypatch):
+    fc = FloodControl(rate=1.0, burst=1)
+    clock = [0.0]
+    results = _feed(fc, [_tap(5, bot) for _ in range(4)], clock, monkeypatch)
+    assert results == ["ok", "stop", "stop", "stop"]
+    assert bot.answers == ["⏳ Juda tez! Biroz kuting.", None, None]
+    assert fc.counters["warned"] == 1 and fc.counters["throttled"] == 3
+
+
+def test_warning_resets_after_an_allowed_update(bot, monkeypatch):
+    fc = FloodControl(rate=1.0, burst=1)
+    clock = [0.0]
+    _feed(fc, [_tap(5, bot), _tap(5, bot)], clock, monkeypatch)
+    clock[0] = 10.0
+    _feed(fc, [_tap(5, bot), _tap(5, bot)], clock, monkeypatch)
+    assert bot.answers == ["⏳ Juda tez! Biroz kuting.", "⏳ Juda tez! Biroz kuting."]
+
+
+def test_admins_are_exempt_once_loaded(bot, monkeypatch):
+    fc = FloodControl(rate=0.001, burst=1, load_exempt=lambda: [5])
+    clock = [0.0]
+    # Birinchi update ro'yxat yuklanishini boshlaydi, keyingilari cheklanmaydi
+    results = _feed(fc, [_tap(5, bot) for _ in range(5)], clock, monkeypatch)
+    assert results == ["ok"] * 5
+    assert fc.stats()["exempt"] == 1
+    assert _feed(fc, [_tap(6, bot), _tap(6, bot)], clock, monkeypatch) == ["ok", "stop"]
+
+
+def test_failed_exempt_load_keeps_limiting(bot, monkeypatch):
+    def broken():
+        raise RuntimeError("db down")
+    fc = FloodControl(rate=0.001, burst=1, load_exempt=broken)
+    clock = [0.0]
+    assert _feed(fc, [_tap(5, bot), _tap(5, bot)], clock, monkeypatch) == ["ok", "stop"]
@@ -0,0 +1,71 @@
+from genre_index import GenreIndex
+
+BOOKS = [
+    {"id": "2", "nomi": "Ikki", "sort_key": 2},
+    {"id": "10", "nomi": "O'n", "sort_key": 10},
+    {"id": "old", "nomi": "Eski", "sort_key": None},
+]
+GENRES = [{"id": 1, "nomi": "Roman"}, {"id": 2, "nomi": "Tarix"}]
+LINKS = [
+    {"book_id": "2", "genre_id": 1},
+    {"book_id": "10", "genre_id": 1},
+    {"book_id": "10", "genre_id": 2},
+    {"book_id": "old", "genre_id": 2},
+]
+
+
+def _loaded():
+    index = GenreIndex()
+    assert index.load(BOOKS, GENRES, LINKS, index.generation)
+    return index
+
+
+def test_first_load_is_accepted_even_if_generation_moved():
+    index = GenreIndex()
+    generation = index.generation
+    index.genre_added(3, "She'r")
+    assert index.load(BOOKS, GENRES, LINKS, generation)
+    assert index.ready
+
+
+def test_stale_snapshot_is_rejected_after_local_write():
+    index = _loaded()
+    generation = index.generation
+    # Snapshot o'qilayotgan paytda shu jarayonda yozuv bo'ldi
+    index.links_changed([("2", 2)], [])
+    assert not index.load(BOOKS, GENRES, LINKS, generation)
+    assert [b["id"] for b in index.books_with_genres([1, 2])] == ["2", "10"]
+
+
+def test_snapshot_without_intervening_writes_is_applied():
+    index = _loaded()
+    index.book_renamed("2", "Ikkinchi")
+    generation = index.generation
+    assert index.load(BOOKS, GENRES, LINKS, generation)
+    assert index.books()[0] == {"id": "2", "nomi": "Ikki"}
+
+
+def test_every_write_bumps_generation():
+    index = _loaded()
+    writes = [
+        lambda: index.book_added("11", "Yangi", 11),
+        lambda: index.book_renamed("11", "Yangi 2"),
+        lambda: index.genre_added(3, "She'r"),
+        lambda: index.genre_linked("11", 3),
+        lambda: index.genres_set("11", [1]),
+        lambda: index.links_changed([], [("11", 1)]),
+        lambda: index.genre_deleted(3),
+        lambda: index.book_deleted("11"),
+    ]
+    for write in writes:
+        before = index.generation
+        write()
+        assert index.generation == before + 1
+
+
+def test_reads_follow_sort_key_with_nulls_last():
+    index = _loaded()
+    assert [b["id"] for b in index.books()] == ["2", "10", "old"]
+    assert [b["id"] for b in index.books_with_genres([2])] == ["10", "old"]
+    assert index.refine_counts([1]) == {2: 1}
+    assert index.stats() == {"books": 3, "genres": 2, "links": 4, "generation": 0}
@@ -0,0 +1,162 @@
+from contextlib import contextmanager
+
+import pytest
+
+import storage
+from genre_index import genre_index
+
+
+class ScriptedCursor:
+    """Har execute'dan keyingi fetchall() natijasi oldindan berilgan."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        if self.conn.fail_on and self.conn.fail_on in sql:
+            raise RuntimeError("boom")
+        self.conn.events.append(("execute", " ".join(sql.split()), params))
+        self._rows = self.conn.results.pop(0)
+
+    def fetchall(self):
+        return self._rows
+
+
+class ScriptedConn:
+    def __init__(self, results, fail_on=None):
+        self.events = []
+        self.results = list(results)
+        self.fail_on = fail_on
+
+    @contextmanager
+    def transaction(self):
+        self.events.append("begin")
+        try:
+            yield
+        except BaseException:
+            self.events.append("rollback")
+            raise
+        self.events.append("commit")
+
+    @contextmanager
+    def cursor(self):
+        yield ScriptedCursor(self)
+
+
+@pytest.fixture
+def scripted(monkeypatch):
+    def install(results, fail_on=None):
+        conn = ScriptedConn(results, fail_on)
+
+        @contextmanager
+        def get_conn():
+            yield conn
+
+        monkeypatch.setattr(storage, "get_conn", get_conn)
+        return conn
+    return install
+
+
+@pytest.fixture(autouse=True)
+def catalog():
+    genre_index.load(
+        [{"id": b, "nomi": f"K{b}", "sort_key": int(b)} for b in ("1", "2", "3")],
+        [{"id": g, "nomi": f"J{g}"} for g in (1, 2, 3)],
+        [{"book_id": "1", "genre_id": 3}, {"book_id": "2", "genre_id": 1}],
+    )
+    yield
+    genre_index.load([], [], [])
+
+
+def _statements(conn):
+    return [e for e in conn.events if e != "begin" and e != "commit" and e != "rollback"]
+
+
+def _links():
+    return {gid: [b["id"] for b in genre_index.books_with_genres([gid])] for gid in (1, 2, 3)}
+
+
+def test_set_genres_locks_then_diffs_in_one_transaction(scripted):
+    conn = scripted([
+        [{"id": "1"}, {"id": "2"}],                       # "9" mavjud emas
+        [{"added": False, "book_id": "1", "genre_id": 3},
+         {"added": True, "book_id": "1", "genre_id": 1}],
+    ])
+    result = storage.set_genres_for_books({"2": [1], "1": [1, 99], "9": [2]})
+
+    assert conn.events[0] == "begin" and conn.events[-1] == "commit"
+    (_, lock_sql, lock_params), (_, diff_sql, diff_params) = _statements(conn)
+    assert lock_sql.endswith("ORDER BY id FOR UPDATE;")
+    assert lock_params == (["1", "2", "9"],)
+    assert diff_sql.startswith("WITH desired AS")
+    # Farq faqat qulflangan (mavjud) kitoblar bo'yicha
+    assert diff_params["books"] == ["1", "2"]
+    assert list(zip(diff_params["pair_books"], diff_params["pair_genres"])) == [
+        ("1", 1), ("1", 99), ("2", 1), ("9", 2),
+    ]
+    assert result == {"added": 1, "removed": 1}
+
+
+def test_set_genres_updates_index_only_from_returned_rows(scripted):
+    scripted([
+        [{"id": "1"}, {"id": "2"}],
+        # 99-janr yo'q, "2" o'zgarmagan: DB faqat shu ikkisini qaytardi
+        [{"added": False, "book_id": "1", "genre_id": 3},
+         {"added": True, "book_id": "1", "genre_id": 1}],
+    ])
+    version = storage.catalog_version()
+    storage.set_genres_for_books({"2": [1], "1": [1, 99]})
+    assert _links() == {1: ["1", "2"], 2: [], 3: []}
+    assert genre_index.genre_name(99) is None
+    assert storage.catalog_version() == version + 1
+
+
+def test_set_genres_without_changes_keeps_catalog_version(scripted):
+    scripted([[{"id": "2"}], []])
+    version = storage.catalog_version()
+    assert storage.set_genres_for_books({"2": [1]}) == {"added": 0, "removed": 0}
+    assert storage.catalog_version() == version
+    assert _links() == {1: ["2"], 2: [], 3: ["1"]}
+
+
+def test_failed_diff_rolls_back_and_leaves_index(scripted):
+    conn = scripted([[{"id": "1"}]], fail_on="WITH desired")
+    generation = genre_index.generation
+    with pytest.raises(RuntimeError):
+        storage.set_genres_for_books({"1": [2]})
+    assert conn.events[-1] == "rollback"
+    assert genre_index.generation == generation
+    assert _links() == {1: ["2"], 2: [], 3: ["1"]}
+
+
+def test_update_genre_books_locks_then_diffs_for_existing_books(scripted):
+    conn = scripted([
+        [{"id": "1"}, {"id": "3"}],                       # "9" mavjud emas
+        [{"added": True, "book_id": "1"}, {"added": False, "book_id": "3"}],
+    ])
+    result = storage.update_genre_books(2, add=["9", "1"], remove=["3"])
+
+    (_, lock_sql, lock_params), (_, diff_sql, diff_params) = _statements(conn)
+    assert lock_sql.endswith("FOR UPDATE;")
+    assert lock_params == (["1", "3", "9"],)
+    assert diff_sql.startswith("WITH removed AS")
+    assert diff_params == {"genre_id": 2, "add": ["1"], "remove": ["3"]}
+    assert conn.events[-1] == "commit"
+    assert result == {"added": 1, "removed": 1}
+
+
+def test_update_genre_books_applies_returned_rows_to_index(scripted):
+    scripted([
+        [{"id": "1"}, {"id": "2"}],
+        # "1" uchun qator qaytmadi (ON CONFLICT): indeks so'ralganni emas, qaytganini oladi
+        [{"added": False, "book_id": "2"}],
+    ])
+    storage.update_genre_books(1, add=["1"], remove=["2"])
+    assert _links() == {1: [], 2: [], 3: ["1"]}
+
+
+def test_empty_requests_do_not_touch_the_database(scripted):
+    conn = scripted([])
+    assert storage.set_genres_for_books({}) == {"added": 0, "removed": 0}
+    assert storage.update_genre_books(1, [], []) == {"added": 0, "removed": 0}
+    assert conn.events == []
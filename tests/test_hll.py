@@ -0,0 +1,47 @@
+import pytest
+
+from hll import HyperLogLog, merge_bytes
+
+
+def _sketch(values):
+    hll = HyperLogLog()
+    for v in values:
+        hll.add(v)
+    return hll
+
+
+@pytest.mark.parametrize("n", [0, 1, 10, 1000, 50000])
+def test_estimate_is_close(n):
+    # Standart xato ≈ 2.3%: 4 sigma'dan oshmasligi kerak
+    assert _sketch(range(n)).estimate() == pytest.approx(n, rel=0.1, abs=1)
+
+
+def test_duplicates_do_not_count():
+    hll = _sketch(range(500))
+    assert not any(hll.add(v) for v in range(500))
+    assert hll.estimate() == _sketch(range(500)).estimate()
+
+
+def test_merge_equals_sketch_of_union():
+    a = _sketch(range(0, 20000))
+    b = _sketch(range(10000, 30000))
+    a.merge(b)
+    assert a.registers == _sketch(range(30000)).registers
+    assert a.estimate() == pytest.approx(30000, rel=0.1)
+
+
+@pytest.mark.parametrize("n", [3, 100000])
+def test_bytes_round_trip_sparse_and_dense(n):
+    hll = _sketch(range(n))
+    data = hll.to_bytes()
+    assert data[0] == (1 if n == 3 else 0)
+    assert HyperLogLog.from_bytes(data).registers == hll.registers
+
+
+def test_merge_bytes_and_union():
+    a, b = _sketch(range(0, 600)), _sketch(range(400, 1000))
+    merged = HyperLogLog.from_bytes(merge_bytes(a.to_bytes(), b.to_bytes()))
+    assert merged.registers == _sketch(range(1000)).registers
+    assert HyperLogLog.union([a.to_bytes(), b.to_bytes()]).registers == merged.registers
+    assert merge_bytes(None, b.to_bytes()) == b.to_bytes()
+    assert HyperLogLog.from_bytes(b"").estimate() == 0
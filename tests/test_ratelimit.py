@@ -0,0 +1,41 @@
+import pytest
+
+from ratelimit import TelegramRateLimiter, _Bucket
+
+
+def test_bucket_allows_burst_then_waits():
+    bucket = _Bucket(rate=2.0, capacity=3)
+    now = bucket.updated
+    assert [bucket.reserve(now) for _ in range(3)] == [0.0, 0.0, 0.0]
+    # To'rtinchisi bitta token yetishmaydi: 1 / rate soniya
+    assert bucket.reserve(now) == pytest.approx(0.5)
+    # Beshinchisi navbatda undan keyin turadi
+    assert bucket.reserve(now) == pytest.approx(1.0)
+
+
+def test_bucket_refills_with_elapsed_time():
+    bucket = _Bucket(rate=2.0, capacity=3)
+    now = bucket.updated
+    for _ in range(3):
+        bucket.reserve(now)
+    assert bucket.reserve(now + 0.5) == 0.0
+    assert bucket.tokens == pytest.approx(0.0)
+
+
+def test_bucket_refill_is_capped_at_capacity():
+    bucket = _Bucket(rate=2.0, capacity=3)
+    now = bucket.updated
+    bucket.reserve(now)
+    bucket.reserve(now + 3600)
+    assert bucket.tokens == pytest.approx(2.0)
+    assert bucket.idle(now + 3600.5)
+
+
+def test_chat_buckets_use_private_and_group_rates():
+    limiter = TelegramRateLimiter(private_max_rate=1.0, group_max_rate=0.5, chat_burst=3)
+    private = limiter._chat_bucket(42, 0.0)
+    group = limiter._chat_bucket(-100123, 0.0)
+    assert (private.rate, private.capacity) == (1.0, 3.0)
+    assert (group.rate, group.capacity) == (0.5, 3.0)
+    assert limiter._chat_bucket(42, 1.0) is private
+    assert limiter.stats()["chats_tracked"] == 2
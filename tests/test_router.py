@@ -0,0 +1,82 @@
+import pytest
+
+from router import CallbackRouter, cb, fits, parse
+
+
+async def show_part(update, context):
+    pass
+
+
+async def show_book(update, context):
+    pass
+
+
+async def remove_admin(update, context):
+    pass
+
+
+async def show_books(update, context):
+    pass
+
+
+@pytest.fixture
+def router():
+    r = CallbackRouter()
+    r.prefix("part", show_part, str, int, legacy="part_")
+    r.prefix("book", show_book, str, legacy="book_")
+    r.prefix("remove_admin", remove_admin, str, legacy="remove_admin_")
+    r.exact("books", show_books)
+    return r
+
+
+def test_cb_builds_new_format():
+    assert cb("part", 12, 3) == "part:12:3"
+
+
+def test_new_format_converts_types(router):
+    assert router.resolve("part:12:3") == (show_part, ["12", 3])
+
+
+def test_exact_wins_over_prefixes(router):
+    assert router.resolve("books") == (show_books, [])
+
+
+@pytest.mark.parametrize("data, expected", [
+    ("part_12_3", (show_part, ["12", 3])),
+    ("book_7", (show_book, ["7"])),
+    # Oxirgi argument qolgan qismni to'liq oladi
+    ("book_old_id", (show_book, ["old_id"])),
+    # Prefiksning o'zida "_" bor
+    ("remove_admin_555", (remove_admin, ["555"])),
+])
+def test_legacy_buttons(router, data, expected):
+    assert router.resolve(data) == expected
+
+
+@pytest.mark.parametrize("data", [
+    "part_12",          # argument yetishmaydi
+    "part_12_x",        # int emas
+    "book_",            # argument yo'q
+    "remove_admin",     # argument yo'q
+    "unknown_1",
+    "part:12",
+    "home",
+])
+def test_unknown_or_malformed_is_not_routed(router, data):
+    assert router.resolve(data) is None
+
+
+def test_parse_is_the_inverse_of_cb():
+    assert parse(cb("bulkbook", 2, "abc:d"), "bulkbook", int, str) == [2, "abc:d"]
+    assert parse(cb("bulkpage", 3), "bulkpage", int) == [3]
+
+
+@pytest.mark.parametrize("data", ["bulkpage:x", "bulkpage", "bulkpages:1", "bulkbook:1"])
+def test_parse_rejects_other_prefixes_and_bad_args(data):
+    assert parse(data, "bulkpage", int) is None
+
+
+def test_fits_counts_bytes():
+    assert fits(cb("bulkbook", 0, "x" * 53))
+    assert not fits(cb("bulkbook", 0, "x" * 54))
+    assert not fits(cb("book", "ё" * 30))
@@ -0,0 +1,142 @@
+"""
+Webhook rejimi: Telegram update JSON'ini POST qiladi, server uni `sink` ga uzatadi.
+
+  curl -X POST http://127.0.0.1:8443/telegram \
+       -H 'X-Telegram-Bot-Api-Secret-Token: <WEBHOOK_SECRET>' \
+       -H 'Content-Type: application/json' -d @update.json
+
+HTTP qismi tornado'da (python-telegram-bot[webhooks] bilan keladigan server).
+PTB'ning o'z webhook serveri update'ni xotiradagi navbatga qo'yishi bilan 200
+qaytaradi; bizda esa 200 sink tugagandan keyin qaytadi — receiver rejimida bu
+update updates_queue'ga yozilganini bildiradi, Telegram aks holda qayta yuboradi.
+
+WEBHOOK_SECRET majburiy: usiz har kim URL'ni topib, soxta (masalan, admin
+nomidan) update yubora oladi.
+"""
+import asyncio
+import hmac
+import json
+import logging
+import signal
+from typing import Awaitable, Callable, Dict, Optional
+
+import tornado.httpserver
+import tornado.web
+from telegram import Update
+from telegram.ext import Application
+
+from config import WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_URL
+import metrics
+
+log = logging.getLogger(__name__)
+
+MAX_BODY = 1 << 20  # Telegram update'lari bundan ancha kichik
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class _UpdateHandler(tornado.web.RequestHandler):
+    SUPPORTED_METHODS = ("POST",)
+
+    def initialize(self, server: "WebhookServer"):
+        self.server = server
+
+    async def post(self):
+        self.set_status(await self.server.accept(self.request.headers.get(SECRET_HEADER, ""), self.request.body))
+
+    def log_exception(self, typ, value, tb):
+        if isinstance(value, tornado.web.HTTPError):  # 405 va h.k. — oddiy rad etish
+            return super().log_exception(typ, value, tb)
+        log.error("Webhook so'rovini qayta ishlashda xato", exc_info=(typ, value, tb))
+
+
+class WebhookServer:
+    """POST qilingan JSON'ni tekshirib, `sink` korutinasiga uzatadi."""
+
+    def __init__(self, sink: Callable[[dict], Awaitable[None]], path: str = WEBHOOK_PATH,
+                 secret: Optional[str] = WEBHOOK_SECRET):
+        if not secret:
+            raise ValueError("WEBHOOK_SECRET not set: webhook mode refuses unauthenticated updates")
+        self.sink = sink
+        self.path = path
+        self.secret = secret
+        self.counters = {"accepted": 0, "rejected": 0}
+        self._http: Optional[tornado.httpserver.HTTPServer] = None
+
+    async def accept(self, given_secret: str, body: bytes) -> int:
+        """HTTP status: 200 faqat sink muvaffaqiyatli tugaganda."""
+        status = await self._accept(given_secret, body)
+        self.counters["accepted" if status == 200 else "rejected"] += 1
+        return status
+
+    async def _accept(self, given_secret: str, body: bytes) -> int:
+        if not hmac.compare_digest(given_secret.encode(), self.secret.encode()):
+            return 403
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return 400
+        if not isinstance(payload, dict) or "update_id" not in payload:
+            return 400
+        await self.sink(payload)
+        return 200
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counters)
+
+    async def start(self, host: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT):
+        app = tornado.web.Application([(self.path, _UpdateHandler, {"server": self})])
+        self._http = tornado.httpserver.HTTPServer(app, max_body_size=MAX_BODY)
+        self._http.listen(port, host)
+        log.info("Webhook %s:%s%s da tinglanmoqda", host, port, self.path)
+
+    async def stop(self):
+        if self._http is not None:
+            self._http.stop()
+            await self._http.close_all_connections()
+            self._http = None
+
+
+async def wait_for_stop_signal():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            signal.signal(sig, lambda *_: loop.call_soon_threadsafe(stop.set))
+    await stop.wait()
+
+
+async def _serve(app: Application):
+    async def enqueue(payload: dict):
+        await app.update_queue.put(Update.de_json(payload, app.bot))
+
+    server = WebhookServer(enqueue)
+    metrics.register("webhook", server.stats)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    try:
+        if WEBHOOK_URL:
+            await app.bot.set_webhook(
+                url=WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        await app.start()
+        await server.start()
+        await wait_for_stop_signal()
+    finally:
+        await server.stop()
+        if app.running:
+            await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+def run_webhook(app: Application):
+    """app.run_polling() o'rniga: webhook serverini ishga tushiradi."""
+    asyncio.run(_serve(app))